@@ -1,9 +1,22 @@
 import json
 import logging
+import os
+import sys
 import yaml
-from pykafka import KafkaClient
+import threading
+import time
+from kafka import TopicPartition
+from event_index import EventIndex
+import column_store
+from shared import wire_format
+from shared.health import READINESS, add_health_routes, retry_forever, start_thread
+from shared.kafka_pool import get_pool, partition_lag
+from shared.response_cache import create_cache, etag
+from shared.metrics import instrument_app, callback_metric, register_cache, LATENCY_BUCKETS
+from shared.spec_cache import load_spec
+from prometheus_client import Counter, Gauge, Histogram
 import connexion
-from flask import request  # Still used internally by Connexion
+from flask import request, Response, jsonify  # Still used internally by Connexion
 
 # Load configuration from a YAML file
 def load_config():
@@ -22,25 +35,188 @@ def setup_logging():
 CONFIG = load_config()
 logger = setup_logging()
 
+EVENT_TYPES = ("listing_event", "transaction_event")
+
+# Index of event number -> (partition, offset), kept up to date by the indexer thread
+EVENT_INDEX = EventIndex(EVENT_TYPES)
+
+INDEX_CHECKPOINT_DIR = CONFIG.get("index", {}).get("checkpoint_dir", "index")
+INDEX_CHECKPOINT_INTERVAL_S = CONFIG.get("index", {}).get("checkpoint_interval_s", 10)
+
+kafka_pool = get_pool(CONFIG["kafka"])
+fetch_consumer = None  # consumer used to read single messages, guarded by fetch_lock
+fetch_lock = threading.Lock()
+
+# Events never change once written, so decoded lookups can be cached for as long as they fit
+CACHE_CONFIG = CONFIG.get("cache", {})
+response_cache = create_cache(CACHE_CONFIG, prefix="analyzer:") if CACHE_CONFIG.get("enabled", True) else None
+
+# Metrics, served at /metrics
+INDEXED = Counter("analyzer_indexed_messages", "Messages read by the indexer")
+INDEXER_LAG = Gauge("analyzer_indexer_lag", "Messages behind the high watermark, per partition", ["partition"])
+FETCH_LATENCY = Histogram("analyzer_fetch_message_seconds", "Seek and read of a single event from Kafka",
+                          buckets=LATENCY_BUCKETS)
+callback_metric("analyzer_indexed_events", "Events in the index by type",
+                lambda: {(event_type,): EVENT_INDEX.count(event_type) for event_type in EVENT_TYPES}, labels=["event_type"])
+register_cache(response_cache)
+
+# Analytics run over an in-memory column store of the events of the last
+# retention_hours, filled by its own consumer (see load_column_store)
+ANALYTICS_CONFIG = CONFIG.get("analytics", {})
+ANALYTICS_RETENTION_US = int(ANALYTICS_CONFIG.get("retention_hours", 24) * 3600 * 1000000)
+ANALYTICS_MAX_ROWS = ANALYTICS_CONFIG.get("max_rows_per_type", 5000000)
+ANALYTICS_COMPACT_INTERVAL_S = ANALYTICS_CONFIG.get("compact_interval_s", 60)
+VALUE_FIELDS = {"listing_event": "price", "transaction_event": "amount"}
+COLUMN_STORE = None
+if ANALYTICS_CONFIG.get("enabled", True):
+    if column_store.np is None:
+        logger.warning("numpy is not installed, analytics endpoints are disabled")
+    else:
+        COLUMN_STORE = column_store.ColumnStore(VALUE_FIELDS)
+        callback_metric("analyzer_analytics_rows", "Events held in the analytics column store by type",
+                        lambda: {(event_type,): count for event_type, count in COLUMN_STORE.counts().items()},
+                        labels=["event_type"])
+        callback_metric("analyzer_analytics_bytes", "Memory allocated by the analytics column store",
+                        COLUMN_STORE.memory_bytes)
+
+def connect_consumer(name, **overrides):
+    """Consumer assigned to every partition of the topic, retrying until Kafka has its metadata."""
+    def connect():
+        consumer = kafka_pool.consumer(group_id=None, enable_auto_commit=False, **overrides)
+        partitions = consumer.partitions_for_topic(kafka_pool.topic)
+        if not partitions:
+            consumer.close()
+            raise RuntimeError(f"no metadata for topic {kafka_pool.topic} yet")
+        assignment = [TopicPartition(kafka_pool.topic, partition) for partition in sorted(partitions)]
+        consumer.assign(assignment)
+        return consumer, assignment
+    return retry_forever(name, connect)
+
+def index_events():
+    """Tail the topic and record where each event lives, resuming from the last checkpoint."""
+    if EVENT_INDEX.load(INDEX_CHECKPOINT_DIR):
+        logger.info(f"Resuming event index from checkpoint at offset {EVENT_INDEX.as_of_offset()}")
+    consumer, assignment = connect_consumer("kafka-indexer")
+    next_offsets = EVENT_INDEX.next_offsets()
+    for tp in assignment:
+        if tp.partition in next_offsets:
+            consumer.seek(tp, next_offsets[tp.partition])
+        else:
+            consumer.seek_to_beginning(tp)
+
+    logger.info("Event indexer started")
+    last_checkpoint = time.monotonic()
+    while True:
+        records = consumer.poll(timeout_ms=1000)  # wake up periodically to checkpoint while idle
+        for tp, messages in records.items():
+            INDEXED.inc(len(messages))
+            for msg in messages:
+                try:
+                    event_type = wire_format.event_type(msg.value)
+                except ValueError:
+                    event_type = None
+                EVENT_INDEX.add(event_type, tp.partition, msg.offset)
+        for partition, lag in partition_lag(consumer).items():
+            INDEXER_LAG.labels(partition).set(lag)
+        if time.monotonic() - last_checkpoint >= INDEX_CHECKPOINT_INTERVAL_S:
+            try:
+                EVENT_INDEX.save(INDEX_CHECKPOINT_DIR)
+            except OSError as e:
+                logger.error(f"Failed to checkpoint event index: {e}")
+            last_checkpoint = time.monotonic()
+
+def setup_indexer_thread():
+    start_thread("event-indexer", index_events)
+
+def now_micros():
+    return time.time_ns() // 1000
+
+def load_column_store():
+    """Fill the column store with the events of the retention window, then keep tailing the topic.
+
+    On startup each partition is sought to the first message produced
+    within the retention window, so the store does not depend on the
+    index checkpoint and is rebuilt after a restart.
+    """
+    consumer, assignment = connect_consumer("kafka-analytics", max_poll_records=5000)
+    since_ms = (now_micros() - ANALYTICS_RETENTION_US) // 1000
+    for tp, found in consumer.offsets_for_times({tp: since_ms for tp in assignment}).items():
+        if found is not None:
+            consumer.seek(tp, found.offset)
+        else:
+            consumer.seek_to_end(tp)  # nothing produced within the window
+
+    logger.info("Analytics loader started")
+    last_compaction = time.monotonic()
+    while True:
+        records = consumer.poll(timeout_ms=1000)
+        # Gather each poll into plain lists per event type and append them as one chunk
+        chunks = {event_type: ([], [], []) for event_type in VALUE_FIELDS}
+        for messages in records.values():
+            for msg in messages:
+                try:
+                    envelope = wire_format.decode(msg.value)
+                    chunk = chunks.get(envelope.get("type"))
+                    if chunk is None:
+                        continue
+                    payload = envelope["payload"]
+                    value = float(payload[VALUE_FIELDS[envelope["type"]]])
+                    timestamp = wire_format.to_micros(payload["timestamp"])
+                    user_id = payload["user_id"]
+                    hash(user_id)  # users are keyed by id in the column store; a list or object cannot be one
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    logger.warning(f"Skipping undecodable message at offset {msg.offset}: {e}")
+                    continue
+                # Only append once every field decoded, so the columns stay the same length
+                chunk[0].append(timestamp)
+                chunk[1].append(user_id)
+                chunk[2].append(value)
+        for event_type, (timestamps, user_ids, values) in chunks.items():
+            COLUMN_STORE.append(event_type, timestamps, user_ids, values)
+
+        if time.monotonic() - last_compaction >= ANALYTICS_COMPACT_INTERVAL_S:
+            removed = COLUMN_STORE.compact(now_micros() - ANALYTICS_RETENTION_US, ANALYTICS_MAX_ROWS)
+            if any(removed.values()):
+                logger.info(f"Analytics compaction removed {removed}")
+            last_compaction = time.monotonic()
+
+def setup_column_store_thread():
+    start_thread("analytics-loader", load_column_store)
+
+def fetch_message(partition, offset):
+    """Read the single message at partition/offset."""
+    global fetch_consumer
+    with fetch_lock, FETCH_LATENCY.time():
+        if fetch_consumer is None:
+            fetch_consumer = kafka_pool.consumer(group_id=None, enable_auto_commit=False)
+        tp = TopicPartition(kafka_pool.topic, partition)
+        fetch_consumer.assign([tp])
+        fetch_consumer.seek(tp, offset)
+        deadline = time.monotonic() + 1
+        while time.monotonic() < deadline:
+            for msg in fetch_consumer.poll(timeout_ms=100, max_records=1).get(tp, []):
+                if msg.offset == offset:
+                    return msg
+        return None
+
 # Function to get event from Kafka by index
 def get_event_by_index(event_type, index):
     try:
-        client = KafkaClient(hosts=CONFIG["kafka"]["hostname"])
-        topic = client.topics[CONFIG["kafka"]["topic"].encode()]
-        consumer = topic.get_simple_consumer(reset_offset_on_start=True, consumer_timeout_ms=1000)
-
         logger.info(f"Fetching {event_type} event with index {index} from Kafka")
 
-        counter = 0
-        for msg in consumer:
-            if msg is None:
-                continue
-            data = json.loads(msg.value.decode("utf-8"))
-
-            if data.get("type") == event_type:  # <-- FIXED: matches what Receiver sends
-                if counter == index:
-                    return data, 200
-                counter += 1
+        cache_key = f"{event_type}|{index}"
+        body = response_cache.get(cache_key) if response_cache else None
+        if body is None:
+            position = EVENT_INDEX.lookup(event_type, index)
+            msg = fetch_message(*position) if position is not None else None
+            if msg is not None:
+                body = json.dumps(wire_format.decode(msg.value)).encode("utf-8")
+                if response_cache:
+                    response_cache.set(cache_key, body)
+        if body is not None:
+            response = Response(body, mimetype="application/json")
+            response.set_etag(etag(body))
+            return response.make_conditional(request)
 
         logger.warning(f"No {event_type} event found at index {index}")
         return {"message": f"No {event_type} event at index {index}!"}, 404
@@ -62,34 +238,88 @@ def get_transaction_event():
     return get_event_by_index("transaction_event", int(index))  # <-- FIXED type
 
 def get_event_stats():
+    # Counts are maintained by the indexer thread as messages arrive
+    return {
+        "num_listing_events": EVENT_INDEX.count("listing_event"),
+        "num_transaction_events": EVENT_INDEX.count("transaction_event"),
+        "as_of_offset": EVENT_INDEX.as_of_offset()
+    }, 200
+
+def analytics_window():
+    """(event type, start, end) from the query string; start/end as microseconds, None if not given."""
+    event_type = request.args.get("event_type", "transaction_event")
+    if event_type not in VALUE_FIELDS:
+        raise ValueError(f"'event_type' must be one of {', '.join(VALUE_FIELDS)}")
+    try:
+        start, end = (wire_format.to_micros(request.args[name]) if name in request.args else None
+                      for name in ("start_timestamp", "end_timestamp"))
+    except ValueError:
+        raise ValueError("Invalid timestamp format")
+    return event_type, start, end
+
+def analytics_query(compute):
+    """Run compute(event_type, start, end) and wrap its result with the window it covers."""
+    if COLUMN_STORE is None:
+        return {"message": "Analytics are disabled (analytics.enabled is off or numpy is missing)"}, 501
     try:
-        client = KafkaClient(hosts=CONFIG["kafka"]["hostname"])
-        topic = client.topics[CONFIG["kafka"]["topic"].encode()]
-        consumer = topic.get_simple_consumer(reset_offset_on_start=True, consumer_timeout_ms=1000)
+        event_type, start, end = analytics_window()
+        result = compute(event_type, start, end)
+    except ValueError as e:
+        return {"message": str(e)}, 400
+    oldest = COLUMN_STORE.columns[event_type].oldest()
+    result.update({
+        "event_type": event_type,
+        "start_timestamp": request.args.get("start_timestamp"),
+        "end_timestamp": request.args.get("end_timestamp"),
+        # Events before this are no longer (or not yet) in the store
+        "retained_from": wire_format.from_micros(oldest) if oldest is not None else None,
+    })
+    return result, 200
 
-        listing_count = 0
-        transaction_count = 0
+def get_value_histogram():
+    bins = request.args.get("bins", 20, type=int)
+    low = request.args.get("low", type=float)
+    high = request.args.get("high", type=float)
+    if not 1 <= bins <= 1000:
+        return {"message": "'bins' must be between 1 and 1000"}, 400
+    return analytics_query(lambda event_type, start, end:
+                           COLUMN_STORE.histogram(event_type, start, end, bins, low, high))
 
-        for msg in consumer:
-            data = json.loads(msg.value.decode("utf-8"))
-            if data.get("type") == "listing_event":
-                listing_count += 1
-            elif data.get("type") == "transaction_event":
-                transaction_count += 1
+def get_top_users():
+    limit = request.args.get("limit", 10, type=int)
+    by = request.args.get("by", "total")
+    if not 1 <= limit <= 1000:
+        return {"message": "'limit' must be between 1 and 1000"}, 400
+    if by not in ("total", "count"):
+        return {"message": "'by' must be total or count"}, 400
+    return analytics_query(lambda event_type, start, end:
+                           {"users": COLUMN_STORE.top_users(event_type, start, end, limit, by)})
 
-        return {
-            "num_listing_events": listing_count,
-            "num_transaction_events": transaction_count
-        }, 200
+def get_user_totals():
+    user_ids = request.args.getlist("user_id")
+    if not user_ids or len(user_ids) > 1000:
+        return {"message": "Between 1 and 1000 'user_id' parameters are required"}, 400
+    return analytics_query(lambda event_type, start, end:
+                           {"users": COLUMN_STORE.totals_for_users(event_type, user_ids, start, end)})
 
-    except Exception as e:
-        logger.error(f"Error while fetching event stats: {str(e)}")
-        return {"message": "Internal Server Error"}, 500
+def cache_stats():
+    return jsonify(response_cache.info() if response_cache else {"enabled": False})
 
 # Connexion app setup
+# Run as a script this module is __main__; let the spec's app.<handler> operationIds resolve
+# to it instead of importing app.py a second time (which registers every metric twice)
+sys.modules.setdefault('app', sys.modules[__name__])
 app = connexion.App(__name__, specification_dir='.')
-app.add_api("openapi.yaml")
+app.add_api(load_spec(os.path.join(os.path.dirname(os.path.abspath(__file__)), "openapi.yaml")))
+app.app.add_url_rule("/cache/stats", "cache_stats", cache_stats)
+instrument_app(app.app)
+add_health_routes(app.app)
 
 if __name__ == "__main__":
     logger.info("Starting Connexion analyzer app")
+    READINESS.register("kafka-indexer")
+    setup_indexer_thread()
+    if COLUMN_STORE is not None:
+        READINESS.register("kafka-analytics")
+        setup_column_store_thread()
     app.run(port=8081, host="0.0.0.0")
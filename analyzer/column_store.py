@@ -0,0 +1,202 @@
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class EventColumns:
+    """Column-oriented copy of the recent events of one type.
+
+    Each event is kept as three entries in parallel numpy arrays: its
+    timestamp (int64 microseconds since the epoch), its user (int32 code
+    into a dictionary of user ids) and its value (float64 price or
+    amount), i.e. 20 bytes per event. The arrays are preallocated and
+    doubled when full. Appends only write past the current length and
+    compaction builds new arrays, so a reader can take views of the first
+    n rows under the lock and compute on them without holding it.
+    """
+
+    def __init__(self, initial_capacity=65536):
+        self._lock = threading.Lock()
+        self._timestamps = np.empty(initial_capacity, dtype=np.int64)
+        self._users = np.empty(initial_capacity, dtype=np.int32)
+        self._values = np.empty(initial_capacity, dtype=np.float64)
+        self._length = 0
+        self._user_codes = {}  # user id -> code
+        self._user_ids = []    # code -> user id
+
+    def __len__(self):
+        return self._length
+
+    def append(self, timestamps, user_ids, values):
+        """Append a chunk of events given as three equally long sequences."""
+        count = len(timestamps)
+        if not count:
+            return
+        with self._lock:
+            codes = np.fromiter((self._user_code(user_id) for user_id in user_ids), dtype=np.int32, count=count)
+            end = self._length + count
+            if end > len(self._timestamps):
+                self._grow(end)
+            self._timestamps[self._length:end] = timestamps
+            self._users[self._length:end] = codes
+            self._values[self._length:end] = values
+            self._length = end
+
+    def _user_code(self, user_id):
+        code = self._user_codes.get(user_id)
+        if code is None:
+            code = self._user_codes[user_id] = len(self._user_ids)
+            self._user_ids.append(user_id)
+        return code
+
+    def _grow(self, needed):
+        capacity = max(needed, 2 * len(self._timestamps))
+        for name in ('_timestamps', '_users', '_values'):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._length] = column[:self._length]
+            setattr(self, name, grown)
+
+    def compact(self, min_timestamp, max_rows=None):
+        """Drop events older than min_timestamp, and the oldest events beyond max_rows.
+
+        Users with no events left are dropped from the dictionary. Returns
+        the number of events removed.
+        """
+        with self._lock:
+            n = self._length
+            keep = self._timestamps[:n] >= min_timestamp
+            if max_rows is not None and np.count_nonzero(keep) > max_rows:
+                cutoff = np.partition(self._timestamps[:n][keep], -max_rows)[-max_rows]
+                keep &= self._timestamps[:n] >= cutoff
+            removed = n - int(np.count_nonzero(keep))
+            if not removed:
+                return 0
+
+            timestamps, users, values = self._timestamps[:n][keep], self._users[:n][keep], self._values[:n][keep]
+            used, users = np.unique(users, return_inverse=True)
+            self._user_ids = [self._user_ids[code] for code in used]
+            self._user_codes = {user_id: code for code, user_id in enumerate(self._user_ids)}
+
+            capacity = max(len(timestamps) * 2, 1024)
+            self._timestamps = np.empty(capacity, dtype=np.int64)
+            self._users = np.empty(capacity, dtype=np.int32)
+            self._values = np.empty(capacity, dtype=np.float64)
+            self._timestamps[:len(timestamps)] = timestamps
+            self._users[:len(timestamps)] = users
+            self._values[:len(timestamps)] = values
+            self._length = len(timestamps)
+            return removed
+
+    def snapshot(self, start=None, end=None):
+        """(timestamps, user codes, values, user id list) of the events with start <= timestamp < end."""
+        with self._lock:
+            n = self._length
+            timestamps, users, values = self._timestamps[:n], self._users[:n], self._values[:n]
+            user_ids = self._user_ids
+        if start is None and end is None:
+            return timestamps, users, values, user_ids
+        mask = np.ones(n, dtype=bool)
+        if start is not None:
+            mask &= timestamps >= start
+        if end is not None:
+            mask &= timestamps < end
+        return timestamps[mask], users[mask], values[mask], user_ids
+
+    def memory_bytes(self):
+        return self._timestamps.nbytes + self._users.nbytes + self._values.nbytes
+
+    def oldest(self):
+        with self._lock:
+            return int(self._timestamps[:self._length].min()) if self._length else None
+
+
+class ColumnStore:
+    """EventColumns for each event type, plus the analytics queries over them.
+
+    `value_fields` maps each event type to the payload field stored as its
+    value (price for listings, amount for transactions).
+    """
+
+    def __init__(self, value_fields):
+        if np is None:
+            raise RuntimeError("The analytics column store requires the numpy package")
+        self.value_fields = dict(value_fields)
+        self.columns = {event_type: EventColumns() for event_type in self.value_fields}
+
+    def append(self, event_type, timestamps, user_ids, values):
+        self.columns[event_type].append(timestamps, user_ids, values)
+
+    def compact(self, min_timestamp, max_rows=None):
+        return {event_type: columns.compact(min_timestamp, max_rows)
+                for event_type, columns in self.columns.items()}
+
+    def counts(self):
+        return {event_type: len(columns) for event_type, columns in self.columns.items()}
+
+    def memory_bytes(self):
+        return sum(columns.memory_bytes() for columns in self.columns.values())
+
+    def oldest(self):
+        timestamps = [t for t in (columns.oldest() for columns in self.columns.values()) if t is not None]
+        return min(timestamps) if timestamps else None
+
+    def histogram(self, event_type, start=None, end=None, bins=20, low=None, high=None):
+        """Distribution of the event values in `bins` equal-width bins over [low, high]."""
+        _, _, values, _ = self.columns[event_type].snapshot(start, end)
+        if low is None:
+            low = float(values.min()) if len(values) else 0.0
+        if high is None:
+            high = float(values.max()) if len(values) else 0.0
+        if high <= low:
+            high = low + 1.0
+        counts, edges = np.histogram(values, bins=bins, range=(low, high))
+        return {
+            "count": int(len(values)),
+            "edges": edges.tolist(),
+            "counts": counts.tolist(),
+        }
+
+    def user_totals(self, event_type, start=None, end=None):
+        """(user id list, event count per user code, value total per user code) over the time range."""
+        _, users, values, user_ids = self.columns[event_type].snapshot(start, end)
+        counts = np.bincount(users, minlength=len(user_ids))
+        totals = np.bincount(users, weights=values, minlength=len(user_ids))
+        return user_ids, counts, totals
+
+    def top_users(self, event_type, start=None, end=None, limit=10, by="total"):
+        """The `limit` users with the highest value total (or event count) over the time range."""
+        user_ids, counts, totals = self.user_totals(event_type, start, end)
+        ranking = totals if by == "total" else counts
+        active = np.flatnonzero(counts)
+        if len(active) > limit:
+            # Only sort the candidates, not every user
+            active = active[np.argpartition(ranking[active], -limit)[-limit:]]
+        order = active[np.argsort(-ranking[active], kind="stable")]
+        return [_user_row(user_ids, counts, totals, code) for code in order]
+
+    def totals_for_users(self, event_type, wanted, start=None, end=None):
+        """Count and value total for each of the `wanted` user ids (zero if they have no events)."""
+        user_ids, counts, totals = self.user_totals(event_type, start, end)
+        codes = {user_id: code for code, user_id in enumerate(user_ids)}
+        rows = []
+        for user_id in wanted:
+            code = codes.get(user_id)
+            if code is None or code >= len(counts):
+                rows.append({"user_id": user_id, "count": 0, "total": 0.0, "average": None})
+            else:
+                rows.append(_user_row(user_ids, counts, totals, code))
+        return rows
+
+
+def _user_row(user_ids, counts, totals, code):
+    count, total = int(counts[code]), float(totals[code])
+    return {
+        "user_id": user_ids[code],
+        "count": count,
+        "total": total,
+        "average": total / count if count else None,
+    }
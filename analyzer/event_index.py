@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+from array import array
+
+
+class EventIndex:
+    """Maps the n-th event of each type to its (partition, offset) in Kafka.
+
+    Positions are kept in two parallel typed arrays per event type (4 bytes
+    per partition, 8 bytes per offset), so millions of events fit in a few
+    megabytes and a lookup is a plain array access.
+    """
+
+    def __init__(self, event_types):
+        self._lock = threading.Lock()
+        self._partitions = {event_type: array('i') for event_type in event_types}
+        self._offsets = {event_type: array('q') for event_type in event_types}
+        self._next_offsets = {}  # partition -> next offset the indexer will read
+        self._saved = None  # (directory, header) of the last checkpoint written or loaded
+
+    def add(self, event_type, partition, offset):
+        with self._lock:
+            if offset < self._next_offsets.get(partition, 0):
+                return  # already indexed (redelivered after resuming from a checkpoint)
+            if event_type in self._partitions:
+                self._partitions[event_type].append(partition)
+                self._offsets[event_type].append(offset)
+            self._next_offsets[partition] = offset + 1
+
+    def lookup(self, event_type, index):
+        """Return (partition, offset) of the event, or None if it is not indexed (yet)."""
+        with self._lock:
+            offsets = self._offsets[event_type]
+            if index >= len(offsets):
+                return None
+            return self._partitions[event_type][index], offsets[index]
+
+    def count(self, event_type):
+        with self._lock:
+            return len(self._offsets[event_type])
+
+    def next_offsets(self):
+        with self._lock:
+            return dict(self._next_offsets)
+
+    def as_of_offset(self):
+        """Highest offset indexed so far across all partitions, or None if nothing is indexed."""
+        with self._lock:
+            return max(self._next_offsets.values()) - 1 if self._next_offsets else None
+
+    def save(self, directory):
+        """Checkpoint the index to directory. Returns False if nothing changed since the last checkpoint.
+
+        The arrays only ever grow, so they are written first and the small
+        JSON header with the counts and offsets is renamed into place last.
+        A crash in between leaves the old header, which only covers a
+        prefix of the (newer) arrays. After the first checkpoint only the
+        entries added since are appended, to files cut back to the saved
+        length first (dropping the tail of an interrupted save).
+        """
+        with self._lock:
+            header = {
+                "next_offsets": {str(p): o for p, o in self._next_offsets.items()},
+                "counts": {t: len(o) for t, o in self._offsets.items()},
+            }
+            if self._saved == (directory, header):
+                return False
+            saved_counts = self._saved[1]["counts"] if self._saved and self._saved[0] == directory else {}
+            writes = []  # (path, start byte or None to rewrite the file, data)
+            for event_type in self._offsets:
+                for suffix, values in (("partitions", self._partitions[event_type]),
+                                       ("offsets", self._offsets[event_type])):
+                    path = os.path.join(directory, f"{event_type}.{suffix}")
+                    start = saved_counts.get(event_type)
+                    if start is not None and _size(path) >= start * values.itemsize:
+                        writes.append((path, start * values.itemsize, values[start:].tobytes()))
+                    else:
+                        writes.append((path, None, values.tobytes()))
+
+        os.makedirs(directory, exist_ok=True)
+        for path, start, data in writes:
+            if start is None:
+                _write_atomic(path, data)
+            else:
+                _write_tail(path, start, data)
+        _write_atomic(os.path.join(directory, "index.json"), json.dumps(header).encode("utf-8"))
+        with self._lock:
+            self._saved = (directory, header)
+        return True
+
+    def load(self, directory):
+        """Restore a checkpoint written by save(). Returns False if there is none."""
+        try:
+            with open(os.path.join(directory, "index.json"), "rb") as f:
+                header = json.loads(f.read())
+            arrays = {}
+            for event_type, count in header["counts"].items():
+                partitions, offsets = array('i'), array('q')
+                with open(os.path.join(directory, f"{event_type}.partitions"), "rb") as f:
+                    partitions.frombytes(f.read())
+                with open(os.path.join(directory, f"{event_type}.offsets"), "rb") as f:
+                    offsets.frombytes(f.read())
+                if len(partitions) < count or len(offsets) < count:
+                    raise ValueError(f"{event_type} arrays are shorter than the checkpoint header")
+                arrays[event_type] = (partitions[:count], offsets[:count])
+        except FileNotFoundError:
+            return False
+
+        with self._lock:
+            for event_type, (partitions, offsets) in arrays.items():
+                if event_type in self._partitions:
+                    self._partitions[event_type] = partitions
+                    self._offsets[event_type] = offsets
+            self._next_offsets = {int(p): o for p, o in header["next_offsets"].items()}
+            self._saved = (directory, header)
+        return True
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return -1
+
+
+def _write_tail(path, start, data):
+    """Cut the file at byte `start` and append data there."""
+    with open(path, "r+b") as f:
+        f.truncate(start)
+        f.seek(start)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
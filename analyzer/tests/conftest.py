@@ -0,0 +1,5 @@
+import os
+import sys
+
+ANALYZER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ANALYZER_DIR, os.path.dirname(ANALYZER_DIR)]
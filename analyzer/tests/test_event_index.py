@@ -0,0 +1,61 @@
+"""The event index checkpoint must restore the same positions after incremental saves."""
+from event_index import EventIndex
+
+TYPES = ('listing_event', 'transaction_event')
+
+
+def fill(index, events):
+    for event_type, partition, offset in events:
+        index.add(event_type, partition, offset)
+
+
+def positions(index):
+    return {t: [index.lookup(t, i) for i in range(index.count(t))] for t in TYPES}
+
+
+def test_save_append_and_reload(tmp_path):
+    index = EventIndex(TYPES)
+    fill(index, [('listing_event', 0, 0), ('transaction_event', 1, 0), ('listing_event', 0, 1)])
+    assert index.save(str(tmp_path))
+    assert not index.save(str(tmp_path))  # unchanged
+
+    fill(index, [('listing_event', 1, 1), ('transaction_event', 0, 2), ('other_event', 0, 3)])
+    assert index.save(str(tmp_path))  # appends the new tail
+
+    reloaded = EventIndex(TYPES)
+    assert reloaded.load(str(tmp_path))
+    assert positions(reloaded) == positions(index) == {
+        'listing_event': [(0, 0), (0, 1), (1, 1)],
+        'transaction_event': [(1, 0), (0, 2)],
+    }
+    assert reloaded.next_offsets() == {0: 4, 1: 2}
+
+    # Redelivered messages are ignored; new ones continue after the checkpoint
+    fill(reloaded, [('listing_event', 0, 1), ('listing_event', 0, 4)])
+    assert reloaded.lookup('listing_event', 3) == (0, 4)
+    assert reloaded.count('listing_event') == 4
+
+
+def test_interrupted_save_keeps_the_previous_checkpoint(tmp_path):
+    index = EventIndex(TYPES)
+    fill(index, [('listing_event', 0, 0), ('listing_event', 0, 1)])
+    index.save(str(tmp_path))
+    # Arrays written but the header never renamed into place
+    with open(tmp_path / 'listing_event.offsets', 'ab') as f:
+        f.write(b'\x07' * 8)
+    with open(tmp_path / 'listing_event.partitions', 'ab') as f:
+        f.write(b'\x00' * 4)
+
+    reloaded = EventIndex(TYPES)
+    assert reloaded.load(str(tmp_path))
+    assert reloaded.count('listing_event') == 2
+    fill(reloaded, [('listing_event', 0, 2)])
+    assert reloaded.save(str(tmp_path))
+
+    again = EventIndex(TYPES)
+    again.load(str(tmp_path))
+    assert positions(again)['listing_event'] == [(0, 0), (0, 1), (0, 2)]
+
+
+def test_missing_checkpoint(tmp_path):
+    assert not EventIndex(TYPES).load(str(tmp_path / 'none'))
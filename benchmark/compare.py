@@ -0,0 +1,66 @@
+"""Compare two benchmark reports.
+
+    python -m benchmark.compare BASELINE.json CURRENT.json [--threshold 10]
+
+Prints the change of each headline metric and exits with status 1 if any
+of them regressed by more than the threshold (in percent).
+"""
+import argparse
+import json
+import sys
+
+# (label, path in the report, True if higher is better)
+METRICS = (
+    ("receiver req/s", ("receiver", "requests_per_s"), True),
+    ("receiver accepted events/s", ("receiver", "accepted_events_per_s"), True),
+    ("receiver p50 ms", ("receiver", "latency", "p50_ms"), False),
+    ("receiver p99 ms", ("receiver", "latency", "p99_ms"), False),
+    ("storage visible p50 ms", ("pipeline", "storage", "visible_latency", "p50_ms"), False),
+    ("storage visible p99 ms", ("pipeline", "storage", "visible_latency", "p99_ms"), False),
+    ("storage drain s", ("pipeline", "storage", "drain_s"), False),
+    ("processing drain s", ("pipeline", "processing", "drain_s"), False),
+    ("analyzer drain s", ("pipeline", "analyzer", "drain_s"), False),
+)
+
+
+def lookup(report, path):
+    for key in path:
+        if not isinstance(report, dict) or key not in report:
+            return None
+        report = report[key]
+    return report
+
+
+def compare(baseline, current, threshold_pct):
+    """[(label, baseline, current, change in percent, regressed)] for the metrics in both reports."""
+    rows = []
+    for label, path, higher_is_better in METRICS:
+        before, after = lookup(baseline, path), lookup(current, path)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        regressed = (-change if higher_is_better else change) > threshold_pct
+        rows.append((label, before, after, change, regressed))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed regression in percent")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    rows = compare(baseline, current, args.threshold)
+    for label, before, after, change, regressed in rows:
+        print(f"{label:<28} {before:>12} {after:>12} {change:>+8.1f}%{'  REGRESSED' if regressed else ''}")
+    return 1 if any(row[4] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import logging
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger('basicLogger')
+
+# event type -> (single endpoint, batch endpoint)
+ENDPOINTS = {
+    'listing': ('/events/listings', '/events/listings/batch'),
+    'transaction': ('/events/transactions', '/events/transactions/batch'),
+}
+
+
+def listing_payload(rng, users, timestamp):
+    return {
+        "trace_id": str(uuid.uuid4()),
+        "user_id": f"user{rng.randint(1, users)}",
+        "item_id": f"item{rng.randint(1, 100000)}",
+        "price": round(rng.uniform(1, 500), 2),
+        "timestamp": timestamp,
+    }
+
+
+def transaction_payload(rng, users, timestamp):
+    return {
+        "trace_id": str(uuid.uuid4()),
+        "user_id": f"user{rng.randint(1, users)}",
+        "transaction_id": f"txn{rng.randint(1, 10**9)}",
+        "amount": round(rng.uniform(1, 1000), 2),
+        "timestamp": timestamp,
+    }
+
+
+PAYLOADS = {'listing': listing_payload, 'transaction': transaction_payload}
+
+
+def utc_timestamp():
+    """Event timestamp in the format the receiver accepts (RFC 3339, UTC)."""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies_s):
+    """p50/p90/p99/max/mean in milliseconds of a list of latencies in seconds."""
+    values = sorted(latencies_s)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p90_ms": round(percentile(values, 90) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3),
+    }
+
+
+class LoadGenerator:
+    """Drives the receiver endpoints with a weighted mix of events.
+
+    With a target `rate` (requests per second) the load is open-loop: request
+    i is due at start + i / rate whatever happened to earlier requests, and
+    its latency is measured from that due time. A slow receiver therefore
+    shows up as queueing delay in the percentiles instead of quietly lowering
+    the offered load. With rate 0 the workers send back to back.
+
+    The first event of every `probe_every`-th request is handed to
+    `on_probe` so the pipeline stages can be timed end to end.
+    """
+
+    def __init__(self, client, mix, rate, concurrency, duration_s, batch_size=0,
+                 users=1000, probe_every=0, on_probe=None, seed=None):
+        self.client = client
+        self.event_types = list(mix)
+        self.weights = [mix[event_type] for event_type in self.event_types]
+        self.rate = rate
+        self.concurrency = concurrency
+        self.duration_s = duration_s
+        self.batch_size = batch_size
+        self.users = users
+        self.probe_every = probe_every
+        self.on_probe = on_probe
+        self.seed = seed
+
+        self._lock = threading.Lock()
+        self._next_request = 0
+        self.latencies = []
+        self.service_times = []
+        self.status_counts = {}
+        self.events = {"sent": 0, "accepted": 0, "duplicate": 0, "rejected": 0, "queued": 0, "failed": 0}
+        self.accepted_by_type = {event_type: 0 for event_type in self.event_types}
+
+    def _claim(self):
+        with self._lock:
+            index = self._next_request
+            self._next_request += 1
+            return index
+
+    def _worker(self, worker_id, started, deadline):
+        rng = random.Random(None if self.seed is None else self.seed + worker_id)
+        while True:
+            index = self._claim()
+            due = started + index / self.rate if self.rate else time.monotonic()
+            if due >= deadline:
+                return
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            event_type = rng.choices(self.event_types, self.weights)[0]
+            single, batch = ENDPOINTS[event_type]
+            count = self.batch_size or 1
+            items = [PAYLOADS[event_type](rng, self.users, utc_timestamp()) for _ in range(count)]
+
+            sent_at = time.monotonic()
+            try:
+                if self.batch_size:
+                    status, body = self.client.post(batch, items)
+                else:
+                    status, body = self.client.post(single, items[0])
+            except Exception as e:
+                logger.warning(f"Request to the receiver failed: {e}")
+                status, body = 'error', None
+            finished = time.monotonic()
+
+            outcome = self._outcome(status, body, count)
+            with self._lock:
+                self.latencies.append(finished - due)
+                self.service_times.append(finished - sent_at)
+                self.status_counts[str(status)] = self.status_counts.get(str(status), 0) + 1
+                self.events["sent"] += count
+                for key, value in outcome.items():
+                    self.events[key] += value
+                self.accepted_by_type[event_type] += outcome.get("accepted", 0)
+                probe = self.on_probe and self.probe_every and len(self.latencies) % self.probe_every == 0
+
+            # Probe with the first event of the request, if the receiver accepted it
+            if probe and (status == 201 or (self.batch_size and status in (200, 207)
+                                            and body["results"][0]["status"] == "accepted")):
+                self.on_probe(event_type, items[0], sent_at)
+
+    @staticmethod
+    def _outcome(status, body, count):
+        """Per-status event counts for one response."""
+        if status == 201:
+            return {"accepted": 1}
+        if status == 202:
+            return {"queued": 1}
+        if status in (200, 207) and body and "results" in body:
+            return {"accepted": body["accepted"], "duplicate": body["duplicates"],
+                    "rejected": body["rejected"] + body.get("shed", 0), "queued": body["queued"]}
+        if status == 200:
+            return {"duplicate": 1}
+        if status == 'error':
+            return {"failed": count}
+        return {"rejected": count}
+
+    def run(self):
+        """Run for duration_s and return the receiver-side results."""
+        started = time.monotonic()
+        deadline = started + self.duration_s
+        threads = [threading.Thread(target=self._worker, args=(i, started, deadline), daemon=True)
+                   for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        requests_sent = len(self.latencies)
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "requests": requests_sent,
+            "requests_per_s": round(requests_sent / elapsed, 2) if elapsed else None,
+            "events": dict(self.events),
+            "accepted_events_per_s": round(self.events["accepted"] / elapsed, 2) if elapsed else None,
+            "accepted_by_type": dict(self.accepted_by_type),
+            "status_counts": dict(self.status_counts),
+            "latency": summarize(self.latencies),
+            "service_time": summarize(self.service_times),
+        }
+
+
+def probe_window(payload):
+    """Naive UTC [start, end) query window that contains exactly the probe's timestamp."""
+    timestamp = datetime.fromisoformat(payload["timestamp"].replace('Z', '+00:00')).replace(tzinfo=None)
+    return timestamp.isoformat(), (timestamp + timedelta(milliseconds=1)).isoformat()
@@ -0,0 +1,164 @@
+import importlib.util
+import logging
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger('basicLogger')
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RecordMetadata = namedtuple('RecordMetadata', ['topic', 'partition', 'offset'])
+
+
+class InMemoryTopic:
+    """Append-only list of messages standing in for a single-partition Kafka topic."""
+
+    def __init__(self, name):
+        self.name = name
+        self._messages = []
+        self._appended = threading.Condition()
+
+    def append(self, value):
+        with self._appended:
+            self._messages.append(value)
+            self._appended.notify_all()
+            return len(self._messages) - 1
+
+    def read(self, offset, max_records, timeout_s):
+        """Messages from offset on, waiting up to timeout_s for the first one."""
+        with self._appended:
+            if offset >= len(self._messages):
+                self._appended.wait(timeout_s)
+            return self._messages[offset:offset + max_records]
+
+
+class _DeliveredFuture:
+    def __init__(self, metadata):
+        self.metadata = metadata
+
+    def get(self, timeout=None):
+        return self.metadata
+
+    def add_callback(self, f, *args, **kwargs):
+        f(*args, self.metadata, **kwargs)
+        return self
+
+    def add_errback(self, f, *args, **kwargs):
+        return self
+
+
+class InMemoryProducer:
+    """The part of KafkaProducer the services use; sends are delivered immediately."""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def send(self, topic, value=None, key=None):
+        offset = self.broker.topic_log(topic).append(value)
+        return _DeliveredFuture(RecordMetadata(topic, 0, offset))
+
+    def partitions_for(self, topic):
+        return {0}
+
+    def flush(self, timeout=None):
+        pass
+
+
+class InMemoryPool:
+    """Drop-in for shared.kafka_pool.KafkaPool backed by in-memory topics."""
+
+    def __init__(self, topic):
+        self.topic = topic
+        self.bootstrap_servers = 'in-memory'
+        self._topics = {}
+        self._lock = threading.Lock()
+        self._producer = InMemoryProducer(self)
+
+    def topic_log(self, name):
+        with self._lock:
+            if name not in self._topics:
+                self._topics[name] = InMemoryTopic(name)
+            return self._topics[name]
+
+    def producer(self, name='default', **overrides):
+        return self._producer
+
+    def close(self, timeout=None):
+        pass
+
+
+def _load_service(name):
+    """Import <name>/app.py as the module `app`, which its openapi.yaml operationIds refer to.
+
+    Connexion resolves the handlers while the module is being imported, so
+    the next service can take over the `app` name afterwards.
+    """
+    service_dir = os.path.join(REPO_ROOT, name)
+    if service_dir not in sys.path:
+        sys.path.insert(0, service_dir)
+    spec = importlib.util.spec_from_file_location('app', os.path.join(service_dir, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['app'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class LocalStack:
+    """Receiver and storage running in this process, joined by an in-memory topic.
+
+    The services read their usual /app/config/<service>/ files, so point
+    the storage datastore at SQLite (datastore.url) before using this. The
+    Kafka consumer of storage is replaced by a thread that decodes and
+    writes micro-batches with storage's own decode_event and write_batch,
+    using the same batch limits. Processing and the analyzer are not part
+    of the local stack.
+    """
+
+    def __init__(self):
+        if REPO_ROOT not in sys.path:
+            sys.path.insert(0, REPO_ROOT)
+        self.receiver = _load_service('receiver')
+        self.storage = _load_service('storage')
+
+        self.pool = InMemoryPool(self.receiver.kafka_topic)
+        self.receiver.kafka_pool = self.pool
+        self.storage.kafka_pool = self.pool
+        self.storage.init_db()
+
+        self._stopping = threading.Event()
+        self._consumer = threading.Thread(target=self._consume, daemon=True)
+
+    def start(self):
+        self._consumer.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self._consumer.join(5)
+
+    def _consume(self):
+        storage = self.storage
+        topic = self.pool.topic_log(self.storage.KAFKA_TOPIC)
+        offset = 0
+        while not self._stopping.is_set():
+            started = time.monotonic()
+            listings, transactions = [], []
+            while len(listings) + len(transactions) < storage.BATCH_MAX_ROWS:
+                remaining_s = storage.BATCH_MAX_WAIT_MS / 1000 - (time.monotonic() - started)
+                if remaining_s <= 0:
+                    break
+                messages = topic.read(offset, storage.BATCH_MAX_ROWS - len(listings) - len(transactions), remaining_s)
+                for value in messages:
+                    try:
+                        event = storage.decode_event(value)
+                    except storage.InvalidEvent as e:
+                        logger.warning(f"Skipping invalid event at offset {offset}: {e}")
+                        offset += 1
+                        continue
+                    (listings if type(event) is storage.ListingEvent else transactions).append(event)
+                    offset += 1
+            if listings or transactions:
+                storage.write_batch(listings, transactions)
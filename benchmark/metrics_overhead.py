@@ -0,0 +1,63 @@
+"""Measure what the /metrics instrumentation adds to the request path.
+
+    python -m benchmark.metrics_overhead [--requests 20000]
+
+Times a trivial Flask route with and without shared.metrics.instrument_app
+(interleaved rounds, best round wins), plus a bare histogram observation.
+"""
+import argparse
+import time
+
+from flask import Flask
+from prometheus_client import Histogram
+
+from shared.metrics import LATENCY_BUCKETS, instrument_app
+
+
+def make_app(instrumented):
+    app = Flask(f"overhead_{'instrumented' if instrumented else 'plain'}")
+    app.add_url_rule('/ping', 'ping', lambda: 'pong')
+    if instrumented:
+        instrument_app(app)
+    return app
+
+
+def time_requests(client, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        client.get('/ping')
+    return (time.perf_counter() - started) / count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Request-path overhead of the metrics instrumentation")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    plain = make_app(False).test_client()
+    instrumented = make_app(True).test_client()
+    time_requests(plain, 1000)  # warm up
+    time_requests(instrumented, 1000)
+
+    per_round = args.requests // args.rounds
+    plain_s, instrumented_s = [], []
+    for _ in range(args.rounds):
+        plain_s.append(time_requests(plain, per_round))
+        instrumented_s.append(time_requests(instrumented, per_round))
+
+    histogram = Histogram('overhead_probe_seconds', 'Overhead benchmark', buckets=LATENCY_BUCKETS)
+    started = time.perf_counter()
+    for _ in range(args.requests):
+        histogram.observe(0.001)
+    observe_s = (time.perf_counter() - started) / args.requests
+
+    base, with_metrics = min(plain_s), min(instrumented_s)
+    print(f"plain request:         {base * 1e6:8.1f} us")
+    print(f"instrumented request:  {with_metrics * 1e6:8.1f} us")
+    print(f"overhead per request:  {(with_metrics - base) * 1e6:8.1f} us ({(with_metrics - base) / base * 100:.1f}%)")
+    print(f"histogram observe():   {observe_s * 1e6:8.2f} us")
+
+
+if __name__ == "__main__":
+    main()
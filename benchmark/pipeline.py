@@ -0,0 +1,145 @@
+import json
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from benchmark.loadgen import probe_window, summarize
+
+logger = logging.getLogger('basicLogger')
+
+
+class HttpClient:
+    """JSON client for one service of a running deployment (e.g. docker-compose)."""
+
+    def __init__(self, base_url, pool_size=10, timeout_s=10):
+        self.base_url = base_url.rstrip('/')
+        self.timeout_s = timeout_s
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def post(self, path, body):
+        response = self.session.post(self.base_url + path, json=body, timeout=self.timeout_s)
+        return response.status_code, _json(response.content)
+
+    def get(self, path, params=None):
+        response = self.session.get(self.base_url + path, params=params, timeout=self.timeout_s)
+        return response.status_code, _json(response.content)
+
+
+class LocalClient:
+    """Same interface over a Flask test client, one per thread."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.flask_app.test_client()
+        return self._local.client
+
+    def post(self, path, body):
+        response = self._client().post(path, json=body)
+        return response.status_code, _json(response.data)
+
+    def get(self, path, params=None):
+        response = self._client().get(path, query_string=params)
+        return response.status_code, _json(response.data)
+
+
+def _json(content):
+    try:
+        return json.loads(content) if content else None
+    except ValueError:
+        return None
+
+
+class ProbeTracker:
+    """Times how long probe events take to become queryable in storage.
+
+    Covers receiver -> Kafka -> storage consumer -> database -> range query.
+    Each outstanding probe is looked up with a range query on a 1 ms window
+    around its timestamp every `poll_interval_s`, so the resolution of the
+    measurement is the poll interval.
+    """
+
+    def __init__(self, storage, poll_interval_s=0.05, timeout_s=30):
+        self.storage = storage
+        self.poll_interval_s = poll_interval_s
+        self.timeout_s = timeout_s
+        self._pending = []  # (event_type, trace_id, start, end, sent_at)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self.latencies = []
+        self.lost = 0
+
+    def add(self, event_type, payload, sent_at):
+        start, end = probe_window(payload)
+        with self._lock:
+            self._pending.append((event_type, payload["trace_id"], start, end, sent_at))
+
+    def start(self):
+        self._thread.start()
+
+    def _poll(self):
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if not pending and self._stopping.is_set():
+                return
+            for probe in pending:
+                event_type, trace_id, start, end, sent_at = probe
+                try:
+                    status, rows = self.storage.get(f"/events/{event_type}s",
+                                                    {"start_timestamp": start, "end_timestamp": end})
+                except Exception as e:
+                    logger.warning(f"Probe query failed: {e}")
+                    status, rows = None, None
+                now = time.monotonic()
+                found = status == 200 and any(row.get("trace_id") == trace_id for row in rows or ())
+                if found or now - sent_at > self.timeout_s:
+                    with self._lock:
+                        self._pending.remove(probe)
+                        if found:
+                            self.latencies.append(now - sent_at)
+                        else:
+                            self.lost += 1
+            time.sleep(self.poll_interval_s)
+
+    def finish(self):
+        """Wait for the outstanding probes (up to the timeout) and summarize."""
+        self._stopping.set()
+        self._thread.join(self.timeout_s + 1)
+        return {"visible_latency": summarize(self.latencies), "lost": self.lost}
+
+
+def wait_for_count(read_count, target, started, load_finished, timeout_s, poll_interval_s=0.5):
+    """Poll read_count() until it reaches target.
+
+    Returns how long after the end of the load the stage caught up, and the
+    stage's end-to-end throughput since the load started.
+    """
+    deadline = time.monotonic() + timeout_s
+    count = None
+    while True:
+        try:
+            count = read_count()
+        except Exception as e:
+            logger.warning(f"Could not read stage count: {e}")
+        now = time.monotonic()
+        if count is not None and count >= target:
+            return {
+                "caught_up": True,
+                "count": count,
+                "drain_s": round(max(0.0, now - load_finished), 3),
+                "events_per_s": round(count / (now - started), 2) if now > started else None,
+            }
+        if now >= deadline:
+            return {"caught_up": False, "count": count, "target": target}
+        time.sleep(poll_interval_s)
@@ -0,0 +1,184 @@
+"""End-to-end load benchmark.
+
+    python -m benchmark.run [--target local|compose] [--rate N] [--duration S] ...
+
+Drives the receiver with the configured event mix and writes a JSON report
+with receiver latency/throughput and how long storage, processing and the
+analyzer took to catch up. Compare two reports with benchmark.compare.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import time
+from datetime import datetime, timedelta, timezone
+
+import yaml
+
+from benchmark.loadgen import LoadGenerator
+from benchmark.pipeline import HttpClient, LocalClient, ProbeTracker, wait_for_count
+
+logger = logging.getLogger('basicLogger')
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CONFIG = os.path.join(REPO_ROOT, "config", "benchmark", "benchmark_conf.yaml")
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True, cwd=REPO_ROOT).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def storage_count(storage, start, end):
+    """Events stored with a timestamp in [start, end), from the storage stats endpoints."""
+    total = 0
+    for event_type in ("listings", "transactions"):
+        status, body = storage.get(f"/events/{event_type}/stats",
+                                   {"start_timestamp": start.isoformat(), "end_timestamp": end.isoformat()})
+        if status != 200:
+            raise RuntimeError(f"storage stats returned {status}")
+        total += body["count"]
+    return total
+
+
+def processing_count(processing):
+    status, body = processing.get("/stats")
+    if status != 200:
+        raise RuntimeError(f"processing stats returned {status}")
+    return body["num_listings"] + body["num_transactions"]
+
+
+def analyzer_count(analyzer):
+    status, body = analyzer.get("/stats")
+    if status != 200:
+        raise RuntimeError(f"analyzer stats returned {status}")
+    return body["num_listing_events"] + body["num_transaction_events"]
+
+
+def run_benchmark(bench_config):
+    target = bench_config.get("target", "local")
+    load_config = bench_config.get("load", {})
+    pipeline_config = bench_config.get("pipeline", {})
+    timeout_s = pipeline_config.get("timeout_s", 60)
+
+    stack = None
+    if target == "local":
+        from benchmark.local_stack import LocalStack
+        stack = LocalStack().start()
+        receiver = LocalClient(stack.receiver.app.app)
+        storage = LocalClient(stack.storage.app.app)
+        stages = {}  # processing and analyzer do not run in the local stack
+    else:
+        urls = bench_config["services"]
+        http_timeout_s = bench_config.get("http", {}).get("timeout_s", 10)
+        receiver = HttpClient(urls["receiver"], load_config.get("concurrency", 16), http_timeout_s)
+        storage = HttpClient(urls["storage"], 4, http_timeout_s)
+        processing = HttpClient(urls["processing"], 1, http_timeout_s)
+        analyzer = HttpClient(urls["analyzer"], 1, http_timeout_s)
+        stages = {"processing": lambda: processing_count(processing), "analyzer": lambda: analyzer_count(analyzer)}
+
+    # Counts before the run, so the stages' totals can be compared with what we sent
+    baselines = {}
+    for name, read_count in stages.items():
+        try:
+            baselines[name] = read_count()
+        except Exception as e:
+            logger.warning(f"Skipping the {name} stage, it is not reachable: {e}")
+    stages = {name: read_count for name, read_count in stages.items() if name in baselines}
+
+    probes = ProbeTracker(storage, pipeline_config.get("poll_interval_s", 0.05), timeout_s)
+    generator = LoadGenerator(
+        receiver,
+        mix=load_config.get("mix", {"listing": 0.5, "transaction": 0.5}),
+        rate=load_config.get("rate", 100),
+        concurrency=load_config.get("concurrency", 16),
+        duration_s=load_config.get("duration_s", 30),
+        batch_size=load_config.get("batch_size", 0),
+        users=load_config.get("users", 1000),
+        probe_every=pipeline_config.get("probe_every", 50),
+        on_probe=probes.add,
+        seed=load_config.get("seed"),
+    )
+
+    started_at = utcnow()
+    logger.info(f"Running {target} benchmark: {load_config}")
+    probes.start()
+    started = time.monotonic()
+    receiver_results = generator.run()
+    load_finished = time.monotonic()
+    window_end = utcnow() + timedelta(seconds=1)
+
+    expected = receiver_results["events"]["accepted"] + receiver_results["events"]["queued"]
+    pipeline = {"storage": probes.finish()}
+    pipeline["storage"].update(wait_for_count(
+        lambda: storage_count(storage, started_at - timedelta(seconds=1), window_end),
+        expected, started, load_finished, timeout_s))
+    for name, read_count in stages.items():
+        pipeline[name] = wait_for_count(lambda: read_count() - baselines[name],
+                                        expected, started, load_finished, timeout_s)
+
+    if stack:
+        stack.stop()
+
+    return {
+        "run": {
+            "target": target,
+            "started_at": started_at.isoformat(),
+            "commit": git_commit(),
+        },
+        "config": bench_config,
+        "receiver": receiver_results,
+        "pipeline": pipeline,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load and end-to-end latency benchmark")
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--target", choices=("local", "compose"))
+    parser.add_argument("--rate", type=float, help="requests per second, 0 for as fast as possible")
+    parser.add_argument("--duration", type=float, help="seconds of load")
+    parser.add_argument("--concurrency", type=int)
+    parser.add_argument("--batch-size", type=int, help="events per request, 0 for the single-event endpoints")
+    parser.add_argument("--output", help="report path (default: <results_dir>/<time>-<target>.json)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    with open(args.config, "r") as f:
+        bench_config = yaml.safe_load(f)
+    if args.target:
+        bench_config["target"] = args.target
+    load_config = bench_config.setdefault("load", {})
+    for key, value in (("rate", args.rate), ("duration_s", args.duration),
+                       ("concurrency", args.concurrency), ("batch_size", args.batch_size)):
+        if value is not None:
+            load_config[key] = value
+
+    results = run_benchmark(bench_config)
+
+    output = args.output or os.path.join(
+        REPO_ROOT, bench_config.get("results_dir", "benchmark/results"),
+        f"{datetime.now():%Y%m%d-%H%M%S}-{bench_config.get('target', 'local')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    latency = results["receiver"]["latency"]
+    logger.info(f"Receiver: {results['receiver']['requests_per_s']} req/s, "
+                f"p50 {latency.get('p50_ms')} ms, p99 {latency.get('p99_ms')} ms")
+    for name, stage in results["pipeline"].items():
+        logger.info(f"{name}: {stage}")
+    logger.info(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
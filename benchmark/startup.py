@@ -0,0 +1,117 @@
+"""Measure how long each service takes to start.
+
+    python -m benchmark.startup [--services receiver storage ...] [--runs 5] [--output FILE]
+
+For every service this times `import app` in fresh interpreters (median
+and best of --runs), then launches `python app.py` the way its container
+does and polls /health/live and /health/ready until they answer 200. The
+readiness body lists how long each component (Kafka clients, database)
+took, so a slow scale-up can be attributed. Services read their config
+from /app/config as in the containers; a service whose Kafka or database
+is unreachable reports ready_s as null after --timeout.
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+from benchmark.run import REPO_ROOT, git_commit
+
+PORTS = {'receiver': 8080, 'storage': 8090, 'processing': 8100, 'analyzer': 8081}
+
+IMPORT_PROBE = "import time; started = time.perf_counter(); import app; print(time.perf_counter() - started)"
+
+
+def service_env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [REPO_ROOT, env.get('PYTHONPATH')]))
+    return env
+
+
+def import_times(service, runs):
+    """Seconds spent in `import app`, one fresh interpreter per run."""
+    times = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', IMPORT_PROBE], cwd=os.path.join(REPO_ROOT, service),
+                                env=service_env(), capture_output=True, text=True, timeout=120)
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing {service} failed:\n{result.stderr[-2000:]}")
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return times
+
+
+def wait_for_health(port, started, timeout_s):
+    """(seconds until /health/live answered, seconds until /health/ready answered, last readiness body)."""
+    live_s = ready_s = body = None
+    deadline = started + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            if live_s is None and requests.get(f"http://127.0.0.1:{port}/health/live", timeout=1).status_code == 200:
+                live_s = time.monotonic() - started
+            if live_s is not None:
+                response = requests.get(f"http://127.0.0.1:{port}/health/ready", timeout=1)
+                body = response.json()
+                if response.status_code == 200:
+                    ready_s = time.monotonic() - started
+                    break
+        except requests.RequestException:
+            pass  # not listening yet
+        time.sleep(0.05)
+    return live_s, ready_s, body
+
+
+def time_to_ready(service, timeout_s):
+    started = time.monotonic()
+    process = subprocess.Popen([sys.executable, 'app.py'], cwd=os.path.join(REPO_ROOT, service), env=service_env(),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        live_s, ready_s, body = wait_for_health(PORTS[service], started, timeout_s)
+    finally:
+        # The whole process group, so servers with worker processes stop too
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+    return {
+        'live_s': round(live_s, 3) if live_s is not None else None,
+        'ready_s': round(ready_s, 3) if ready_s is not None else None,
+        'components': (body or {}).get('components'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import time and time to ready of each service")
+    parser.add_argument('--services', nargs='+', choices=sorted(PORTS), default=sorted(PORTS))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=60, help="seconds to wait for /health/ready")
+    parser.add_argument('--skip-launch', action='store_true', help="only measure the import time")
+    parser.add_argument('--output', help="write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    report = {'commit': git_commit(), 'runs': args.runs, 'services': {}}
+    for service in args.services:
+        times = import_times(service, args.runs)
+        result = {'import_median_s': round(statistics.median(times), 3), 'import_min_s': round(min(times), 3)}
+        if not args.skip_launch:
+            result.update(time_to_ready(service, args.timeout))
+        report['services'][service] = result
+        print(f"{service:<11} import {result['import_median_s']:6.3f} s (best {result['import_min_s']:.3f})"
+              + ("" if args.skip_launch else
+                 f"  live {result['live_s'] if result['live_s'] is not None else '-'} s"
+                 f"  ready {result['ready_s'] if result['ready_s'] is not None else '-'} s"))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
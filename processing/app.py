@@ -1,12 +1,22 @@
 import yaml
 import logging
 import logging.config
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request
 from datetime import datetime, timezone
 from apscheduler.schedulers.background import BackgroundScheduler
-import os
-import json
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import atexit
+import threading
+from checkpoint import CheckpointStore
+from stats_engine import StatsEngine
+from recompute import RecomputeProgress, parse_utc, recompute, time_chunks
+from shared.health import READINESS, add_health_routes
+from shared.metrics import instrument_app, callback_metric, LATENCY_BUCKETS
+from prometheus_client import Histogram
 
 # Set up basic logging configuration
 logging.basicConfig(level=logging.DEBUG, 
@@ -14,6 +24,8 @@ logging.basicConfig(level=logging.DEBUG,
 logger = logging.getLogger('basicLogger')
 
 app = Flask(__name__)
+instrument_app(app)
+add_health_routes(app)
 
 # Load configuration from the YAML file
 def load_config():
@@ -35,79 +47,187 @@ stats_file_path = config.get('datastore', {}).get('filename', 'data.json')
 scheduler_interval = config.get('scheduler', {}).get('interval', 60)
 listings_url = config.get('eventstores', {}).get('listings', {}).get('url', 'http://localhost:8090/events/listings')
 transactions_url = config.get('eventstores', {}).get('transactions', {}).get('url', 'http://localhost:8090/events/transactions')
+listings_stats_url = config.get('eventstores', {}).get('listings', {}).get('stats_url', f"{listings_url}/stats")
+transactions_stats_url = config.get('eventstores', {}).get('transactions', {}).get('stats_url', f"{transactions_url}/stats")
+window_minutes = config.get('stats', {}).get('window_minutes', 60)
+sketch_accuracy = config.get('stats', {}).get('sketch_accuracy', 0.01)
+recompute_chunk_minutes = config.get('recompute', {}).get('chunk_minutes', 60)
+recompute_workers = config.get('recompute', {}).get('workers', 2)
 
-def populate_stats():
-    logger.info("Starting periodic processing...")
+# HTTP client settings for the event store requests
+http_config = config.get('http', {})
+http_timeout = (http_config.get('connect_timeout', 2), http_config.get('read_timeout', 10))
+http_retries = http_config.get('retries', 3)
+http_backoff = http_config.get('backoff_factor', 0.2)
+http_pool_size = http_config.get('pool_size', 4)
+
+# Per-cycle latency metrics, reported by the status endpoint
+CYCLE_METRICS = {'cycles': 0, 'failures': 0, 'last_ms': None, 'max_ms': 0.0, 'total_ms': 0.0, 'fetch_ms': {}}
+
+# Checkpointing: persist every N cycles, and (optionally) only when new events arrived
+persist_every = config.get('datastore', {}).get('persist_every', 1)
+persist_on_change = config.get('datastore', {}).get('persist_on_change', True)
+CHECKPOINTS = CheckpointStore(stats_file_path, keep=config.get('datastore', {}).get('keep_versions', 3))
+PERSIST_STATE = {'dirty': False, 'cycles': 0}
+
+# Running statistics, updated by populate_stats and served by /stats
+STATS = StatsEngine(window_minutes=window_minutes, accuracy=sketch_accuracy)
+
+# Held for a whole processing cycle, so a recompute never swaps STATS while a
+# cycle is between reading last_processed_timestamp and merging its batch
+CYCLE_LOCK = threading.Lock()
+RECOMPUTE = {'progress': RecomputeProgress(), 'thread': None}
+RECOMPUTE_LOCK = threading.Lock()
 
-    # Default statistics in case the file doesn't exist
-    default_stats = {
-        "num_listings": 0,
-        "num_transactions": 0,
-        "last_processed_timestamp": "1970-01-01T00:00:00"  # Start from epoch if no file
-    }
+# Metrics, served at /metrics
+CYCLE_DURATION = Histogram('processing_cycle_seconds', 'Duration of one populate_stats cycle', ['outcome'],
+                           buckets=LATENCY_BUCKETS)
+FETCH_DURATION = Histogram('processing_fetch_seconds', 'Event store aggregate requests', ['url', 'query'],
+                           buckets=LATENCY_BUCKETS)
 
-    # Read current statistics from the JSON file (or use defaults)
+def processed_lag_seconds():
+    last = datetime.fromisoformat(STATS.last_processed_timestamp)
+    if last.tzinfo is None:
+        last = last.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - last).total_seconds()
+
+callback_metric('processing_last_processed_age_seconds', 'Age of the end of the last processed window',
+                processed_lag_seconds)
+
+def load_stats():
+    """Seed the in-memory engine from the newest readable checkpoint."""
+    data = CHECKPOINTS.load()
+    if data is None:
+        logger.info("No stats checkpoint found. Using default values.")
+    elif not STATS.load(data):
+        logger.info("Stats file has no aggregation state. Recomputing from the epoch.")
+    elif 'listings' not in data:
+        logger.warning(f"Migrated the counts-only stats file: counts carried over, value statistics "
+                       f"start at {STATS.last_processed_timestamp}")
+    else:
+        logger.info(f"Loaded statistics up to {STATS.last_processed_timestamp} "
+                    f"(checkpoint version {CHECKPOINTS.version})")
+
+def persist_stats(force=False):
+    """Checkpoint the engine if it changed and persist_every cycles have passed (or force)."""
+    PERSIST_STATE['cycles'] += 1
+    if not PERSIST_STATE['dirty']:
+        return
+    if not force and PERSIST_STATE['cycles'] < persist_every:
+        return
     try:
-        if os.path.exists(stats_file_path) and os.path.getsize(stats_file_path) > 0:
-            with open(stats_file_path, 'r') as f:
-                stats = json.load(f)
-        else:
-            logger.info("Stats file is empty or not found. Using default values.")
-            stats = default_stats
+        CHECKPOINTS.save(STATS.to_dict())
+        PERSIST_STATE['dirty'] = False
+        PERSIST_STATE['cycles'] = 0
+        logger.debug(f"Saved statistics checkpoint version {CHECKPOINTS.version}")
     except Exception as e:
-        logger.error(f"Error occurred while reading stats file: {e}")
-        stats = default_stats
+        logger.error(f"Failed to write updated statistics to file: {e}")
+
+def create_http_session():
+    """Shared keep-alive session with a connection pool and retry with backoff."""
+    retry = Retry(
+        total=http_retries,
+        backoff_factor=http_backoff,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET'])
+    )
+    adapter = HTTPAdapter(pool_connections=http_pool_size, pool_maxsize=http_pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+http_session = create_http_session()
+fetch_executor = ThreadPoolExecutor(max_workers=http_pool_size, thread_name_prefix='fetch')
+
+def timed_get(url, params):
+    started = time.perf_counter()
+    response = http_session.get(url, params=params, timeout=http_timeout)
+    return response, (time.perf_counter() - started) * 1000
+
+def fetch_aggregates(urls, start_timestamp, end_timestamp):
+    """Get per-minute aggregates and a quantile sketch from each event store concurrently.
+
+    Returns a list of (buckets, sketch) in the order of urls, with None for
+    stores that did not answer with 200.
+    """
+    params = {'start_timestamp': start_timestamp, 'end_timestamp': end_timestamp}
+    futures = [
+        (url,
+         fetch_executor.submit(timed_get, url, {**params, 'bucket': 'minute'}),
+         fetch_executor.submit(timed_get, url, {**params, 'sketch_accuracy': sketch_accuracy}))
+        for url in urls
+    ]
+    results = []
+    for url, buckets_future, sketch_future in futures:
+        buckets_response, buckets_ms = buckets_future.result()
+        sketch_response, sketch_ms = sketch_future.result()
+        CYCLE_METRICS['fetch_ms'][url] = round(max(buckets_ms, sketch_ms), 3)
+        FETCH_DURATION.labels(url, 'buckets').observe(buckets_ms / 1000)
+        FETCH_DURATION.labels(url, 'sketch').observe(sketch_ms / 1000)
+        if buckets_response.status_code != 200 or sketch_response.status_code != 200:
+            logger.error(f"Failed to fetch aggregates from {url}. Status codes: "
+                         f"{buckets_response.status_code}, {sketch_response.status_code}")
+            results.append(None)
+        else:
+            results.append((buckets_response.json(), sketch_response.json()['sketch']))
+    return results
+
+def fetch_window(start_timestamp, end_timestamp):
+    return fetch_aggregates([listings_stats_url, transactions_stats_url], start_timestamp, end_timestamp)
+
+def record_cycle(started, succeeded):
+    duration_ms = (time.perf_counter() - started) * 1000
+    CYCLE_METRICS['cycles'] += 1
+    if not succeeded:
+        CYCLE_METRICS['failures'] += 1
+    CYCLE_METRICS['last_ms'] = round(duration_ms, 3)
+    CYCLE_METRICS['max_ms'] = max(CYCLE_METRICS['max_ms'], CYCLE_METRICS['last_ms'])
+    CYCLE_METRICS['total_ms'] += duration_ms
+    CYCLE_DURATION.labels('succeeded' if succeeded else 'failed').observe(duration_ms / 1000)
+    logger.info(f"Processing cycle took {duration_ms:.1f} ms")
+
+def populate_stats():
+    with CYCLE_LOCK:
+        run_cycle()
+
+def run_cycle():
+    logger.info("Starting periodic processing...")
+    started = time.perf_counter()
 
     # Get the current datetime as the "end" timestamp
     current_timestamp = datetime.now(timezone.utc).isoformat()
 
-    # Get the datetime of the most recent event processed from the stats file
-    last_processed_timestamp = stats.get('last_processed_timestamp', "1970-01-01T00:00:00")
-    
-    logger.debug(f"Fetching new events since: {last_processed_timestamp}")
+    # Get the datetime of the most recent event processed
+    last_processed_timestamp = STATS.last_processed_timestamp
 
-    # Initialize counters for events
-    num_listings = 0
-    num_transactions = 0
+    logger.debug(f"Fetching new events since: {last_processed_timestamp}")
 
     try:
-        # Get listings events
-        listings_response = requests.get(listings_url, params={'start_timestamp': last_processed_timestamp, 'end_timestamp': current_timestamp})
-        if listings_response.status_code == 200:
-            listings_data = listings_response.json()
-            num_listings = len(listings_data)
-            logger.info(f"Received {num_listings} new listings.")
-        else:
-            logger.error(f"Failed to fetch listings. Status code: {listings_response.status_code}")
-
-        # Get transaction events
-        transactions_response = requests.get(transactions_url, params={'start_timestamp': last_processed_timestamp, 'end_timestamp': current_timestamp})
-        if transactions_response.status_code == 200:
-            transactions_data = transactions_response.json()
-            num_transactions = len(transactions_data)
-            logger.info(f"Received {num_transactions} new transactions.")
-        else:
-            logger.error(f"Failed to fetch transactions. Status code: {transactions_response.status_code}")
-
+        # Aggregates are computed by storage, no raw events are transferred
+        listings, transactions = fetch_window(last_processed_timestamp, current_timestamp)
     except requests.exceptions.RequestException as e:
         logger.error(f"Request error occurred while fetching events: {e}")
+        record_cycle(started, False)
         return
+    if listings is None or transactions is None:
+        record_cycle(started, False)
+        return  # retry the same window on the next run
 
-    # Update statistics based on the new events
-    updated_stats = {
-        "num_listings": stats["num_listings"] + num_listings,
-        "num_transactions": stats["num_transactions"] + num_transactions,
-        "last_processed_timestamp": current_timestamp  # Update the last processed timestamp
-    }
+    listing_buckets, listing_sketch = listings
+    transaction_buckets, transaction_sketch = transactions
+    logger.info(f"Received {sum(b['count'] for b in listing_buckets)} new listings.")
+    logger.info(f"Received {sum(b['count'] for b in transaction_buckets)} new transactions.")
 
-    # Write the updated statistics to the JSON file
-    try:
-        with open(stats_file_path, 'w') as f:
-            json.dump(updated_stats, f, indent=4)
-        logger.debug(f"Updated statistics: {updated_stats}")
-    except Exception as e:
-        logger.error(f"Failed to write updated statistics to file: {e}")
+    # Merge the new batch into the running statistics, O(buckets in the batch)
+    STATS.merge(listing_buckets, listing_sketch, transaction_buckets, transaction_sketch, current_timestamp)
+
+    num_new = sum(b['count'] for b in listing_buckets) + sum(b['count'] for b in transaction_buckets)
+    if num_new or not persist_on_change:
+        PERSIST_STATE['dirty'] = True
+    persist_stats()
 
+    record_cycle(started, True)
     logger.info("Periodic processing completed.")
 
 def init_scheduler():
@@ -119,10 +239,78 @@ def init_scheduler():
 @app.route('/')
 def status():
     """API endpoint to check the status of the application."""
-    return jsonify({"status": "running", "last_processed_timestamp": date_created})
+    cycles = CYCLE_METRICS['cycles']
+    return jsonify({
+        "status": "running",
+        "last_processed_timestamp": STATS.last_processed_timestamp,
+        "scheduler": {
+            "interval_s": scheduler_interval,
+            "cycles": cycles,
+            "failures": CYCLE_METRICS['failures'],
+            "last_cycle_ms": CYCLE_METRICS['last_ms'],
+            "max_cycle_ms": CYCLE_METRICS['max_ms'],
+            "avg_cycle_ms": round(CYCLE_METRICS['total_ms'] / cycles, 3) if cycles else None,
+            "fetch_ms": CYCLE_METRICS['fetch_ms'],
+        }
+    })
+
+
+def run_recompute(start, end, chunk_minutes, progress):
+    try:
+        engine = recompute(fetch_window, start, end, window_minutes, sketch_accuracy,
+                           chunk_minutes, recompute_workers, progress)
+        with CYCLE_LOCK:
+            STATS.load(engine.to_dict())
+            PERSIST_STATE['dirty'] = True
+            persist_stats(force=True)
+        logger.info(f"Statistics replaced by the recompute of {progress.start}..{progress.end}")
+        progress.finish()
+    except Exception as e:
+        logger.error(f"Recompute failed, statistics left unchanged: {e}")
+        progress.finish(e)
+
+
+@app.route('/recompute', methods=['POST'])
+def start_recompute():
+    """Rebuild the statistics from start_timestamp on in the background (see recompute.py)."""
+    params = request.get_json(silent=True) or request.args
+    try:
+        start = parse_utc(params['start_timestamp'])
+        end = parse_utc(params['end_timestamp']) if params.get('end_timestamp') else datetime.now(timezone.utc)
+        chunk_minutes = int(params.get('chunk_minutes', recompute_chunk_minutes))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"message": "start_timestamp (and optional end_timestamp, chunk_minutes) required"}), 400
+    if start >= end or end > datetime.now(timezone.utc) or chunk_minutes < 1:
+        return jsonify({"message": "Need start < end <= now and chunk_minutes >= 1"}), 400
+
+    with RECOMPUTE_LOCK:
+        if RECOMPUTE['thread'] is not None and RECOMPUTE['thread'].is_alive():
+            return jsonify({"message": "A recompute is already running", **RECOMPUTE['progress'].to_dict()}), 409
+        progress = RecomputeProgress(start.isoformat(), end.isoformat(), len(time_chunks(start, end, chunk_minutes)))
+        thread = threading.Thread(target=run_recompute, args=(start, end, chunk_minutes, progress), name='recompute')
+        thread.daemon = True
+        RECOMPUTE.update(progress=progress, thread=thread)
+        thread.start()
+    return jsonify(progress.to_dict()), 202
+
+
+@app.route('/recompute')
+def recompute_status():
+    return jsonify(RECOMPUTE['progress'].to_dict())
+
+
+@app.route('/stats')
+def get_stats():
+    """API endpoint returning the current statistics straight from memory."""
+    return jsonify(STATS.snapshot()), 200
 
 
 if __name__ == "__main__":
+    READINESS.register("checkpoint")
+    load_stats()
+    READINESS.ready("checkpoint")
+    atexit.register(persist_stats, force=True)  # don't lose coalesced cycles on shutdown
     # Start the scheduler before running the API service
     init_scheduler()
-    app.run(debug=True, port=8100, host="0.0.0.0")
+    # No reloader: it imports the app a second time in a child process, doubling startup and the scheduler
+    app.run(debug=True, use_reloader=False, port=8100, host="0.0.0.0")
@@ -0,0 +1,80 @@
+import json
+import logging
+import os
+import shutil
+
+logger = logging.getLogger('basicLogger')
+
+
+class CheckpointStore:
+    """Crash-safe JSON checkpoints with a few previous versions kept around.
+
+    Each save writes a temp file, fsyncs it and renames it over the current
+    checkpoint, so the file on disk is always either the old or the new
+    version. The previous `keep` checkpoints are rotated to `<path>.1`,
+    `<path>.2`, ...; if the current one is unreadable, load falls back to
+    the newest readable previous version instead of starting over.
+    """
+
+    def __init__(self, path, keep=3):
+        self.path = path
+        self.keep = keep
+        self.version = 0
+
+    def _candidates(self):
+        yield self.path
+        for i in range(1, self.keep + 1):
+            yield f"{self.path}.{i}"
+
+    def load(self):
+        """Return the newest readable checkpoint, or None if there is none."""
+        for path in self._candidates():
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as e:
+                logger.error(f"Checkpoint {path} is unreadable, trying an older version: {e}")
+                continue
+            if not isinstance(data, dict):
+                logger.error(f"Checkpoint {path} is not a JSON object, trying an older version")
+                continue
+            self.version = data.get('checkpoint_version', 0)
+            if path != self.path:
+                logger.warning(f"Recovered statistics from previous checkpoint {path}")
+            return data
+        return None
+
+    def save(self, data):
+        self.version += 1
+        data = {**data, 'checkpoint_version': self.version}
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Rotate previous versions: path.(keep-1) -> path.keep, ..., path -> path.1
+        for i in range(self.keep - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.keep and os.path.exists(self.path):
+            # Link (or copy) rather than rename, so a current checkpoint exists at every moment
+            previous = f"{self.path}.1"
+            if os.path.exists(previous):  # keep == 1, nothing rotated it away
+                os.remove(previous)
+            try:
+                os.link(self.path, previous)
+            except OSError:
+                shutil.copyfile(self.path, previous)
+        os.replace(tmp_path, self.path)
+
+        # Make the renames durable
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
@@ -0,0 +1,158 @@
+"""Rebuild the processing statistics from the event store, starting at a past time.
+
+    python recompute.py --start 2026-10-01T00:00:00 [--end ISO] [--chunk-minutes 60]
+                        [--workers 2] [--apply | --output FILE]
+
+The window [start, end) is split into chunks of `chunk_minutes`, whose
+aggregates are fetched from storage `workers` chunks at a time and merged
+in time order into a fresh StatsEngine. The result covers exactly that
+window and has last_processed_timestamp = end, so once it replaces the
+service's statistics the scheduler carries on from end: recomputing from
+some past start with the default end of now resets the statistics to
+"everything since start", and an earlier end makes the scheduler catch up
+on [end, now) by itself.
+
+The running service does the same through POST /recompute (progress at
+GET /recompute) and swaps the result in between two cycles. The CLI writes
+the result to --output, or with --apply over the checkpoint file, which is
+only safe while the processing service is stopped.
+"""
+import argparse
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from stats_engine import StatsEngine
+
+logger = logging.getLogger('basicLogger')
+
+
+class RecomputeProgress:
+    """State of a recompute run, as reported by GET /recompute."""
+
+    def __init__(self, start=None, end=None, chunks=0):
+        self._lock = threading.Lock()
+        self.state = 'idle' if start is None else 'running'
+        self.start, self.end = start, end
+        self.chunks_total = chunks
+        self.chunks_done = 0
+        self.events = 0
+        self.error = None
+        self.started = time.monotonic()
+        self.finished = None
+
+    def chunk_done(self, events):
+        with self._lock:
+            self.chunks_done += 1
+            self.events += events
+
+    def finish(self, error=None):
+        with self._lock:
+            self.state = 'failed' if error else 'done'
+            self.error = str(error) if error else None
+            self.finished = time.monotonic()
+
+    def to_dict(self):
+        with self._lock:
+            elapsed = (self.finished or time.monotonic()) - self.started
+            return {
+                'state': self.state,
+                'start_timestamp': self.start,
+                'end_timestamp': self.end,
+                'chunks_done': self.chunks_done,
+                'chunks_total': self.chunks_total,
+                'events': self.events,
+                'elapsed_s': round(elapsed, 3),
+                'events_per_s': round(self.events / elapsed, 1) if elapsed else None,
+                'error': self.error,
+            }
+
+
+def parse_utc(value):
+    timestamp = datetime.fromisoformat(value)
+    return timestamp.replace(tzinfo=timezone.utc) if timestamp.tzinfo is None else timestamp.astimezone(timezone.utc)
+
+
+def time_chunks(start, end, chunk_minutes):
+    """[(chunk start, chunk end)] covering [start, end) as ISO strings."""
+    chunks = []
+    step = timedelta(minutes=chunk_minutes)
+    while start < end:
+        chunks.append((start.isoformat(), min(start + step, end).isoformat()))
+        start += step
+    return chunks
+
+
+def fetch_chunk(fetch, chunk, retries=3):
+    """Aggregates of one chunk; fetch returns [(buckets, sketch) or None] for listings and transactions."""
+    for attempt in range(retries + 1):
+        try:
+            results = fetch(*chunk)
+            if all(result is not None for result in results):
+                return results
+            error = "event store did not answer with 200"
+        except Exception as e:  # connection errors after the HTTP adapter's own retries
+            error = e
+        if attempt < retries:
+            logger.warning(f"Fetching {chunk[0]}..{chunk[1]} failed (attempt {attempt + 1}), retrying: {error}")
+            time.sleep(0.5 * 2 ** attempt)
+    raise RuntimeError(f"Could not fetch aggregates for {chunk[0]}..{chunk[1]}: {error}")
+
+
+def recompute(fetch, start, end, window_minutes, accuracy, chunk_minutes=60, workers=2, progress=None):
+    """StatsEngine holding the statistics of [start, end) (aware datetimes)."""
+    chunks = time_chunks(start, end, chunk_minutes)
+    if progress is None:
+        progress = RecomputeProgress(start.isoformat(), end.isoformat(), len(chunks))
+    engine = StatsEngine(window_minutes=window_minutes, accuracy=accuracy)
+    engine.last_processed_timestamp = start.isoformat()
+    logger.info(f"Recomputing statistics for {start.isoformat()}..{end.isoformat()} in {len(chunks)} chunk(s)")
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='recompute') as executor:
+        # map() yields in submission order, so the chunks are merged oldest first
+        for (_, chunk_end), (listings, transactions) in zip(
+                chunks, executor.map(lambda chunk: fetch_chunk(fetch, chunk), chunks)):
+            listing_buckets, listing_sketch = listings
+            transaction_buckets, transaction_sketch = transactions
+            engine.merge(listing_buckets, listing_sketch, transaction_buckets, transaction_sketch, chunk_end)
+            progress.chunk_done(sum(b['count'] for b in listing_buckets) +
+                                sum(b['count'] for b in transaction_buckets))
+            status = progress.to_dict()
+            logger.info(f"Recompute progress: {status['chunks_done']}/{status['chunks_total']} chunks, "
+                        f"{status['events']} events, {status['events_per_s'] or 0:,.0f} events/s")
+    return engine
+
+
+def main(argv=None):
+    import json
+    import app
+
+    parser = argparse.ArgumentParser(description="Recompute the processing statistics for a past window")
+    parser.add_argument('--start', type=parse_utc, required=True)
+    parser.add_argument('--end', type=parse_utc, help="default: now")
+    parser.add_argument('--chunk-minutes', type=int, default=app.recompute_chunk_minutes)
+    parser.add_argument('--workers', type=int, default=app.recompute_workers)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--output', help="write the recomputed statistics to this file")
+    target.add_argument('--apply', action='store_true', help="replace the checkpoint (stop the service first)")
+    args = parser.parse_args(argv)
+
+    end = args.end or datetime.now(timezone.utc)
+    if args.start >= end:
+        parser.error("--start must be before --end")
+    engine = recompute(app.fetch_window, args.start, end, app.window_minutes, app.sketch_accuracy,
+                       args.chunk_minutes, args.workers)
+    if args.apply:
+        app.CHECKPOINTS.load()  # continue the version numbering
+        app.CHECKPOINTS.save(engine.to_dict())
+        logger.info(f"Replaced {app.stats_file_path} (checkpoint version {app.CHECKPOINTS.version})")
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(engine.to_dict(), f)
+    print(json.dumps(engine.snapshot(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+
+class RunningStats:
+    """Count, sum, min, max, mean and variance that can be merged incrementally.
+
+    Batches arrive as pre-aggregated (count, sum, sum of squares, min, max)
+    tuples from storage and are folded in with the parallel form of
+    Welford's algorithm (Chan et al.), so a merge is O(1).
+    """
+
+    __slots__ = ('count', 'total', 'minimum', 'maximum', 'mean', 'm2')
+
+    def __init__(self, count=0, total=0.0, minimum=None, maximum=None, mean=0.0, m2=0.0):
+        self.count = count
+        self.total = total
+        self.minimum = minimum
+        self.maximum = maximum
+        self.mean = mean
+        self.m2 = m2
+
+    @classmethod
+    def from_aggregate(cls, count, total, sum_sq, minimum, maximum):
+        if not count:
+            return cls()
+        mean = total / count
+        m2 = max(sum_sq - total * mean, 0.0)  # clamp float rounding below zero
+        return cls(count, total, minimum, maximum, mean, m2)
+
+    def merge(self, other):
+        if not other.count:
+            return
+        if not self.count:
+            self.count, self.total, self.mean, self.m2 = other.count, other.total, other.mean, other.m2
+            self.minimum, self.maximum = other.minimum, other.maximum
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else 0.0
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'min': self.minimum,
+            'max': self.maximum,
+            'mean': self.mean,
+            'm2': self.m2,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['count'], data['sum'], data['min'], data['max'], data['mean'], data['m2'])
+
+
+class QuantileSketch:
+    """Mergeable log-bucketed histogram for approximate percentiles (DDSketch).
+
+    Every positive value x is counted in bin ceil(log_gamma(x)); any quantile
+    is then returned within `accuracy` relative error. Storage computes the
+    bins for a batch in SQL, so merging is a dict update over the bins.
+    """
+
+    def __init__(self, accuracy=0.01, bins=None, zero_count=0):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.bins = bins or {}
+        self.zero_count = zero_count
+
+    @property
+    def count(self):
+        return self.zero_count + sum(self.bins.values())
+
+    def merge_bins(self, bins, zero_count=0):
+        for key, count in bins.items():
+            key = int(key)
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zero_count += zero_count
+
+    def quantile(self, q):
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if rank < seen:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def to_dict(self):
+        return {'accuracy': self.accuracy, 'bins': {str(k): v for k, v in self.bins.items()}, 'zero_count': self.zero_count}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['accuracy'], {int(k): v for k, v in data['bins'].items()}, data['zero_count'])
+
+
+def window_start(processed_until, window_minutes):
+    """Oldest bucket key ("YYYY-MM-DDTHH:MM:SS", UTC) still inside the window ending at processed_until."""
+    until = datetime.fromisoformat(processed_until.replace('Z', '+00:00'))
+    if until.tzinfo is not None:
+        until = until.astimezone(timezone.utc).replace(tzinfo=None)
+    return (until - timedelta(minutes=window_minutes)).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+class EventTypeStats:
+    """All-time stats, quantile sketch and per-minute rolling window for one event type."""
+
+    def __init__(self, window_minutes, accuracy):
+        self.window_minutes = window_minutes
+        self.totals = RunningStats()
+        self.sketch = QuantileSketch(accuracy)
+        self.minutes = OrderedDict()  # "YYYY-MM-DDTHH:MM:00" -> RunningStats, oldest first
+        self.carried_count = 0  # events counted by a counts-only data.json, before values were tracked
+
+    def merge_buckets(self, buckets, processed_until):
+        """Fold per-minute aggregates from storage into the totals and rolling window.
+
+        The window keeps the minutes starting within `window_minutes` of
+        processed_until, so minutes without events still age out the older ones.
+        """
+        out_of_order = False
+        for bucket in buckets:
+            batch = RunningStats.from_aggregate(
+                bucket['count'], bucket['sum'], bucket['sum_sq'], bucket['min'], bucket['max'])
+            self.totals.merge(batch)
+            minute = self.minutes.get(bucket['bucket'])
+            if minute is None:
+                out_of_order = out_of_order or (self.minutes and bucket['bucket'] < next(reversed(self.minutes)))
+                self.minutes[bucket['bucket']] = minute = RunningStats()
+            minute.merge(batch)
+        if out_of_order:
+            self.minutes = OrderedDict(sorted(self.minutes.items()))
+        cutoff = window_start(processed_until, self.window_minutes)
+        while self.minutes and next(iter(self.minutes)) < cutoff:
+            self.minutes.popitem(last=False)
+
+    def window(self):
+        merged = RunningStats()
+        for minute in self.minutes.values():
+            merged.merge(minute)
+        return merged
+
+    def summary(self):
+        window = self.window()
+        return {
+            'count': self.totals.count + self.carried_count,
+            'sum': self.totals.total,
+            'min': self.totals.minimum,
+            'max': self.totals.maximum,
+            'mean': self.totals.mean,
+            'stddev': math.sqrt(self.totals.variance),
+            'p50': self.sketch.quantile(0.5),
+            'p90': self.sketch.quantile(0.9),
+            'p99': self.sketch.quantile(0.99),
+            'window_minutes': self.window_minutes,
+            'window': {
+                'count': window.count,
+                'sum': window.total,
+                'max': window.maximum,
+                'mean': window.mean,
+            },
+        }
+
+    def to_dict(self):
+        return {
+            'totals': self.totals.to_dict(),
+            'sketch': self.sketch.to_dict(),
+            'minutes': {key: value.to_dict() for key, value in self.minutes.items()},
+            'carried_count': self.carried_count,
+        }
+
+    def load(self, data):
+        self.totals = RunningStats.from_dict(data['totals'])
+        self.sketch = QuantileSketch.from_dict(data['sketch'])
+        self.minutes = OrderedDict(sorted((key, RunningStats.from_dict(value)) for key, value in data['minutes'].items()))
+        self.carried_count = data.get('carried_count', 0)
+
+
+class StatsEngine:
+    """In-memory statistics for listings and transactions.
+
+    populate_stats merges each new batch into the engine; the /stats summary
+    is rebuilt once per merge so requests only read a prepared dict.
+    """
+
+    def __init__(self, window_minutes=60, accuracy=0.01):
+        self.listings = EventTypeStats(window_minutes, accuracy)
+        self.transactions = EventTypeStats(window_minutes, accuracy)
+        self.last_processed_timestamp = "1970-01-01T00:00:00"
+        self._lock = threading.Lock()
+        self._snapshot = self._build_snapshot()
+
+    def merge(self, listing_buckets, listing_sketch, transaction_buckets, transaction_sketch, processed_until):
+        with self._lock:
+            self.listings.merge_buckets(listing_buckets, processed_until)
+            self.listings.sketch.merge_bins(listing_sketch['bins'], listing_sketch['zero_count'])
+            self.transactions.merge_buckets(transaction_buckets, processed_until)
+            self.transactions.sketch.merge_bins(transaction_sketch['bins'], transaction_sketch['zero_count'])
+            self.last_processed_timestamp = processed_until
+            self._snapshot = self._build_snapshot()
+
+    def snapshot(self):
+        return self._snapshot
+
+    def _build_snapshot(self):
+        listings = self.listings.summary()
+        transactions = self.transactions.summary()
+        return {
+            'num_listings': listings['count'],
+            'max_listing_price': listings['max'] or 0.0,
+            'num_transactions': transactions['count'],
+            'max_transaction_amount': transactions['max'] or 0.0,
+            'listing_price': listings,
+            'transaction_amount': transactions,
+            'last_processed_timestamp': self.last_processed_timestamp,
+        }
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'num_listings': self.listings.totals.count + self.listings.carried_count,
+                'num_transactions': self.transactions.totals.count + self.transactions.carried_count,
+                'last_processed_timestamp': self.last_processed_timestamp,
+                'listings': self.listings.to_dict(),
+                'transactions': self.transactions.to_dict(),
+            }
+
+    def load(self, data):
+        """Restore from data.json; False if it holds nothing to resume from.
+
+        Files written before the engine only carry counts. Those are carried
+        over and processing resumes where the file stopped; the value
+        statistics (mean, percentiles, window) only cover later events.
+        """
+        with self._lock:
+            if 'listings' in data:
+                self.listings.load(data['listings'])
+                self.transactions.load(data['transactions'])
+            elif 'last_processed_timestamp' in data:
+                self.listings.carried_count = data.get('num_listings', 0)
+                self.transactions.carried_count = data.get('num_transactions', 0)
+            else:
+                return False
+            self.last_processed_timestamp = data.get('last_processed_timestamp', "1970-01-01T00:00:00")
+            self._snapshot = self._build_snapshot()
+            return True
@@ -0,0 +1,5 @@
+import os
+import sys
+
+PROCESSING_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [PROCESSING_DIR, os.path.dirname(PROCESSING_DIR)]
@@ -0,0 +1,68 @@
+"""Checkpoints must survive a corrupted current file and upgrades from the counts-only data.json."""
+import json
+
+import pytest
+
+import checkpoint
+from checkpoint import CheckpointStore
+from stats_engine import StatsEngine
+
+
+@pytest.mark.parametrize('keep', [1, 3])
+def test_previous_version_is_kept_next_to_the_current(tmp_path, keep):
+    store = CheckpointStore(str(tmp_path / 'data.json'), keep=keep)
+    for n in range(1, 5):
+        store.save({'n': n})
+    assert json.loads((tmp_path / 'data.json').read_text())['n'] == 4
+    assert [json.loads((tmp_path / f'data.json.{i}').read_text())['n'] for i in range(1, keep + 1)] == \
+        list(range(3, 3 - keep, -1))
+    assert not (tmp_path / 'data.json.tmp').exists()
+
+
+def test_current_checkpoint_exists_throughout_a_save(tmp_path, monkeypatch):
+    path = tmp_path / 'data.json'
+    store = CheckpointStore(str(path))
+    store.save({'n': 1})
+    replace = checkpoint.os.replace
+
+    def checked_replace(src, dst):
+        assert path.exists()  # a crash here must still find a current checkpoint
+        replace(src, dst)
+    monkeypatch.setattr(checkpoint.os, 'replace', checked_replace)
+    store.save({'n': 2})
+    store.save({'n': 3})
+    assert CheckpointStore(str(path)).load()['n'] == 3
+
+
+def test_corrupted_current_checkpoint_falls_back_to_the_previous(tmp_path):
+    path = tmp_path / 'data.json'
+    store = CheckpointStore(str(path))
+    store.save({'n': 1})
+    store.save({'n': 2})
+    path.write_text('{"n": 3, "checkpoint_ver')  # torn write
+
+    restored = CheckpointStore(str(path))
+    assert restored.load() == {'n': 1, 'checkpoint_version': 1}
+    assert restored.version == 1
+
+
+def test_counts_only_stats_file_is_migrated():
+    engine = StatsEngine(window_minutes=10)
+    legacy = {'num_listings': 7, 'num_transactions': 3, 'last_processed_timestamp': '2025-04-08T17:08:37+00:00'}
+    assert engine.load(legacy)
+    assert engine.last_processed_timestamp == legacy['last_processed_timestamp']
+
+    bucket = {'bucket': '2025-04-08T17:09:00', 'count': 2, 'sum': 30.0, 'sum_sq': 500.0, 'min': 10.0, 'max': 20.0}
+    empty = {'bins': {}, 'zero_count': 0}
+    engine.merge([bucket], empty, [], empty, '2025-04-08T17:10:00+00:00')
+    snapshot = engine.snapshot()
+    assert (snapshot['num_listings'], snapshot['num_transactions']) == (9, 3)
+    assert snapshot['listing_price']['mean'] == 15.0  # only the events seen since the upgrade
+
+    reloaded = StatsEngine(window_minutes=10)
+    assert reloaded.load(json.loads(json.dumps(engine.to_dict())))
+    assert reloaded.snapshot()['num_listings'] == 9
+
+
+def test_stats_file_without_a_position_is_not_loaded():
+    assert not StatsEngine().load({'num_listings': 7})
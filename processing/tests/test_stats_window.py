@@ -0,0 +1,33 @@
+"""The rolling window must cover the last window_minutes of time, not the last window_minutes buckets."""
+from stats_engine import StatsEngine
+
+
+def bucket(minute, value):
+    return {'bucket': minute, 'count': 1, 'sum': value, 'sum_sq': value * value, 'min': value, 'max': value}
+
+
+def merge(engine, buckets, processed_until):
+    engine.merge(buckets, {'bins': {}, 'zero_count': 0}, [], {'bins': {}, 'zero_count': 0}, processed_until)
+
+
+def test_window_evicts_by_time_across_a_gap():
+    engine = StatsEngine(window_minutes=10)
+    merge(engine, [bucket('2024-05-01T12:00:00', 100.0), bucket('2024-05-01T12:05:00', 5.0)],
+          '2024-05-01T12:06:00+00:00')
+    assert engine.snapshot()['listing_price']['window']['count'] == 2
+
+    # Nothing arrives for 20 minutes; both older minutes fall out although only one bucket is added
+    merge(engine, [bucket('2024-05-01T12:25:00', 1.0)], '2024-05-01T12:25:30+00:00')
+    window = engine.snapshot()['listing_price']['window']
+    assert window['count'] == 1
+    assert window['max'] == 1.0
+    assert engine.snapshot()['num_listings'] == 3
+
+
+def test_empty_cycles_age_out_the_window():
+    engine = StatsEngine(window_minutes=10)
+    merge(engine, [bucket('2024-05-01T12:00:00', 3.0)], '2024-05-01T12:01:00Z')
+    merge(engine, [], '2024-05-01T12:09:59Z')
+    assert engine.snapshot()['listing_price']['window']['count'] == 1
+    merge(engine, [], '2024-05-01T12:10:01Z')
+    assert engine.snapshot()['listing_price']['window']['count'] == 0
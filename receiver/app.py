@@ -2,16 +2,30 @@ import logging
 import logging.config
 import yaml
 import connexion
-import httpx
-import json
+import time
 import datetime
 import uuid
-from pykafka import KafkaClient
+import os
+import sys
+import tempfile
+from concurrent.futures import TimeoutError as FutureTimeout
+from dedup import RecentKeys
+from ingest_queue import IngestQueue, Overloaded
+from spill import SpillLog
+from shared import wire_format
+from shared.health import READINESS, add_health_routes
+from shared.kafka_pool import get_pool
+from shared.spec_cache import load_spec
+from shared.metrics import instrument_app, callback_metric, LATENCY_BUCKETS
+from prometheus_client import Counter, Gauge, Histogram
 from connexion import NoContent
 from flask import request  # Make sure this is at the top with other imports
 
+# /app/config/receiver in the container; APP_CONFIG_DIR points elsewhere (tests)
+CONFIG_DIR = os.path.join(os.environ.get('APP_CONFIG_DIR', '/app/config'), 'receiver')
+
 # Load logging configuration from YAML file
-with open("/app/config/receiver/receiver_log_conf.yml", "r") as f:
+with open(os.path.join(CONFIG_DIR, "receiver_log_conf.yml"), "r") as f:
     LOG_CONFIG = yaml.safe_load(f.read())
 logging.config.dictConfig(LOG_CONFIG)
 
@@ -19,20 +33,92 @@ logging.config.dictConfig(LOG_CONFIG)
 logger = logging.getLogger('basicLogger')
 
 # Load app_conf.yml for Kafka details
-with open('/app/config/receiver/receiver_conf.yaml', 'r') as f:
+with open(os.path.join(CONFIG_DIR, 'receiver_conf.yaml'), 'r') as f:
     config = yaml.safe_load(f.read())
 
 # Kafka client setup
-kafka_hostname = config['events']['kafka']['hostname']
-kafka_port = config['events']['kafka']['port']
-kafka_topic = config['events']['kafka']['topic']
+kafka_config = config['events']['kafka']
+kafka_pool = get_pool(kafka_config)
+kafka_topic = kafka_pool.topic
+SEND_TIMEOUT_S = kafka_config.get('send_timeout_s', 10)
+WIRE_FORMAT = kafka_config.get('wire_format', 'json')  # json | msgpack
 
-client = KafkaClient(hosts=f'{kafka_hostname}:{kafka_port}')
-topic = client.topics[str.encode(kafka_topic)]
-producer = topic.get_sync_producer()
+# Batch producer settings (see receiver_conf.yaml)
+batch_config = config['events'].get('batch', {})
+BATCH_LINGER_MS = batch_config.get('linger_ms', 50)
+BATCH_SIZE_BYTES = batch_config.get('batch_size_bytes', 262144)
+BATCH_DELIVERY_TIMEOUT_S = batch_config.get('delivery_timeout_s', 10)
 
-def submit_listing_event(body):
+# Ingest queue between the handlers and the producer (see receiver_conf.yaml)
+ingest_config = config['events'].get('ingest_queue', {})
+INGEST_ACK_TIMEOUT_S = ingest_config.get('ack_timeout_s', 2)
+spill_config = ingest_config.get('spill', {})
+
+# Server settings: "flask" runs the single-process development server, "asgi"
+# runs asgi_app (connexion AsyncApp) under uvicorn with `workers` processes
+server_config = config.get('server', {})
+SERVER_MODE = server_config.get('mode', 'flask')
+
+# Recently accepted client trace_ids, used to drop retried/duplicate submissions
+dedup_config = config['events'].get('dedup', {})
+SEEN_TRACE_IDS = RecentKeys(max_size=dedup_config.get('max_size', 100000), ttl_s=dedup_config.get('ttl_s', 600))
+
+
+# Metrics, served at /metrics
+PRODUCED = Counter('receiver_produced_events', 'Events handed to Kafka by outcome', ['event_type', 'outcome'])
+PRODUCE_ACK_LATENCY = Histogram('receiver_produce_ack_seconds', 'Time from send() to the broker ack (single-event endpoints)',
+                                buckets=LATENCY_BUCKETS)
+AWAITING_DELIVERY = Gauge('receiver_awaiting_delivery', 'Batch messages sent and waiting for their delivery report')
+callback_metric('receiver_dedup_keys', 'Trace ids held by the duplicate filter', lambda: len(SEEN_TRACE_IDS))
+
+
+def get_ingest_producer():
+    """Producer fed by the ingest queue's sender thread.
 
+    Messages are buffered and sent in the background; each send() returns a
+    future that resolves to the delivery report. When the buffer is full
+    send() gives up after send_block_ms, so the sender thread notices a
+    stalled broker while the messages wait in the ingest queue.
+    """
+    return kafka_pool.producer(
+        'ingest',
+        linger_ms=BATCH_LINGER_MS,
+        batch_size=BATCH_SIZE_BYTES,
+        max_block_ms=ingest_config.get('send_block_ms', 500)
+    )
+
+
+INGEST_QUEUE = IngestQueue(
+    get_ingest_producer,
+    kafka_topic,
+    max_size=ingest_config.get('max_size', 10000),
+    high_watermark=ingest_config.get('high_watermark'),
+    low_watermark=ingest_config.get('low_watermark'),
+    spill=SpillLog(
+        spill_config.get('directory', 'spill'),
+        segment_bytes=spill_config.get('segment_bytes', 16777216),
+        max_bytes=spill_config.get('max_bytes', 1073741824),
+    ) if spill_config.get('enabled', False) else None,
+    retry_after_max_s=ingest_config.get('retry_after_max_s', 30),
+)
+READINESS.register('kafka-producer')  # ready once the sender thread has connected
+callback_metric('receiver_ingest_queue_depth', 'Events waiting in the ingest queue for the producer', INGEST_QUEUE.depth)
+callback_metric('receiver_ingest_in_flight', 'Events handed to the producer and waiting for their delivery report',
+                INGEST_QUEUE.in_flight)
+callback_metric('receiver_ingest_shedding', '1 while the ingest queue is above its watermark and sheds load',
+                lambda: int(INGEST_QUEUE.shedding()))
+callback_metric('receiver_ingest_broker_available', '0 while sends to Kafka are failing or blocked',
+                lambda: int(INGEST_QUEUE.broker_available()))
+if INGEST_QUEUE.spill is not None:
+    callback_metric('receiver_spill_bytes', 'Events spilled to disk and waiting for replay, in bytes',
+                    INGEST_QUEUE.spill.size_bytes)
+
+
+def build_listing_reading(body):
+    """Validate a listing event body and build the Kafka payload.
+
+    Returns a (reading, error_message) tuple; reading is None on error.
+    """
     trace_id = body.get('trace_id') or str(uuid.uuid4())  # Generate or use provided trace_id
 
     # Convert the timestamp to datetime object
@@ -40,10 +126,10 @@ def submit_listing_event(body):
     if timestamp:
         try:
             timestamp = datetime.datetime.fromisoformat(timestamp)  # Parse timestamp string into datetime
-        except ValueError:
-            return {"message": "Invalid timestamp format"}, 400
+        except (ValueError, TypeError):
+            return None, "Invalid timestamp format"
     else:
-        return {"message": "Missing 'timestamp' field"}, 400
+        return None, "Missing 'timestamp' field"
 
     # Extracting other necessary fields from the body
     user_id = body.get('user_id')
@@ -52,12 +138,8 @@ def submit_listing_event(body):
 
     # Error handling for missing fields
     if not user_id or not item_id or not price:
-        return {"message": "Missing required fields"}, 400
-
-    # Log received event
-    logger.info(f"Received event listing with trace id of {trace_id}")
+        return None, "Missing required fields"
 
-    # Prepare the message for Kafka
     reading = {
         "trace_id": trace_id,
         "user_id": user_id,
@@ -65,30 +147,24 @@ def submit_listing_event(body):
         "price": price,
         "timestamp": timestamp.isoformat(),  # Send as string again in ISO format
     }
+    return reading, None
 
-    msg = {
-        "type": "listing_event",  # Event type: listing_event
-        "datetime": datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
-        "payload": reading
-    }
-    msg_str = json.dumps(msg)
-    producer.produce(msg_str.encode('utf-8'))  # Send message to Kafka
 
-    # Return success response
-    return NoContent, 201
-
-def submit_transaction_event(body):
+def build_transaction_reading(body):
+    """Validate a transaction event body and build the Kafka payload.
 
+    Returns a (reading, error_message) tuple; reading is None on error.
+    """
     trace_id = body.get('trace_id') or str(uuid.uuid4())  # Generate or use provided trace_id
 
     timestamp = body.get('timestamp')
     if timestamp:
         try:
             timestamp = datetime.datetime.fromisoformat(timestamp)  # Parse timestamp string into datetime
-        except ValueError:
-            return {"message": "Invalid timestamp format"}, 400
+        except (ValueError, TypeError):
+            return None, "Invalid timestamp format"
     else:
-        return {"message": "Missing 'timestamp' field"}, 400
+        return None, "Missing 'timestamp' field"
 
     user_id = body.get('user_id')
     transaction_id = body.get('transaction_id')
@@ -96,12 +172,8 @@ def submit_transaction_event(body):
 
     # Error handling for missing fields
     if not user_id or not transaction_id or not amount:
-        return {"message": "Missing required fields"}, 400
-
-    # Log received event
-    logger.info(f"Received event transaction with trace id of {trace_id}")
+        return None, "Missing required fields"
 
-    # Prepare the message for Kafka
     reading = {
         "trace_id": trace_id,
         "user_id": user_id,
@@ -109,17 +181,192 @@ def submit_transaction_event(body):
         "amount": amount,
         "timestamp": timestamp.isoformat(),
     }
+    return reading, None
 
+
+def build_message(event_type, reading):
+    """Wrap a payload in the envelope the storage and analyzer services expect."""
     msg = {
-        "type": "transaction_event",  # Event type: transaction_event
+        "type": event_type,
         "datetime": datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
         "payload": reading
     }
-    msg_str = json.dumps(msg)
-    producer.produce(msg_str.encode('utf-8'))  # Send message to Kafka
+    return wire_format.encode(msg, WIRE_FORMAT)
+
+
+def is_duplicate(body):
+    """True if the client-supplied trace_id was already accepted recently."""
+    trace_id = body.get('trace_id')
+    return bool(trace_id) and not SEEN_TRACE_IDS.add(trace_id)
+
+
+def late_failure(event_type, trace_id):
+    """Callback for a queued (202) event whose delivery failed after the handler answered."""
+    def failed(error):
+        SEEN_TRACE_IDS.discard(trace_id)  # the client's retry must not be dropped as a duplicate
+        PRODUCED.labels(event_type, 'failed').inc()
+        logger.warning(f"Queued {event_type} {trace_id} was not delivered: {type(error).__name__} {error}")
+    return failed
+
+
+def on_late_failure(delivery, failed):
+    """Call failed(error) if a delivery the handler stopped waiting for fails."""
+    delivery.add_done_callback(lambda done: done.exception() is None or failed(done.exception()))
+
+
+def produce(event_type, reading):
+    """Queue one event and wait up to ack_timeout_s for the broker to acknowledge it.
+
+    Returns "accepted" once acknowledged, "queued" if the ack is still
+    outstanding (the event stays queued) or "spilled" if it went to the
+    spill log. Raises Overloaded if it was shed, or the KafkaError of a
+    failed delivery.
+    """
+    started = time.perf_counter()
+    try:
+        delivery = INGEST_QUEUE.offer(build_message(event_type, reading))
+    except Overloaded:
+        PRODUCED.labels(event_type, 'shed').inc()
+        raise
+    if delivery is None:
+        PRODUCED.labels(event_type, 'spilled').inc()
+        return "spilled"
+    try:
+        delivery.result(timeout=INGEST_ACK_TIMEOUT_S)
+    except FutureTimeout:
+        on_late_failure(delivery, late_failure(event_type, reading['trace_id']))
+        PRODUCED.labels(event_type, 'queued').inc()
+        return "queued"
+    except Exception:
+        PRODUCED.labels(event_type, 'failed').inc()
+        raise
+    PRODUCE_ACK_LATENCY.observe(time.perf_counter() - started)
+    PRODUCED.labels(event_type, 'accepted').inc()
+    return "accepted"
+
+
+def overloaded(error):
+    return {"message": str(error)}, error.status, {"Retry-After": str(error.retry_after_s)}
+
+
+def submit_event(event_type, body, build_reading):
+    reading, error = build_reading(body)
+    if error:
+        return {"message": error}, 400
+
+    if is_duplicate(body):
+        logger.info(f"Ignoring duplicate {event_type} with trace id of {reading['trace_id']}")
+        return {"message": "Duplicate event, already accepted"}, 200
+
+    # Log received event
+    logger.info(f"Received {event_type} with trace id of {reading['trace_id']}")
+
+    try:
+        outcome = produce(event_type, reading)
+    except Overloaded as e:
+        SEEN_TRACE_IDS.discard(reading['trace_id'])  # let the client retry
+        return overloaded(e)
+    except Exception as e:
+        SEEN_TRACE_IDS.discard(reading['trace_id'])
+        logger.warning(f"Could not produce {event_type} {reading['trace_id']}: {type(e).__name__} {e}")
+        return overloaded(Overloaded(503, "Kafka did not accept the event, retry later", INGEST_QUEUE.retry_after_s()))
+
+    # 202 when the event is queued or spilled but not acknowledged yet
+    return NoContent, 201 if outcome == "accepted" else 202
+
+def submit_listing_event(body):
+    return submit_event("listing_event", body, build_listing_reading)
+
+def submit_transaction_event(body):
+    return submit_event("transaction_event", body, build_transaction_reading)
+
+
+def submit_batch(event_type, items, build_reading):
+    """Offer a batch of events to the ingest queue.
+
+    Every item gets a result entry: "rejected" if it fails validation or
+    delivery, "shed" if the queue turned it away (retry it after
+    Retry-After), "duplicate" if its trace_id was already accepted,
+    "accepted" once the broker acknowledges it, and "queued" if it was
+    spilled or no delivery report arrived within the delivery timeout. The
+    response is 207 if some events were shed, and 429/503 if nothing was
+    taken.
+    """
+    results = []
+    pending = []  # (index in results, delivery future)
+    shed = None  # the last Overloaded error, if any item was shed
+
+    for index, item in enumerate(items):
+        reading, error = build_reading(item) if isinstance(item, dict) else (None, "Event must be an object")
+        if error:
+            results.append({"index": index, "status": "rejected", "message": error})
+            continue
+
+        result = {"index": index, "trace_id": reading['trace_id'], "status": "queued"}
+        results.append(result)
+        if is_duplicate(item):
+            result["status"] = "duplicate"
+            continue
+        try:
+            future = INGEST_QUEUE.offer(build_message(event_type, reading))
+        except Overloaded as e:
+            SEEN_TRACE_IDS.discard(reading['trace_id'])
+            result["status"] = "shed"
+            result["message"] = str(e)
+            shed = e
+            continue
+        if future is not None:  # None: spilled, stays "queued"
+            pending.append((index, future))
+
+    # Collect delivery reports for this request's messages
+    AWAITING_DELIVERY.inc(len(pending))
+    deadline = time.monotonic() + BATCH_DELIVERY_TIMEOUT_S
+    for index, future in pending:
+        try:
+            future.result(timeout=max(0, deadline - time.monotonic()))
+        except FutureTimeout:
+            on_late_failure(future, late_failure(event_type, results[index]["trace_id"]))
+            continue  # still queued
+        except Exception as e:
+            SEEN_TRACE_IDS.discard(results[index]["trace_id"])
+            results[index]["status"] = "rejected"
+            results[index]["message"] = str(e)
+            continue
+        finally:
+            AWAITING_DELIVERY.dec()
+        results[index]["status"] = "accepted"
+
+    accepted = sum(1 for r in results if r["status"] == "accepted")
+    rejected = sum(1 for r in results if r["status"] == "rejected")
+    shed_count = sum(1 for r in results if r["status"] == "shed")
+    duplicates = sum(1 for r in results if r["status"] == "duplicate")
+    queued = len(items) - accepted - rejected - shed_count - duplicates
+    for outcome, count in (("accepted", accepted), ("rejected", rejected), ("shed", shed_count),
+                           ("duplicate", duplicates), ("queued", queued)):
+        if count:
+            PRODUCED.labels(event_type, outcome).inc(count)
+    logger.info(f"Batch of {len(items)} {event_type}s: {accepted} accepted, {rejected} rejected, "
+                f"{shed_count} shed, {duplicates} duplicates, {queued} queued")
+
+    if shed is not None and not accepted and not queued:
+        return overloaded(shed)
+    body = {
+        "accepted": accepted,
+        "rejected": rejected,
+        "shed": shed_count,
+        "duplicates": duplicates,
+        "queued": queued,
+        "results": results
+    }
+    if shed is not None:
+        return body, 207, {"Retry-After": str(shed.retry_after_s)}  # resend the "shed" items
+    return body, 200
 
-    # Return success response
-    return NoContent, 201
+def submit_listing_batch(body):
+    return submit_batch("listing_event", body, build_listing_reading)
+
+def submit_transaction_batch(body):
+    return submit_batch("transaction_event", body, build_transaction_reading)
 
 def get_listings(start_timestamp, end_timestamp):
     return [], 200
@@ -128,11 +375,18 @@ def get_transactions(start_timestamp, end_timestamp):
     return [], 200
 
 # Flask app with connexion
+# Run as a script this module is __main__; let the spec's app.<handler> operationIds resolve
+# to it instead of importing app.py a second time (which registers every metric twice)
+sys.modules.setdefault('app', sys.modules[__name__])
 app = connexion.FlaskApp(__name__, specification_dir='')
-# Register the API using the OpenAPI specification (openapi.yaml)
-app.add_api('openapi.yaml', strict_validation=False, validate_responses=True)
+# Register the API using the OpenAPI specification (openapi.yaml, parsed once and cached)
+app.add_api(load_spec(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'openapi.yaml')),
+            strict_validation=False, validate_responses=True)
 
 flask_app = app.app
+instrument_app(flask_app)
+add_health_routes(flask_app)
+flask_app.add_url_rule("/ingest/status", "ingest_status", lambda: INGEST_QUEUE.status())
 
 @flask_app.route("/debug", methods=["POST"])
 def debug():
@@ -140,5 +394,25 @@ def debug():
     print("DEBUG BODY:\n", raw)
     return {"message": "Received"}, 200
 
+def run_asgi():
+    import uvicorn
+    workers = server_config.get('workers', 4)
+    if workers > 1:
+        # Each worker keeps its own metrics; merge them at scrape time
+        os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='receiver-metrics-'))
+    uvicorn.run(
+        'asgi_app:app',
+        host="0.0.0.0",
+        port=8080,
+        workers=workers,
+        backlog=server_config.get('backlog', 2048),
+        timeout_keep_alive=server_config.get('keep_alive_s', 30),
+        log_level=server_config.get('log_level', 'warning'),
+    )
+
 if __name__ == "__main__":
-    app.run(port=8080, host="0.0.0.0")
+    if SERVER_MODE == 'asgi':
+        run_asgi()
+    else:
+        INGEST_QUEUE.start()  # connect to Kafka while the server comes up, not on the first request
+        app.run(port=8080, host="0.0.0.0")
@@ -0,0 +1,163 @@
+"""ASGI deployment of the receiver: connexion AsyncApp with non-blocking produce.
+
+Run by app.py when server.mode is "asgi" (uvicorn, server.workers processes),
+or directly with `uvicorn asgi_app:app`. Validation, deduplication and the
+wire format are shared with the Flask handlers in app.py; only the produce
+step differs. Each worker process has its own duplicate filter, so a retry
+that lands on another worker is only dropped later by storage's unique
+(trace_id, timestamp) index.
+"""
+import asyncio
+import logging
+import os
+
+import connexion
+from connexion import NoContent
+from connexion.resolver import Resolver
+from kafka.errors import KafkaError
+
+import app as receiver
+from async_producer import AsyncProducerQueue, QueueFull
+from shared.health import ASGIHealth
+from shared.metrics import ASGIMetrics, callback_metric, operations_from_spec
+from shared.spec_cache import load_spec
+
+logger = logging.getLogger('basicLogger')
+
+server_config = receiver.config.get('server', {})
+queue_config = server_config.get('async_queue', {})
+RETRY_AFTER_S = queue_config.get('retry_after_s', 1)
+
+PRODUCER_QUEUE = AsyncProducerQueue(
+    lambda: receiver.kafka_pool.producer(
+        'async',
+        linger_ms=receiver.BATCH_LINGER_MS,
+        batch_size=receiver.BATCH_SIZE_BYTES,
+        max_block_ms=0
+    ),
+    receiver.kafka_topic,
+    max_size=queue_config.get('max_size', 10000),
+    enqueue_timeout_s=queue_config.get('enqueue_timeout_s', 0.5),
+    delivery_timeout_s=receiver.SEND_TIMEOUT_S,
+)
+callback_metric('receiver_async_queue_depth', 'Events waiting to be handed to the Kafka producer',
+                PRODUCER_QUEUE.depth)
+
+
+def overloaded():
+    return {"message": "Receiver is overloaded, retry later"}, 503, {"Retry-After": str(RETRY_AFTER_S)}
+
+
+async def submit_event(event_type, body, build_reading):
+    reading, error = build_reading(body)
+    if error:
+        return {"message": error}, 400
+
+    if receiver.is_duplicate(body):
+        logger.info(f"Ignoring duplicate {event_type} with trace id of {reading['trace_id']}")
+        return {"message": "Duplicate event, already accepted"}, 200
+
+    logger.info(f"Received {event_type} with trace id of {reading['trace_id']}")
+    try:
+        await PRODUCER_QUEUE.submit(receiver.build_message(event_type, reading),
+                                    on_late_failure=receiver.late_failure(event_type, reading['trace_id']))
+    except asyncio.TimeoutError:
+        # Still queued and may yet be delivered, as in the Flask handlers
+        receiver.PRODUCED.labels(event_type, 'queued').inc()
+        return NoContent, 202
+    except (QueueFull, KafkaError) as e:
+        receiver.SEEN_TRACE_IDS.discard(reading['trace_id'])  # let the client retry
+        receiver.PRODUCED.labels(event_type, 'failed').inc()
+        logger.warning(f"Could not produce {event_type} {reading['trace_id']}: {type(e).__name__} {e}")
+        return overloaded()
+
+    receiver.PRODUCED.labels(event_type, 'accepted').inc()
+    return NoContent, 201
+
+
+async def submit_batch(event_type, items, build_reading):
+    """Async version of app.submit_batch; the items are produced concurrently."""
+    results = []
+    pending = []  # (index in results, submit coroutine)
+
+    for index, item in enumerate(items):
+        reading, error = build_reading(item) if isinstance(item, dict) else (None, "Event must be an object")
+        if error:
+            results.append({"index": index, "status": "rejected", "message": error})
+            continue
+        result = {"index": index, "trace_id": reading['trace_id'], "status": "queued"}
+        results.append(result)
+        if receiver.is_duplicate(item):
+            result["status"] = "duplicate"
+            continue
+        failed = receiver.late_failure(event_type, reading['trace_id'])
+        pending.append((index, PRODUCER_QUEUE.submit(receiver.build_message(event_type, reading),
+                                                     on_late_failure=failed)))
+
+    outcomes = await asyncio.gather(*(submit for _, submit in pending), return_exceptions=True)
+    for (index, _), outcome in zip(pending, outcomes):
+        if isinstance(outcome, asyncio.TimeoutError):
+            continue  # still queued
+        if isinstance(outcome, (QueueFull, KafkaError)):
+            receiver.SEEN_TRACE_IDS.discard(results[index]["trace_id"])
+            results[index]["status"] = "shed" if isinstance(outcome, QueueFull) else "rejected"
+            results[index]["message"] = "Producer queue is full" if isinstance(outcome, QueueFull) else str(outcome)
+        elif isinstance(outcome, BaseException):
+            raise outcome
+        else:
+            results[index]["status"] = "accepted"
+
+    counts = {status: sum(1 for r in results if r["status"] == status)
+              for status in ("accepted", "rejected", "shed", "duplicate", "queued")}
+    for outcome, count in counts.items():
+        if count:
+            receiver.PRODUCED.labels(event_type, outcome).inc(count)
+    logger.info(f"Batch of {len(items)} {event_type}s: {counts['accepted']} accepted, {counts['rejected']} rejected, "
+                f"{counts['shed']} shed, {counts['duplicate']} duplicates, {counts['queued']} queued")
+
+    if counts["shed"] and not counts["accepted"] and not counts["queued"]:
+        return overloaded()
+    body = {
+        "accepted": counts["accepted"],
+        "rejected": counts["rejected"],
+        "shed": counts["shed"],
+        "duplicates": counts["duplicate"],
+        "queued": counts["queued"],
+        "results": results
+    }
+    if counts["shed"]:
+        return body, 207, {"Retry-After": str(RETRY_AFTER_S)}  # resend the "shed" items
+    return body, 200
+
+
+async def submit_listing_event(body):
+    return await submit_event("listing_event", body, receiver.build_listing_reading)
+
+async def submit_transaction_event(body):
+    return await submit_event("transaction_event", body, receiver.build_transaction_reading)
+
+async def submit_listing_batch(body):
+    return await submit_batch("listing_event", body, receiver.build_listing_reading)
+
+async def submit_transaction_batch(body):
+    return await submit_batch("transaction_event", body, receiver.build_transaction_reading)
+
+async def get_listings(start_timestamp, end_timestamp):
+    return [], 200
+
+async def get_transactions(start_timestamp, end_timestamp):
+    return [], 200
+
+
+def resolve_handler(function_name):
+    """openapi.yaml names the Flask handlers (app.*); serve them from this module instead."""
+    return globals()[function_name.rsplit('.', 1)[-1]]
+
+
+SPEC = load_spec(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'openapi.yaml'))
+
+connexion_app = connexion.AsyncApp(__name__, specification_dir='')
+connexion_app.add_api(SPEC, resolver=Resolver(resolve_handler), strict_validation=False, validate_responses=True)
+
+# The producer connects when the worker starts, so /health/ready reflects Kafka before the first request
+app = ASGIHealth(ASGIMetrics(connexion_app, operations_from_spec(SPEC)), on_startup=PRODUCER_QUEUE.start)
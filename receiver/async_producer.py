@@ -0,0 +1,107 @@
+import asyncio
+import logging
+
+from kafka.errors import KafkaTimeoutError
+
+from shared.health import retry_forever
+
+logger = logging.getLogger('basicLogger')
+
+
+class QueueFull(Exception):
+    """The producer queue stayed full for longer than the enqueue timeout."""
+
+
+def _resolve(delivered, metadata):
+    if not delivered.done():
+        delivered.set_result(metadata)
+
+
+def _fail(delivered, error):
+    if not delivered.done():
+        delivered.set_exception(error)
+
+
+def _report_late_failure(on_failure, delivered):
+    if not delivered.cancelled() and delivered.exception() is not None:
+        on_failure(delivered.exception())
+
+
+class AsyncProducerQueue:
+    """Bounded asyncio queue in front of a kafka-python producer.
+
+    Handlers await submit(), which resolves once the broker acknowledged the
+    message, without holding a thread while they wait. One drain task per
+    event loop moves messages into the (thread-safe, buffering) producer.
+    When the producer buffer is full the drain task backs off instead of
+    failing the message, so backpressure accumulates in this queue; once the
+    queue has been full for enqueue_timeout_s, submit() raises QueueFull and
+    the handler sheds the request.
+    """
+
+    def __init__(self, producer_factory, topic, max_size=10000, enqueue_timeout_s=0.5,
+                 delivery_timeout_s=10, retry_backoff_s=0.005):
+        self.producer_factory = producer_factory
+        self.topic = topic
+        self.max_size = max_size
+        self.enqueue_timeout_s = enqueue_timeout_s
+        self.delivery_timeout_s = delivery_timeout_s
+        self.retry_backoff_s = retry_backoff_s
+        self._queue = None
+        self._drain_task = None
+
+    def start(self):
+        """Create the queue and start draining it; must run inside the worker's event loop."""
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.max_size)
+            self._drain_task = asyncio.get_running_loop().create_task(self._drain())
+
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, value, on_late_failure=None):
+        """Queue value for the topic and wait for its delivery report.
+
+        Raises QueueFull, asyncio.TimeoutError if no report arrived within
+        delivery_timeout_s (the message stays queued and may still be
+        delivered; if it fails after all, on_late_failure(error) is called),
+        or the KafkaError of a failed delivery.
+        """
+        self.start()
+        delivered = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((value, delivered))
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self._queue.put((value, delivered)), self.enqueue_timeout_s)
+            except asyncio.TimeoutError:
+                raise QueueFull()
+        try:
+            # shield: a timed-out wait must not cancel the message itself
+            return await asyncio.wait_for(asyncio.shield(delivered), self.delivery_timeout_s)
+        except asyncio.TimeoutError:
+            if on_late_failure is not None:
+                delivered.add_done_callback(lambda d: _report_late_failure(on_late_failure, d))
+            raise
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        # Connect off the event loop, retrying until the broker answers
+        producer = await loop.run_in_executor(None, retry_forever, 'kafka-producer', self.producer_factory)
+        while True:
+            # Sent even if the handler stopped waiting: it answered 202 (queued)
+            value, delivered = await self._queue.get()
+            while True:
+                try:
+                    future = producer.send(self.topic, value)
+                    break
+                except KafkaTimeoutError:
+                    await asyncio.sleep(self.retry_backoff_s)  # producer buffer is full
+                except Exception as e:
+                    future = None
+                    _fail(delivered, e)
+                    break
+            if future is not None:
+                # Delivery reports arrive on the producer's I/O thread
+                future.add_callback(lambda metadata, d=delivered: loop.call_soon_threadsafe(_resolve, d, metadata))
+                future.add_errback(lambda error, d=delivered: loop.call_soon_threadsafe(_fail, d, error))
@@ -0,0 +1,39 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class RecentKeys:
+    """Bounded, thread-safe set of recently seen keys with a TTL.
+
+    Keys are kept in insertion order, so expired entries and the oldest
+    entries beyond max_size are always at the front and eviction is O(1).
+    """
+
+    def __init__(self, max_size=100000, ttl_s=600):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self._keys = OrderedDict()  # key -> time added
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        """Remember key; returns False if it was already seen within the TTL."""
+        now = time.monotonic()
+        with self._lock:
+            while self._keys:
+                oldest, added = next(iter(self._keys.items()))
+                if now - added < self.ttl_s and len(self._keys) < self.max_size:
+                    break
+                self._keys.popitem(last=False)
+            if key in self._keys:
+                return False
+            self._keys[key] = now
+            return True
+
+    def discard(self, key):
+        """Forget key, e.g. when the event could not be sent and may be retried."""
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def __len__(self):
+        return len(self._keys)
@@ -0,0 +1,232 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from kafka.errors import KafkaTimeoutError
+
+from shared.health import retry_forever
+
+logger = logging.getLogger('basicLogger')
+
+
+class Overloaded(Exception):
+    """The ingest queue is not admitting events; status is 429 or 503."""
+
+    def __init__(self, status, message, retry_after_s):
+        super().__init__(message)
+        self.status = status
+        self.retry_after_s = retry_after_s
+
+
+class IngestQueue:
+    """Bounded queue between the request handlers and the Kafka producer.
+
+    Handlers offer() encoded messages and get a Future for the delivery
+    report; a sender thread hands them to the producer, so a slow or
+    unreachable broker fills this queue instead of blocking request
+    threads. Admission has hysteresis: once the queue reaches
+    high_watermark every offer is shed until it has drained to
+    low_watermark. Shed requests get 429 while the broker is delivering
+    (the clients are simply sending too fast) and 503 while it is not;
+    with a spill log configured, events that arrive while the broker is
+    down are appended to disk instead and replayed once it delivers again.
+    """
+
+    def __init__(self, producer_factory, topic, max_size=10000, high_watermark=None, low_watermark=None,
+                 spill=None, retry_after_max_s=30, send_backoff_s=0.05, drain_interval_s=1, replay_timeout_s=60):
+        self.producer_factory = producer_factory
+        self.topic = topic
+        self.max_size = max_size
+        self.high_watermark = high_watermark if high_watermark is not None else int(max_size * 0.8)
+        self.low_watermark = low_watermark if low_watermark is not None else int(max_size * 0.5)
+        self.spill = spill
+        self.retry_after_max_s = retry_after_max_s
+        self.send_backoff_s = send_backoff_s
+        self.drain_interval_s = drain_interval_s
+        self.replay_timeout_s = replay_timeout_s
+
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._shedding = False
+        self._broker_available = True
+        self._in_flight = 0
+        self._delivered_rate = 0.0  # messages per second, exponentially weighted
+        self._rate_window = (time.monotonic(), 0)  # (window start, deliveries in window)
+        self._threads = None
+
+    def start(self):
+        """Start the sender (which connects to Kafka in the background); offer() does it on first use."""
+        if self._threads is None:
+            with self._lock:
+                if self._threads is None:
+                    self._threads = [threading.Thread(target=self._send_loop, name='ingest-sender', daemon=True)]
+                    if self.spill is not None:
+                        self._threads.append(threading.Thread(target=self._drain_spill, name='ingest-spill', daemon=True))
+                    for t in self._threads:
+                        t.start()
+
+    # --- admission ---------------------------------------------------------------
+
+    def offer(self, value):
+        """Queue value for Kafka.
+
+        Returns a Future resolved with the delivery report (or the
+        KafkaError of a failed delivery), or None if the value was spilled
+        to disk. Raises Overloaded if it was shed.
+        """
+        self.start()
+        with self._lock:
+            self._update_shedding()
+            if not self._shedding and len(self._queue) < self.max_size:
+                return self._enqueue(value)
+            broker_available = self._broker_available
+
+        if not broker_available and self.spill is not None and self.spill.append(value):
+            return None
+        retry_after = self.retry_after_s()
+        if broker_available:
+            raise Overloaded(429, "Too many events, slow down", retry_after)
+        raise Overloaded(503, "Kafka is unavailable, retry later", retry_after)
+
+    def _update_shedding(self):
+        # Called with the lock held, by offer() and whenever the sender takes a message
+        depth = len(self._queue)
+        if self._shedding and depth <= self.low_watermark:
+            self._shedding = False
+            logger.info(f"Ingest queue drained to {depth}, admitting events again")
+        elif not self._shedding and depth >= self.high_watermark:
+            self._shedding = True
+            logger.warning(f"Ingest queue reached {depth} events, shedding load")
+
+    def _enqueue(self, value):
+        future = Future()
+        self._queue.append((value, future))
+        self._not_empty.notify()
+        return future
+
+    def retry_after_s(self):
+        """Time for the queue to drain to the low watermark at the current delivery rate."""
+        backlog = max(len(self._queue) - self.low_watermark, 1)
+        if self._delivered_rate <= 0 or not self._broker_available:
+            return self.retry_after_max_s
+        return max(1, min(self.retry_after_max_s, math.ceil(backlog / self._delivered_rate)))
+
+    def depth(self):
+        return len(self._queue)
+
+    def in_flight(self):
+        return self._in_flight
+
+    def shedding(self):
+        return self._shedding
+
+    def broker_available(self):
+        return self._broker_available
+
+    def status(self):
+        return {
+            "depth": self.depth(),
+            "in_flight": self._in_flight,
+            "max_size": self.max_size,
+            "high_watermark": self.high_watermark,
+            "low_watermark": self.low_watermark,
+            "shedding": self._shedding,
+            "broker_available": self._broker_available,
+            "delivered_per_s": round(self._delivered_rate, 1),
+            "spilled_bytes": self.spill.size_bytes() if self.spill is not None else None,
+        }
+
+    # --- sending -----------------------------------------------------------------
+
+    def _connect(self):
+        try:
+            producer = self.producer_factory()
+            producer.partitions_for(self.topic)  # fetch the topic metadata now, not on the first send
+        except Exception:  # e.g. NoBrokersAvailable while Kafka is still starting
+            self._broker_available = False
+            raise
+        self._broker_available = True
+        return producer
+
+    def _send_loop(self):
+        producer = retry_forever('kafka-producer', self._connect)
+        while True:
+            with self._not_empty:
+                while not self._queue:
+                    self._not_empty.wait()
+                value, future = self._queue[0]  # stays queued (and counted) until the producer takes it
+            while True:
+                try:
+                    kafka_future = producer.send(self.topic, value)
+                    break
+                except KafkaTimeoutError:
+                    # Producer buffer full or no metadata: the broker is not keeping up
+                    self._broker_available = False
+                    time.sleep(self.send_backoff_s)
+                except Exception as e:
+                    kafka_future = None
+                    future.set_exception(e)
+                    break
+            with self._lock:
+                self._queue.popleft()
+                self._update_shedding()
+                if kafka_future is not None:
+                    self._in_flight += 1
+            if kafka_future is not None:
+                kafka_future.add_callback(self._delivered, future)
+                kafka_future.add_errback(self._failed, future)
+
+    def _delivered(self, future, metadata):
+        with self._lock:
+            self._in_flight -= 1
+            self._broker_available = True
+            started, count = self._rate_window
+            now = time.monotonic()
+            if now - started >= 1:
+                self._delivered_rate = 0.5 * self._delivered_rate + 0.5 * (count + 1) / (now - started)
+                self._rate_window = (now, 0)
+            else:
+                self._rate_window = (started, count + 1)
+        future.set_result(metadata)
+
+    def _failed(self, future, error):
+        with self._lock:
+            self._in_flight -= 1
+            self._broker_available = False
+        future.set_exception(error)
+
+    # --- spill replay ------------------------------------------------------------
+
+    def _drain_spill(self):
+        """Replay spilled segments, oldest first, whenever the broker delivers and the queue has room."""
+        while True:
+            time.sleep(self.drain_interval_s)
+            if not self._broker_available or self._shedding or not self.spill.size_bytes():
+                continue
+            for path in self.spill.closed_segments():
+                if not self._replay_segment(path):
+                    break
+
+    def _replay_segment(self, path):
+        futures = []
+        for value in self.spill.read(path):
+            # Stay below the low watermark so replay never causes live traffic to be shed
+            while len(self._queue) >= self.low_watermark:
+                if not self._broker_available:
+                    return False
+                time.sleep(self.send_backoff_s)
+            with self._lock:
+                futures.append(self._enqueue(value))
+        for future in futures:
+            try:
+                future.result(timeout=self.replay_timeout_s)
+            except Exception as e:
+                logger.warning(f"Replay of {path} failed, keeping it for the next attempt: {e}")
+                return False
+        self.spill.remove(path)
+        logger.info(f"Replayed {len(futures)} spilled events from {path}")
+        return True
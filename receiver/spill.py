@@ -0,0 +1,90 @@
+import logging
+import os
+import struct
+import threading
+
+logger = logging.getLogger('basicLogger')
+
+_LENGTH = struct.Struct('>I')
+
+
+class SpillLog:
+    """Append-only segment files holding messages that could not be handed to Kafka.
+
+    Each record is a 4-byte big-endian length followed by the encoded
+    message. Records are appended to the open segment until it reaches
+    segment_bytes; closed segments are replayed oldest first and deleted
+    once every record in them was delivered. A torn record at the end of a
+    segment (crash during a write) is ignored on replay. Nothing is fsynced,
+    so a spilled event survives a receiver crash but not a host crash.
+    """
+
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        existing = self._segment_paths()
+        self._next_sequence = int(os.path.basename(existing[-1])[8:-4]) + 1 if existing else 0
+        self._size = sum(os.path.getsize(path) for path in existing)
+        self._file = None
+        if existing:
+            logger.info(f"Found {len(existing)} spilled segment(s) ({self._size} bytes) in {directory}")
+
+    def _segment_paths(self):
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith('segment-') and name.endswith('.log'))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def size_bytes(self):
+        return self._size
+
+    def append(self, value):
+        """Append one message; returns False if the spill is full."""
+        record = _LENGTH.pack(len(value)) + value
+        with self._lock:
+            if self._size + len(record) > self.max_bytes:
+                return False
+            if self._file is None:
+                path = os.path.join(self.directory, f"segment-{self._next_sequence:012d}.log")
+                self._next_sequence += 1
+                self._file = open(path, 'ab')
+            self._file.write(record)
+            self._file.flush()  # hand it to the OS, so a process crash does not lose it
+            self._size += len(record)
+            if self._file.tell() >= self.segment_bytes:
+                self._close_segment()
+            return True
+
+    def _close_segment(self):
+        self._file.close()
+        self._file = None
+
+    def closed_segments(self):
+        """Segments ready for replay, oldest first; the open segment is closed first so it is included."""
+        with self._lock:
+            if self._file is not None:
+                self._close_segment()
+            return self._segment_paths()
+
+    @staticmethod
+    def read(path):
+        """Yield the records of a segment."""
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(_LENGTH.size)
+                if len(header) < _LENGTH.size:
+                    return
+                (length,) = _LENGTH.unpack(header)
+                value = f.read(length)
+                if len(value) < length:
+                    logger.warning(f"Ignoring torn record at the end of {path}")
+                    return
+                yield value
+
+    def remove(self, path):
+        size = os.path.getsize(path)
+        os.remove(path)
+        with self._lock:
+            self._size -= size
@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+
+import yaml
+
+RECEIVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.dirname(RECEIVER_DIR)
+
+sys.path.append(REPO_ROOT)
+
+
+def write_test_config():
+    """The repo's receiver config under a temporary APP_CONFIG_DIR, with logs and spill kept in it."""
+    root = tempfile.mkdtemp(prefix='receiver-config-')
+    os.makedirs(os.path.join(root, 'receiver'))
+    source = os.path.join(REPO_ROOT, 'config', 'receiver')
+    with open(os.path.join(source, 'receiver_conf.yaml')) as f:
+        config = yaml.safe_load(f)
+    config['events']['kafka'].update(hostname='127.0.0.1', port=9)  # nothing listens there
+    config['events']['ingest_queue']['spill']['directory'] = os.path.join(root, 'spill')
+    with open(os.path.join(root, 'receiver', 'receiver_conf.yaml'), 'w') as f:
+        yaml.safe_dump(config, f)
+    with open(os.path.join(source, 'receiver_log_conf.yml')) as f:
+        log_config = yaml.safe_load(f)
+    log_config['handlers']['file']['filename'] = os.path.join(root, 'app.log')
+    with open(os.path.join(root, 'receiver', 'receiver_log_conf.yml'), 'w') as f:
+        yaml.safe_dump(log_config, f)
+    return root
+
+
+CONFIG_ROOT = write_test_config()
+
+
+def pytest_pycollect_makemodule(module_path, parent):
+    """Import this service's app.py and config in its tests; every service has a flat app.py."""
+    if not getattr(sys.modules.get('app'), '__file__', '').startswith(RECEIVER_DIR):
+        sys.modules.pop('app', None)
+        if RECEIVER_DIR in sys.path:
+            sys.path.remove(RECEIVER_DIR)
+        sys.path.insert(0, RECEIVER_DIR)
+    os.environ['APP_CONFIG_DIR'] = CONFIG_ROOT
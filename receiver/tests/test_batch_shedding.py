@@ -0,0 +1,47 @@
+"""Batches the ingest queue only partly admitted must tell the client what to resend."""
+from concurrent.futures import Future
+
+import app as receiver
+from ingest_queue import Overloaded
+
+
+class AdmitFirst:
+    """Ingest queue that delivers the first `room` events and sheds the rest with 429."""
+
+    def __init__(self, room):
+        self.room = room
+
+    def offer(self, value):
+        if not self.room:
+            raise Overloaded(429, "Too many events, slow down", 7)
+        self.room -= 1
+        future = Future()
+        future.set_result('metadata')
+        return future
+
+
+def batch(prefix, size):
+    return [{'trace_id': f'{prefix}-{i}', 'user_id': 'u1', 'item_id': 'i1', 'price': 1.0,
+             'timestamp': '2026-01-01T12:00:00'} for i in range(size)]
+
+
+def test_partly_shed_batch_is_207_with_the_shed_items(monkeypatch):
+    monkeypatch.setattr(receiver, 'INGEST_QUEUE', AdmitFirst(2))
+    body, status, headers = receiver.submit_listing_batch(batch('part', 3) + [{'price': 1.0}])
+
+    assert status == 207
+    assert headers == {'Retry-After': '7'}
+    assert [r['status'] for r in body['results']] == ['accepted', 'accepted', 'shed', 'rejected']
+    assert (body['accepted'], body['shed'], body['rejected']) == (2, 1, 1)
+
+    # The shed event is not remembered as accepted, so resending it is not a duplicate
+    monkeypatch.setattr(receiver, 'INGEST_QUEUE', AdmitFirst(1))
+    body, status = receiver.submit_listing_batch(batch('part', 3)[2:])
+    assert status == 200
+    assert body['results'][0]['status'] == 'accepted'
+
+
+def test_fully_shed_batch_is_429(monkeypatch):
+    monkeypatch.setattr(receiver, 'INGEST_QUEUE', AdmitFirst(0))
+    _, status, headers = receiver.submit_listing_batch(batch('all', 2))
+    assert (status, headers) == (429, {'Retry-After': '7'})
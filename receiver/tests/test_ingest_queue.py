@@ -0,0 +1,124 @@
+"""Admission control of the ingest queue and replay of the spill log."""
+import threading
+import time
+
+import pytest
+
+from ingest_queue import IngestQueue, Overloaded
+from spill import SpillLog
+
+
+class DeliveredFuture:
+    def add_callback(self, f, *args):
+        f(*args, 'metadata')
+        return self
+
+    def add_errback(self, f, *args):
+        return self
+
+
+class GatedProducer:
+    """Delivers every message at once, but only sends one per permit and only connects while up."""
+
+    def __init__(self, permits=0, up=True):
+        self.permits = threading.Semaphore(permits)
+        self.up = up
+        self.sent = []
+
+    def connect(self):
+        if not self.up:
+            raise ConnectionError("no broker")
+        return self
+
+    def partitions_for(self, topic):
+        return {0}
+
+    def send(self, topic, value):
+        self.permits.acquire()
+        self.sent.append(value)
+        return DeliveredFuture()
+
+    def release(self, count=1):
+        for _ in range(count):
+            self.permits.release()
+
+
+def wait_for(condition, timeout_s=5):
+    deadline = time.monotonic() + timeout_s
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_shedding_starts_at_high_and_stops_at_low_watermark():
+    producer = GatedProducer()
+    queue = IngestQueue(producer.connect, 'events', max_size=10, high_watermark=5, low_watermark=2)
+    # The message the sender is blocked on stays counted until the producer takes it
+    futures = [queue.offer(b'%d' % i) for i in range(5)]
+    with pytest.raises(Overloaded) as shed:
+        queue.offer(b'5')
+    assert shed.value.status == 429  # the broker is up, the clients are too fast
+    assert queue.shedding()
+
+    producer.release(2)
+    wait_for(lambda: queue.depth() == 3)
+    with pytest.raises(Overloaded):
+        queue.offer(b'7')  # still above the low watermark
+
+    producer.release()
+    wait_for(lambda: queue.depth() == 2)
+    assert not queue.shedding()
+    futures.append(queue.offer(b'8'))
+
+    producer.release(10)
+    assert [future.result(timeout=5) for future in futures] == ['metadata'] * 6
+    wait_for(lambda: queue.depth() == 0)
+    assert producer.sent == [b'0', b'1', b'2', b'3', b'4', b'8']
+
+
+def test_events_spilled_while_kafka_is_down_are_replayed(tmp_path):
+    producer = GatedProducer(permits=100, up=False)
+    spill = SpillLog(str(tmp_path), segment_bytes=8)
+    queue = IngestQueue(producer.connect, 'events', max_size=10, high_watermark=2, low_watermark=1,
+                        spill=spill, drain_interval_s=0.05)
+    queued = [queue.offer(b'queued-%d' % i) for i in range(2)]
+    wait_for(lambda: not queue.broker_available())
+
+    assert [queue.offer(b'spilled-%d' % i) for i in range(3)] == [None] * 3
+    assert len(spill.closed_segments()) == 3  # one record fills an 8 byte segment
+    assert [value for path in spill.closed_segments() for value in SpillLog.read(path)] == \
+        [b'spilled-0', b'spilled-1', b'spilled-2']
+
+    producer.up = True  # the sender reconnects on its next retry
+    assert [future.result(timeout=5) for future in queued] == ['metadata'] * 2
+    wait_for(lambda: spill.size_bytes() == 0)
+    assert producer.sent == [b'queued-0', b'queued-1', b'spilled-0', b'spilled-1', b'spilled-2']
+    assert spill.closed_segments() == []
+
+
+def test_full_spill_sheds_with_503(tmp_path):
+    producer = GatedProducer(up=False)
+    spill = SpillLog(str(tmp_path), max_bytes=20)
+    queue = IngestQueue(producer.connect, 'events', max_size=10, high_watermark=1, low_watermark=0, spill=spill)
+    queue.offer(b'queued')
+    wait_for(lambda: not queue.broker_available())
+
+    assert queue.offer(b'spilled') is None
+    with pytest.raises(Overloaded) as shed:
+        queue.offer(b'no room left')
+    assert shed.value.status == 503
+    assert shed.value.retry_after_s == queue.retry_after_max_s
+
+
+def test_torn_record_at_the_end_of_a_segment_is_ignored(tmp_path):
+    spill = SpillLog(str(tmp_path))
+    spill.append(b'first')
+    spill.append(b'second')
+    [path] = spill.closed_segments()
+    with open(path, 'ab') as f:
+        f.write(b'\x00\x00\x00\x10trunc')  # crash in the middle of a write
+
+    assert list(SpillLog.read(path)) == [b'first', b'second']
+    reopened = SpillLog(str(tmp_path))  # after a restart new records go to a new segment
+    reopened.append(b'third')
+    assert [list(SpillLog.read(p)) for p in reopened.closed_segments()] == [[b'first', b'second'], [b'third']]
@@ -0,0 +1,17 @@
+"""The receiver's producer settings must be accepted by the installed kafka-python."""
+import app as receiver
+
+
+def test_ingest_producer_is_created_through_the_pool(monkeypatch):
+    # A fixed api_version skips the broker version probe, so no broker is needed
+    monkeypatch.setitem(receiver.kafka_pool.config, 'producer',
+                        {**receiver.kafka_pool.config.get('producer', {}), 'api_version': (2, 6)})
+    monkeypatch.setattr(receiver.kafka_pool, '_producers', {})
+
+    producer = receiver.get_ingest_producer()
+    try:
+        assert producer.config['linger_ms'] == receiver.BATCH_LINGER_MS
+        assert producer.config['batch_size'] == receiver.BATCH_SIZE_BYTES
+        assert receiver.kafka_pool.producer('ingest') is producer
+    finally:
+        producer.close(timeout=0)
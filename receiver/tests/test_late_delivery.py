@@ -0,0 +1,43 @@
+"""A queued (202) event whose delivery fails later must not block the client's retry."""
+from concurrent.futures import Future
+
+import app as receiver
+
+LISTING = {'trace_id': 'late-1', 'user_id': 'u1', 'item_id': 'i1', 'price': 10.0,
+           'timestamp': '2026-01-01T12:00:00'}
+
+
+class PendingQueue:
+    """Ingest queue whose deliveries are resolved by the test."""
+
+    def __init__(self):
+        self.deliveries = []
+
+    def offer(self, value):
+        self.deliveries.append(Future())
+        return self.deliveries[-1]
+
+
+def test_failed_late_delivery_forgets_the_trace_id(monkeypatch):
+    queue = PendingQueue()
+    monkeypatch.setattr(receiver, 'INGEST_QUEUE', queue)
+    monkeypatch.setattr(receiver, 'INGEST_ACK_TIMEOUT_S', 0.01)
+
+    assert receiver.submit_listing_event(dict(LISTING))[1] == 202
+    assert receiver.submit_listing_event(dict(LISTING))[1] == 200  # duplicate while still queued
+
+    queue.deliveries[0].set_exception(TimeoutError("no ack from the broker"))
+    assert receiver.submit_listing_event(dict(LISTING))[1] == 202
+    assert len(queue.deliveries) == 2
+
+
+def test_failed_late_batch_delivery_forgets_the_trace_id(monkeypatch):
+    queue = PendingQueue()
+    monkeypatch.setattr(receiver, 'INGEST_QUEUE', queue)
+    monkeypatch.setattr(receiver, 'BATCH_DELIVERY_TIMEOUT_S', 0.01)
+    batch = [dict(LISTING, trace_id='late-2')]
+
+    assert receiver.submit_listing_batch(batch)[0]['results'][0]['status'] == 'queued'
+    queue.deliveries[0].set_exception(TimeoutError("no ack from the broker"))
+    assert receiver.submit_listing_batch(batch)[0]['results'][0]['status'] == 'queued'
+    assert len(queue.deliveries) == 2
@@ -0,0 +1,147 @@
+"""Liveness and readiness reporting, and retried initialization of external resources.
+
+Services create their Kafka clients and database schema in background
+threads with retry_forever() instead of at import, so a broker or database
+that is down at startup delays readiness instead of crashing the process.
+
+    /health/live   200 while the process serves requests and every watched
+                   thread is alive, 503 once one of them has died
+    /health/ready  200 once every registered component is initialized,
+                   503 with the per-component state before that
+"""
+import json
+import logging
+import threading
+import time
+
+from flask import jsonify
+
+logger = logging.getLogger('basicLogger')
+
+STARTED = time.monotonic()
+
+
+class Readiness:
+    """Initialization state of the components a service needs before it can take traffic."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._components = {}  # name -> state dict
+        self._threads = {}     # name -> thread that must stay alive
+
+    def register(self, name):
+        with self._lock:
+            self._components.setdefault(name, {'state': 'pending', 'attempts': 0, 'error': None, 'ready_after_s': None})
+
+    def attempt_failed(self, name, error):
+        with self._lock:
+            component = self._components.setdefault(name, {'ready_after_s': None})
+            component.update(state='retrying', error=str(error), attempts=component.get('attempts', 0) + 1)
+
+    def ready(self, name):
+        with self._lock:
+            component = self._components.setdefault(name, {'attempts': 0})
+            component.update(state='ready', error=None, ready_after_s=round(time.monotonic() - STARTED, 3))
+            component['attempts'] = component.get('attempts', 0) + 1
+
+    def watch(self, name, thread):
+        """Report the process as not live once `thread` has stopped."""
+        with self._lock:
+            self._threads[name] = thread
+
+    def is_ready(self):
+        with self._lock:
+            return all(component['state'] == 'ready' for component in self._components.values())
+
+    def dead_threads(self):
+        with self._lock:
+            return sorted(name for name, thread in self._threads.items() if not thread.is_alive())
+
+    def status(self):
+        with self._lock:
+            return {name: dict(component) for name, component in self._components.items()}
+
+
+READINESS = Readiness()
+
+
+def retry_forever(name, func, initial_backoff_s=0.5, max_backoff_s=30, readiness=READINESS):
+    """Call func until it returns, backing off exponentially between failures, and return its result."""
+    readiness.register(name)
+    backoff = initial_backoff_s
+    while True:
+        try:
+            result = func()
+        except Exception as e:
+            readiness.attempt_failed(name, e)
+            logger.warning(f"Initializing {name} failed, retrying in {backoff:.1f} s: {type(e).__name__} {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff_s)
+            continue
+        readiness.ready(name)
+        logger.info(f"Initialized {name}")
+        return result
+
+
+def start_thread(name, target, *args, readiness=READINESS):
+    """Start a daemon thread whose death makes the process report not live."""
+    t = threading.Thread(target=target, args=args, name=name)
+    t.daemon = True
+    t.start()
+    readiness.watch(name, t)
+    return t
+
+
+def liveness(readiness=READINESS):
+    dead = readiness.dead_threads()
+    body = {'status': 'dead' if dead else 'alive', 'uptime_s': round(time.monotonic() - STARTED, 3)}
+    if dead:
+        body['dead_threads'] = dead
+    return body, 503 if dead else 200
+
+
+def readiness_status(readiness=READINESS):
+    ready = readiness.is_ready()
+    return {'status': 'ready' if ready else 'initializing', 'components': readiness.status()}, 200 if ready else 503
+
+
+def add_health_routes(flask_app, readiness=READINESS):
+    def live():
+        body, status = liveness(readiness)
+        return jsonify(body), status
+
+    def ready():
+        body, status = readiness_status(readiness)
+        return jsonify(body), status
+
+    flask_app.add_url_rule('/health/live', 'health_live', live)
+    flask_app.add_url_rule('/health/ready', 'health_ready', ready)
+
+
+class ASGIHealth:
+    """The health routes for an ASGI app; on_startup runs in the event loop at lifespan startup."""
+
+    def __init__(self, app, on_startup=None, readiness=READINESS):
+        self.app = app
+        self.on_startup = on_startup
+        self.readiness = readiness
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan' and self.on_startup is not None:
+            return await self.app(scope, self._lifespan_receive(receive), send)
+        if scope['type'] == 'http' and scope['path'] in ('/health/live', '/health/ready'):
+            check = liveness if scope['path'] == '/health/live' else readiness_status
+            body, status = check(self.readiness)
+            await send({'type': 'http.response.start', 'status': status,
+                        'headers': [(b'content-type', b'application/json')]})
+            await send({'type': 'http.response.body', 'body': json.dumps(body).encode()})
+            return
+        return await self.app(scope, receive, send)
+
+    def _lifespan_receive(self, receive):
+        async def wrapped():
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.on_startup()
+            return message
+        return wrapped
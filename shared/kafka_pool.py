@@ -0,0 +1,116 @@
+import atexit
+import logging
+import threading
+
+from kafka import KafkaConsumer, KafkaProducer
+from kafka.errors import IllegalStateError
+
+logger = logging.getLogger('basicLogger')
+
+
+class KafkaPool:
+    """Lazily created, shared Kafka producers and consumers for one service.
+
+    Built from the `kafka` section of the service's *_conf.yaml
+    (hostname, optional port, topic, and optional `producer`/`consumer`
+    dicts of kafka-python settings). Producers are thread-safe and are
+    created once per name and reused by every request thread, so their
+    broker connections and cached topic metadata are shared. Consumers are
+    not thread-safe, so each call to consumer() returns a new one; the pool
+    only keeps track of them so they are closed on shutdown.
+    """
+
+    def __init__(self, kafka_config):
+        self.config = kafka_config
+        self.topic = kafka_config['topic']
+        if 'port' in kafka_config:
+            self.bootstrap_servers = f"{kafka_config['hostname']}:{kafka_config['port']}"
+        else:
+            self.bootstrap_servers = kafka_config['hostname']
+        self._common = {
+            'bootstrap_servers': self.bootstrap_servers,
+            'metadata_max_age_ms': kafka_config.get('metadata_max_age_ms', 300000),
+        }
+        self._producers = {}
+        self._consumers = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def producer(self, name='default', **overrides):
+        """Return the shared producer called `name`, creating it on first use.
+
+        `overrides` only apply when the producer is created; later calls
+        with the same name get the existing instance.
+        """
+        producer = self._producers.get(name)
+        if producer is not None:
+            return producer
+        with self._lock:
+            if name not in self._producers:
+                settings = {**self._common, **self.config.get('producer', {}), **overrides}
+                logger.info(f"Creating Kafka producer '{name}' for {self.bootstrap_servers}")
+                self._producers[name] = KafkaProducer(**settings)
+            return self._producers[name]
+
+    def consumer(self, *topics, **overrides):
+        """Create a new consumer (one per thread), optionally subscribed to topics."""
+        settings = {**self._common, **self.config.get('consumer', {}), **overrides}
+        consumer = KafkaConsumer(*topics, **settings)
+        with self._lock:
+            self._consumers.append(consumer)
+        return consumer
+
+    def close(self, timeout=10):
+        """Flush and close the producers, then close the consumers."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            producers, consumers = list(self._producers.items()), list(self._consumers)
+        for name, producer in producers:
+            try:
+                producer.flush(timeout=timeout)
+                producer.close(timeout=timeout)
+            except Exception as e:
+                logger.error(f"Failed to flush Kafka producer '{name}': {e}")
+        for consumer in consumers:
+            try:
+                consumer.close(autocommit=False)
+            except Exception as e:
+                logger.error(f"Failed to close Kafka consumer: {e}")
+
+
+def partition_lag(consumer):
+    """{partition: messages behind the high watermark} for the consumer's assigned partitions.
+
+    Call from the thread that owns the consumer, right after a poll.
+    """
+    lag = {}
+    for tp in consumer.assignment():
+        highwater = consumer.highwater(tp)
+        if highwater is None:
+            continue  # no fetch response for this partition yet
+        try:
+            lag[tp.partition] = max(0, highwater - consumer.position(tp))
+        except IllegalStateError:
+            continue  # revoked during a rebalance
+    return lag
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(kafka_config):
+    """Return the process-wide pool for this kafka config section."""
+    key = (kafka_config['hostname'], kafka_config.get('port'), kafka_config['topic'])
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = KafkaPool(kafka_config)
+        return _pools[key]
+
+
+@atexit.register
+def _close_pools():
+    for pool in list(_pools.values()):
+        pool.close()
@@ -0,0 +1,167 @@
+import os
+import time
+
+from flask import Response, g, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Request latencies are mostly sub-millisecond to tens of milliseconds, so the
+# default buckets (starting at 5 ms) are extended downwards
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by OpenAPI operation',
+    ['operation', 'method', 'status'], buckets=LATENCY_BUCKETS
+)
+
+_request_children = {}  # (operation, method, status) -> histogram child, skips the labels() lookup
+
+
+def operation_name(endpoint):
+    """Operation label for a Flask endpoint.
+
+    Connexion registers operationId 'app.get_listings' as endpoint
+    '<api blueprint>.app_get_listings'; plain Flask routes keep their name.
+    """
+    return endpoint.rsplit('.', 1)[-1] if endpoint else 'unmatched'
+
+
+def _start_timer():
+    g.metrics_started = time.perf_counter()
+
+
+def _observe_request(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        key = (request.endpoint, request.method, response.status_code)
+        child = _request_children.get(key)
+        if child is None:
+            child = _request_children[key] = REQUEST_LATENCY.labels(operation_name(key[0]), key[1], key[2])
+        # Streamed responses (NDJSON) are timed to the first byte
+        child.observe(time.perf_counter() - started)
+    return response
+
+
+_callback_collectors = []  # every callback_metric(), also exported in multiprocess mode
+
+
+def scrape_registry():
+    """Registry to export; merges all worker processes when PROMETHEUS_MULTIPROC_DIR is set.
+
+    Callback metrics read process state at scrape time and have no
+    multiprocess files, so in that mode they report the state of the worker
+    serving the scrape.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for collector in _callback_collectors:
+        registry.register(collector)
+    return registry
+
+
+def metrics_view():
+    return Response(generate_latest(scrape_registry()), mimetype=CONTENT_TYPE_LATEST)
+
+
+def instrument_app(flask_app):
+    """Time every request by operation and serve the registry at /metrics."""
+    flask_app.before_request(_start_timer)
+    flask_app.after_request(_observe_request)
+    flask_app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+class ASGIMetrics:
+    """ASGI counterpart of instrument_app() for a connexion AsyncApp.
+
+    `operations` maps (METHOD, path) to the operationId, e.g. from
+    operations_from_spec(); the label matches the Flask one.
+    """
+
+    def __init__(self, app, operations):
+        self.app = app
+        self.operations = {key: operation_id.replace('.', '_') for key, operation_id in operations.items()}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        if scope['path'] == '/metrics':
+            return await self._metrics(send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            key = (self.operations.get((scope['method'], scope['path']), 'unmatched'), scope['method'], status)
+            child = _request_children.get(key)
+            if child is None:
+                child = _request_children[key] = REQUEST_LATENCY.labels(*key)
+            child.observe(time.perf_counter() - started)
+
+    @staticmethod
+    async def _metrics(send):
+        body = generate_latest(scrape_registry())
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', CONTENT_TYPE_LATEST.encode('ascii'))]})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def operations_from_spec(spec, base_path=''):
+    """{(METHOD, path): operationId} for the operations of a loaded OpenAPI document."""
+    return {
+        (method.upper(), base_path + path): operation['operationId']
+        for path, methods in spec.get('paths', {}).items()
+        for method, operation in methods.items()
+        if isinstance(operation, dict) and 'operationId' in operation
+    }
+
+
+class CallbackCollector:
+    """Metric whose value is read from the service state at scrape time.
+
+    func returns a number, or a {label values tuple: number} dict when
+    labels are given. Nothing is recorded on the hot path.
+    """
+
+    def __init__(self, name, documentation, func, labels=(), kind='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.labels = list(labels)
+        self.family = CounterMetricFamily if kind == 'counter' else GaugeMetricFamily
+
+    def collect(self):
+        family = self.family(self.name, self.documentation, labels=self.labels)
+        values = self.func()
+        if self.labels:
+            for label_values, value in values.items():
+                family.add_metric([str(v) for v in label_values], value)
+        elif values is not None:
+            family.add_metric([], values)
+        yield family
+
+
+def callback_metric(name, documentation, func, labels=(), kind='gauge'):
+    collector = CallbackCollector(name, documentation, func, labels, kind)
+    REGISTRY.register(collector)
+    _callback_collectors.append(collector)
+
+
+def register_cache(cache, name='response_cache'):
+    """Export the hit/miss/eviction counters of a shared.response_cache cache."""
+    if cache is None:
+        return
+    callback_metric(f'{name}_hits', 'Cache hits', lambda: cache.stats.hits, kind='counter')
+    callback_metric(f'{name}_misses', 'Cache misses', lambda: cache.stats.misses, kind='counter')
+    callback_metric(f'{name}_evictions', 'Entries evicted to stay within the size bounds',
+                    lambda: cache.stats.evictions, kind='counter')
+
@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger('basicLogger')
+
+
+class CacheStats:
+    """Hit/miss/eviction counters shared by the cache backends."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def to_dict(self, **extra):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            **extra,
+        }
+
+
+class MemoryCache:
+    """In-process LRU cache of bytes values with a TTL, bounded by entries and total size."""
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024, ttl_s=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.stats = CacheStats()
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl_s=None):
+        if len(value) > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (ttl_s or self.ttl_s)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, value)
+            self._size += len(value)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.stats.evictions += 1
+
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self._size -= len(value)
+
+    def info(self):
+        with self._lock:
+            return self.stats.to_dict(backend='memory', entries=len(self._entries), bytes=self._size)
+
+
+class RedisCache:
+    """Same interface backed by a (local) Redis-compatible server; eviction is left to its maxmemory policy."""
+
+    def __init__(self, url, ttl_s=300, prefix='cache:'):
+        if redis is None:
+            raise RuntimeError("The redis cache backend requires the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.ttl_s = ttl_s
+        self.prefix = prefix
+        self.stats = CacheStats()
+
+    def get(self, key):
+        try:
+            value = self.client.get(self.prefix + key)
+        except redis.RedisError as e:
+            logger.warning(f"Redis cache unavailable: {e}")
+            value = None
+        if value is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        return value
+
+    def set(self, key, value, ttl_s=None):
+        try:
+            self.client.set(self.prefix + key, value, ex=ttl_s or self.ttl_s)
+        except redis.RedisError as e:
+            logger.warning(f"Redis cache unavailable: {e}")
+
+    def info(self):
+        return self.stats.to_dict(backend='redis')
+
+
+def create_cache(cache_config, prefix):
+    """Build the cache described by a service's `cache` config section."""
+    ttl_s = cache_config.get('ttl_s', 300)
+    if cache_config.get('backend', 'memory') == 'redis':
+        return RedisCache(cache_config.get('redis_url', 'redis://localhost:6379/0'), ttl_s=ttl_s, prefix=prefix)
+    return MemoryCache(
+        max_entries=cache_config.get('max_entries', 10000),
+        max_bytes=cache_config.get('max_bytes', 64 * 1024 * 1024),
+        ttl_s=ttl_s
+    )
+
+
+def etag(body):
+    """Strong ETag value for a response body."""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
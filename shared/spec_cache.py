@@ -0,0 +1,53 @@
+"""Parsed OpenAPI documents, cached as JSON next to the YAML source.
+
+Connexion parses the YAML with the pure-Python loader on every start, which
+is most of the cost of add_api(). load_spec() returns the same document from
+<dir>/__pycache__/<name>.<content hash>.json instead, parsing the YAML (with
+libyaml when available) only when the file changed. The Dockerfiles run
+`python -m shared.spec_cache openapi.yaml` so images ship with the cache
+already built.
+"""
+import hashlib
+import json
+import os
+import sys
+
+import yaml
+
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def _cache_path(path, raw):
+    directory, name = os.path.split(os.path.abspath(path))
+    digest = hashlib.sha256(raw).hexdigest()[:16]
+    return os.path.join(directory, '__pycache__', f"{os.path.splitext(name)[0]}.{digest}.json")
+
+
+def load_spec(path):
+    """The OpenAPI document at path as a dict, ready for connexion's add_api()."""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    cache_path = _cache_path(path, raw)
+    try:
+        with open(cache_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    # Round-trip through JSON so a fresh parse returns exactly what the cache would
+    spec = json.loads(json.dumps(yaml.load(raw, Loader=_Loader), default=str))
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(spec, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass  # read-only image; parsing again next time is fine
+    return spec
+
+
+if __name__ == '__main__':
+    for spec_path in sys.argv[1:]:
+        load_spec(spec_path)
+        print(f"Cached {spec_path}")
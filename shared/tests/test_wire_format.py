@@ -0,0 +1,99 @@
+"""Events must survive encoding, producer compression and decoding in every supported format."""
+import json
+
+import pytest
+from kafka import codec
+from kafka.record.default_records import DefaultRecordBatch
+from kafka.record.memory_records import MemoryRecords, MemoryRecordsBuilder
+
+from shared import wire_format
+
+LISTING = {
+    'type': 'listing_event',
+    'datetime': '2026-01-01T12:00:05',
+    'payload': {'trace_id': 't-1', 'user_id': 'u1', 'item_id': 'i1', 'price': 19.99,
+                'timestamp': '2026-01-01T11:59:59.123456'},
+}
+TRANSACTION = {
+    'type': 'transaction_event',
+    'datetime': '2026-01-01T12:00:05',
+    'payload': {'trace_id': 't-2', 'user_id': 'u2', 'transaction_id': 'x1', 'amount': 5,
+                'timestamp': '2026-01-01T12:00:00'},
+}
+
+
+@pytest.mark.parametrize('envelope', [LISTING, TRANSACTION], ids=['listing', 'transaction'])
+@pytest.mark.parametrize('fmt', wire_format.FORMATS)
+def test_round_trip(envelope, fmt):
+    raw = wire_format.encode(envelope, fmt)
+    assert wire_format.decode(raw) == envelope
+    assert wire_format.event_type(raw) == envelope['type']
+
+
+def test_msgpack_is_binary_and_smaller():
+    raw = wire_format.encode(LISTING, 'msgpack')
+    assert raw[:2] == bytes((wire_format.MAGIC, wire_format.SCHEMA_IDS['listing_event']))
+    assert len(raw) < len(wire_format.encode(LISTING, 'json'))
+
+
+def test_timestamps_travel_as_utc():
+    envelope = {**LISTING, 'payload': {**LISTING['payload'], 'timestamp': '2026-01-01T13:59:59.123456+02:00'}}
+    assert wire_format.decode(wire_format.encode(envelope, 'msgpack')) == LISTING
+
+
+def test_unknown_event_type_falls_back_to_json():
+    envelope = {'type': 'rating_event', 'datetime': '2026-01-01T12:00:05', 'payload': {'stars': 5}}
+    raw = wire_format.encode(envelope, 'msgpack')
+    assert raw.startswith(b'{')
+    assert wire_format.decode(raw) == envelope
+
+
+def test_legacy_json_messages_still_decode():
+    # As produced before the binary format: json.dumps of the envelope, with spaces
+    raw = json.dumps(LISTING).encode('utf-8')
+    assert wire_format.decode(raw) == LISTING
+    assert wire_format.event_type(raw) == 'listing_event'
+
+
+@pytest.mark.parametrize('raw', [
+    b'',
+    bytes((wire_format.MAGIC,)),
+    bytes((wire_format.MAGIC, 99)) + b'\x90',
+    wire_format.encode(LISTING, 'msgpack')[:-3],
+    bytes((wire_format.MAGIC, 1)) + b'\x92\x01\x02',
+], ids=['empty', 'no-schema', 'unknown-schema', 'truncated', 'wrong-arity'])
+def test_malformed_binary_messages_raise_value_error(raw):
+    with pytest.raises(ValueError):
+        wire_format.decode(raw)
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        wire_format.encode(LISTING, 'avro')
+
+
+CODECS = {
+    'gzip': (codec.has_gzip, DefaultRecordBatch.CODEC_GZIP),
+    'snappy': (codec.has_snappy, DefaultRecordBatch.CODEC_SNAPPY),
+    'lz4': (codec.has_lz4, DefaultRecordBatch.CODEC_LZ4),
+    'zstd': (codec.has_zstd, DefaultRecordBatch.CODEC_ZSTD),
+}
+
+
+@pytest.mark.parametrize('compression', sorted(CODECS))
+@pytest.mark.parametrize('fmt', wire_format.FORMATS)
+def test_round_trip_through_a_compressed_record_batch(compression, fmt):
+    """The producer's compression_type (config/receiver) must not alter the messages."""
+    available, compression_id = CODECS[compression]
+    if not available():
+        pytest.skip(f"{compression} codec is not installed")
+    messages = [wire_format.encode(LISTING, fmt), wire_format.encode(TRANSACTION, fmt),
+                json.dumps(LISTING).encode('utf-8')]
+    builder = MemoryRecordsBuilder(magic=2, compression_type=compression_id, batch_size=1 << 20)
+    for message in messages:
+        builder.append(timestamp=None, key=None, value=message)
+    builder.close()
+
+    batch = MemoryRecords(bytes(builder.buffer())).next_batch()
+    assert batch.compression_type == compression_id
+    assert [wire_format.decode(record.value) for record in batch] == [LISTING, TRANSACTION, LISTING]
@@ -0,0 +1,102 @@
+from datetime import datetime, timezone
+
+# orjson is considerably faster than the standard library; fall back to json
+try:
+    from orjson import loads as json_loads, dumps as json_dumps
+except ImportError:
+    from json import loads as json_loads, dumps as _dumps
+
+    def json_dumps(obj):
+        return _dumps(obj).encode('utf-8')
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Binary messages start with MAGIC followed by a one byte schema id. Legacy
+# JSON messages always start with '{', so both can share the topic.
+MAGIC = 0x00
+
+# schema id -> (envelope type, payload fields in wire order). The payload
+# "timestamp" and the envelope "datetime" travel as microseconds since the
+# epoch (UTC); every other field is sent as is. Only ever append new ids.
+SCHEMAS = {
+    1: ('listing_event', ('trace_id', 'user_id', 'item_id', 'price', 'timestamp')),
+    2: ('transaction_event', ('trace_id', 'user_id', 'transaction_id', 'amount', 'timestamp')),
+}
+SCHEMA_IDS = {event_type: schema_id for schema_id, (event_type, _) in SCHEMAS.items()}
+
+FORMATS = ('json', 'msgpack')
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def to_micros(value):
+    """ISO-8601 string -> microseconds since the epoch; naive times are taken as UTC."""
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    delta = timestamp - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def from_micros(value):
+    seconds, micros = divmod(value, 1000000)
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(microsecond=micros, tzinfo=None).isoformat()
+
+
+def encode(envelope, wire_format='json'):
+    """Serialize a {"type", "datetime", "payload"} envelope for the events topic."""
+    schema_id = SCHEMA_IDS.get(envelope['type'])
+    if wire_format == 'json' or schema_id is None:
+        return json_dumps(envelope)
+    if wire_format != 'msgpack':
+        raise ValueError(f"Unknown wire format: {wire_format!r}")
+    if msgpack is None:
+        raise RuntimeError("The msgpack wire format requires the msgpack package")
+
+    payload = envelope['payload']
+    fields = SCHEMAS[schema_id][1]
+    record = [to_micros(envelope['datetime'])]
+    record.extend(to_micros(payload[f]) if f == 'timestamp' else payload[f] for f in fields)
+    return bytes((MAGIC, schema_id)) + msgpack.packb(record, use_bin_type=True)
+
+
+def decode(raw):
+    """Deserialize a message from the events topic into an envelope dict.
+
+    Accepts both the binary format and legacy JSON. Raises ValueError if
+    the message cannot be decoded.
+    """
+    if not raw:
+        raise ValueError("Empty message")
+    if raw[0] != MAGIC:
+        return json_loads(raw)
+
+    if len(raw) < 2 or raw[1] not in SCHEMAS:
+        raise ValueError(f"Unknown schema id: {raw[1] if len(raw) > 1 else None}")
+    if msgpack is None:
+        raise RuntimeError("Decoding binary events requires the msgpack package")
+    event_type, fields = SCHEMAS[raw[1]]
+    try:
+        record = msgpack.unpackb(raw[2:], raw=False)
+    except Exception as e:
+        raise ValueError(f"Malformed msgpack record: {e}")
+    if not isinstance(record, list) or len(record) != len(fields) + 1:
+        raise ValueError(f"Record does not match schema {raw[1]}")
+
+    try:
+        payload = {f: from_micros(v) if f == 'timestamp' else v for f, v in zip(fields, record[1:])}
+        return {'type': event_type, 'datetime': from_micros(record[0]), 'payload': payload}
+    except (TypeError, OverflowError, OSError) as e:
+        raise ValueError(f"Invalid timestamp in record: {e}")
+
+
+def event_type(raw):
+    """Return the envelope type without decoding the whole message when possible."""
+    if raw and raw[0] == MAGIC:
+        schema = SCHEMAS.get(raw[1]) if len(raw) > 1 else None
+        return schema[0] if schema else None
+    data = json_loads(raw)
+    return data.get('type') if isinstance(data, dict) else None
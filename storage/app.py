@@ -1,19 +1,39 @@
 import yaml
 import logging
 import logging.config
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from db_class import SubmitListingEvent, SubmitTransactionEvent
-from db_setup import get_session
+from db_setup import get_session, get_read_session, init_db, insert_ignore, write_engine, read_engine
+from partitions import (ROLLUPS, HOUR_FORMAT, bucket_expression, dirty_hours, mark_late_hours, rolled_up_until,
+                        run_maintenance, utcnow)
+from events import decode_event, InvalidEvent, ListingEvent
+import export
+from shared.kafka_pool import get_pool, partition_lag
+from shared.response_cache import create_cache, etag
+from shared.metrics import instrument_app, register_cache, LATENCY_BUCKETS
+from shared.health import READINESS, add_health_routes, retry_forever, start_thread
+from shared.spec_cache import load_spec
+from prometheus_client import Counter, Gauge, Histogram
 import threading
-from kafka import KafkaConsumer
-import uuid
+import time
+from sqlalchemy import select, func, and_, or_
+from sqlalchemy.exc import DBAPIError, DataError, IntegrityError, StatementError
+from kafka import ConsumerRebalanceListener
+from kafka.coordinator.assignors.roundrobin import RoundRobinPartitionAssignor
+from kafka.coordinator.assignors.sticky.sticky_assignor import StickyPartitionAssignor
+import base64
+import math
 import json
 import os
+import sys
 import connexion
-from flask import request, jsonify  # still needed for request args and JSON response
+from flask import request, jsonify, Response, stream_with_context  # still needed for request args and JSON response
+
+# /app/config/storage in the container; APP_CONFIG_DIR points elsewhere (tests)
+CONFIG_DIR = os.path.join(os.environ.get('APP_CONFIG_DIR', '/app/config'), 'storage')
 
 # Load configuration file for database settings
-with open("/app/config/storage/storage_conf.yaml", "r") as f:
+with open(os.path.join(CONFIG_DIR, "storage_conf.yaml"), "r") as f:
     config = yaml.safe_load(f)
 
 db_config = config['datastore']
@@ -25,146 +45,591 @@ db_name = db_config['db']
 
 # Kafka configuration (from app_conf.yaml)
 kafka_config = config['kafka']
-KAFKA_SERVER = f"{kafka_config['hostname']}:{kafka_config['port']}"
 KAFKA_TOPIC = kafka_config['topic']
+KAFKA_GROUP_ID = kafka_config.get('group_id', 'storage')
+KAFKA_DEAD_LETTER_TOPIC = kafka_config.get('dead_letter_topic', f"{KAFKA_TOPIC}.dlq")
+
+# Consumer group settings: 'single' runs one consumer thread, 'group' runs
+# `workers` threads that share the topic partitions (and scale across replicas)
+consumer_config = config.get('consumers', {})
+CONSUMER_MODE = consumer_config.get('mode', 'single')
+CONSUMER_WORKERS = consumer_config.get('workers', 1)
+PARTITION_ASSIGNORS = (StickyPartitionAssignor, RoundRobinPartitionAssignor)
+
+# Micro-batch writer settings
+batch_config = config.get('batch', {})
+BATCH_MAX_ROWS = batch_config.get('max_rows', 500)
+BATCH_MAX_WAIT_MS = batch_config.get('max_wait_ms', 200)
+BATCH_RETRY_BACKOFF_S = batch_config.get('retry_backoff_s', 0.5)
+BATCH_RETRY_BACKOFF_MAX_S = batch_config.get('retry_backoff_max_s', 30)
+BATCH_ISOLATE_AFTER = batch_config.get('isolate_after_failures', 3)
+
+# Partitioning, retention and rollup job settings
+PARTITION_CONFIG = config.get('partitioning', {})
+
+# Range query settings
+query_config = config.get('query', {})
+MAX_PAGE_SIZE = query_config.get('max_page_size', 10000)
+STREAM_CHUNK_SIZE = query_config.get('stream_chunk_size', 1000)
+
+# Columnar export: Arrow IPC endpoints and the (optional) periodic Parquet job
+EXPORT_CONFIG = config.get('export', {})
+EXPORT_CHUNK_ROWS = EXPORT_CONFIG.get('chunk_rows', 250000)
+
+# Response cache for range queries over closed windows. A window counts as
+# closed once its end is `closed_after_s` in the past, leaving time for late
+# events; the TTL bounds how long anything later than that can stay hidden.
+cache_config = config.get('cache', {})
+CACHE_ENABLED = cache_config.get('enabled', True)
+CACHE_CLOSED_AFTER_S = cache_config.get('closed_after_s', 60)
+response_cache = create_cache(cache_config, prefix='storage:') if CACHE_ENABLED else None
 
 # Load logging configuration
-with open("/app/config/storage/storage_log_conf.yml", "r") as f:
+with open(os.path.join(CONFIG_DIR, "storage_log_conf.yml"), "r") as f:
     LOG_CONFIG = yaml.safe_load(f.read())
 logging.config.dictConfig(LOG_CONFIG)
 
 # Create a logger object
 logger = logging.getLogger('basicLogger')
 
+# Shared Kafka producer/consumer factory; the producer is only created on the first dead letter
+kafka_pool = get_pool(kafka_config)
 
+# Metrics, served at /metrics
+CONSUMED = Counter('storage_consumed_messages', 'Messages read from the events topic')
+DEAD_LETTERS = Counter('storage_dead_letters', 'Messages that could not be decoded and went to the dead-letter topic')
+CONSUMER_LAG = Gauge('storage_consumer_lag', 'Messages behind the high watermark, per partition', ['partition'])
+PENDING_ROWS = Gauge('storage_batch_pending_rows', 'Events buffered in the current micro-batch', ['worker'])
+BATCH_WRITE = Histogram('storage_batch_write_seconds', 'INSERT and commit of one micro-batch', ['outcome'],
+                        buckets=LATENCY_BUCKETS)
+BATCH_ROWS = Histogram('storage_batch_rows', 'Events per micro-batch', buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500))
+KAFKA_COMMIT = Histogram('storage_kafka_commit_seconds', 'Offset commit after a stored batch', buckets=LATENCY_BUCKETS)
+MAINTENANCE = Histogram('storage_maintenance_seconds', 'One pass of partition, retention and rollup maintenance',
+                        buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300))
 
 
-def process_messages():
-    consumer = KafkaConsumer(KAFKA_TOPIC, bootstrap_servers=KAFKA_SERVER)
-    for message in consumer:
-        logger.info(f"Processing message: {message.value.decode('utf-8')}")
-        event_data = message.value.decode('utf-8')
 
-        if "listing" in event_data:
-            try:
-                body = parse_listing_event(event_data)
-                process_listing_event(body)
-            except Exception as e:
-                logger.error(f"Error processing listing event: {e}")
 
-        elif "transaction" in event_data:
-            try:
-                body = parse_transaction_event(event_data)
-                process_transaction_event(body)
-            except Exception as e:
-                logger.error(f"Error processing transaction event: {e}")
+class FlushOnRevoke(ConsumerRebalanceListener):
+    """Flush the in-flight batch before partitions move to another worker."""
 
-def setup_kafka_thread():
-    t1 = threading.Thread(target=process_messages)
-    t1.setDaemon(True)
-    t1.start()
+    def __init__(self, flush):
+        self.flush = flush
 
-def parse_listing_event(event_data):
-    return {
-        'user_id': 'user_123',
-        'item_id': 'item_123',
-        'price': 100.00,
-        'timestamp': datetime.now().isoformat(),
-        'trace_id': str(uuid.uuid4())
-    }
+    def on_partitions_revoked(self, revoked):
+        if revoked:
+            logger.info(f"Partitions revoked: {sorted(tp.partition for tp in revoked)}")
+            self.flush()
 
-def parse_transaction_event(event_data):
-    return {
-        'user_id': 'user_123',
-        'transaction_id': 'txn_123',
-        'amount': 200.00,
-        'timestamp': datetime.now().isoformat(),
-        'trace_id': str(uuid.uuid4())
+    def on_partitions_assigned(self, assigned):
+        logger.info(f"Partitions assigned: {sorted(tp.partition for tp in assigned)}")
+
+
+def process_messages(worker_id=0):
+    """Consume the events topic as one member of the storage consumer group.
+
+    Each partition is owned by exactly one worker at a time and its messages
+    are handled sequentially, so per-partition order is preserved.
+    """
+    consumer = retry_forever(f"kafka-consumer-{worker_id}", lambda: kafka_pool.consumer(
+        group_id=KAFKA_GROUP_ID,
+        client_id=f"{KAFKA_GROUP_ID}-{worker_id}",
+        enable_auto_commit=False,  # offsets are committed only after the DB commit
+        auto_offset_reset='earliest',
+        partition_assignment_strategy=PARTITION_ASSIGNORS
+    ))
+    batch = {
+        'events': [],  # (decoded event, Kafka message)
+        'offsets': {},  # partition -> first uncommitted offset in this batch
+        'dead_letters': False,
+        'failures': 0,  # consecutive failed writes, across redeliveries
+        'started': time.monotonic()
     }
 
-def process_listing_event(body):
-    session = get_session()
+    def flush():
+        if not batch['offsets']:
+            return
+        if batch['dead_letters']:
+            kafka_pool.producer().flush()  # dead letters must be durable before we commit
+        stored = write_batch(*split_events(batch['events']))
+        if not stored and batch['failures'] + 1 >= BATCH_ISOLATE_AFTER:
+            # Keeps failing: find out whether some events are rejected by the database itself
+            stored = write_isolating(batch['events'])
+            kafka_pool.producer().flush()
+        if stored:
+            batch['failures'] = 0
+            with KAFKA_COMMIT.time():
+                consumer.commit()
+        else:
+            batch['failures'] += 1
+            backoff = min(BATCH_RETRY_BACKOFF_S * 2 ** (batch['failures'] - 1), BATCH_RETRY_BACKOFF_MAX_S)
+            logger.warning(f"Batch write failed {batch['failures']} time(s) in a row, retrying in {backoff:.1f} s")
+            time.sleep(backoff)
+            # Leave offsets uncommitted and rewind so the batch is redelivered
+            for partition, offset in batch['offsets'].items():
+                if partition in consumer.assignment():
+                    consumer.seek(partition, offset)
+        batch['events'] = []
+        batch['offsets'] = {}
+        batch['dead_letters'] = False
+        batch['started'] = time.monotonic()
+        PENDING_ROWS.labels(worker_id).set(0)
+        for partition, lag in partition_lag(consumer).items():
+            CONSUMER_LAG.labels(partition).set(lag)
+
+    consumer.subscribe([KAFKA_TOPIC], listener=FlushOnRevoke(flush))
+    logger.info(f"Storage consumer worker {worker_id} started")
+
+    while True:
+        elapsed_ms = (time.monotonic() - batch['started']) * 1000
+        records = consumer.poll(timeout_ms=max(0, BATCH_MAX_WAIT_MS - elapsed_ms), max_records=BATCH_MAX_ROWS)
+        for partition, messages in records.items():
+            batch['offsets'].setdefault(partition, messages[0].offset)
+            CONSUMED.inc(len(messages))
+            for message in messages:
+                try:
+                    event = decode_event(message.value)
+                except InvalidEvent as e:
+                    send_to_dead_letter(message, str(e))
+                    DEAD_LETTERS.inc()
+                    batch['dead_letters'] = True
+                    continue
+                batch['events'].append((event, message))
+
+        if not batch['offsets']:
+            # Nothing consumed yet, start the wait window on the next message
+            batch['started'] = time.monotonic()
+            continue
+
+        batch_size = len(batch['events'])
+        PENDING_ROWS.labels(worker_id).set(batch_size)
+        elapsed_ms = (time.monotonic() - batch['started']) * 1000
+        if batch_size >= BATCH_MAX_ROWS or elapsed_ms >= BATCH_MAX_WAIT_MS:
+            flush()
+
+def consumer_workers():
+    return CONSUMER_WORKERS if CONSUMER_MODE == 'group' else 1
+
+def setup_kafka_thread():
+    for worker_id in range(consumer_workers()):
+        start_thread(f"storage-consumer-{worker_id}", process_messages, worker_id)
+    logger.info(f"Started {consumer_workers()} storage consumer worker(s) in '{CONSUMER_MODE}' mode")
+
+def send_to_dead_letter(message, reason):
+    """Forward an undecodable message to the dead-letter topic with the reason attached."""
+    logger.warning(f"Sending message at partition {message.partition} offset {message.offset} "
+                   f"to {KAFKA_DEAD_LETTER_TOPIC}: {reason}")
+    kafka_pool.producer().send(
+        KAFKA_DEAD_LETTER_TOPIC,
+        value=message.value,
+        headers=[
+            ('error', reason.encode('utf-8')),
+            ('source', f"{message.topic}:{message.partition}:{message.offset}".encode('utf-8'))
+        ]
+    )
+
+def split_events(events):
+    """([listings], [transactions]) of (event, message) pairs."""
+    listings = [event for event, _ in events if type(event) is ListingEvent]
+    transactions = [event for event, _ in events if type(event) is not ListingEvent]
+    return listings, transactions
+
+def is_rejected_data(error):
+    """True if the database refused the rows themselves (too long, constraint), not the connection."""
+    return isinstance(error, (DataError, IntegrityError)) or (
+        isinstance(error, StatementError) and not isinstance(error, DBAPIError))
+
+def write_isolating(events):
+    """Write (event, message) pairs in halves, dead-lettering single events the database rejects.
+
+    Returns False as soon as a write fails for another reason (e.g. the
+    database is down), so the caller backs off and retries instead of
+    dead-lettering a healthy batch. Halves already written are skipped as
+    duplicates when the batch is redelivered.
+    """
     try:
-        listing_event = SubmitListingEvent(
-            user_id=body['user_id'],
-            item_id=body['item_id'],
-            price=body['price'],
-            timestamp=body['timestamp'],
-            trace_id=body['trace_id']
-        )
-        session.add(listing_event)
-        session.commit()
-        logger.debug(f"Stored event listing for item {body['item_id']} with trace id {body['trace_id']}")
+        write_batch(*split_events(events), raise_errors=True)
+        return True
     except Exception as e:
-        session.rollback()
-        logger.error(f"Failed to store listing event: {e}")
-    finally:
-        session.close()
+        if not is_rejected_data(e):
+            return False
+        if len(events) == 1:
+            _, message = events[0]
+            send_to_dead_letter(message, f"Rejected by the database: {getattr(e, 'orig', None) or e}")
+            DEAD_LETTERS.inc()
+            return True
+    middle = len(events) // 2
+    return write_isolating(events[:middle]) and write_isolating(events[middle:])
+
+def write_batch(listings, transactions, raise_errors=False):
+    """Insert a micro-batch with one multi-row INSERT per table and a single commit.
+
+    Redelivered events are skipped by the unique (trace_id, timestamp) index.
 
-def process_transaction_event(body):
+    Returns True if the batch was committed, False if it was rolled back
+    (or with raise_errors, raises the error after the rollback).
+    """
+    if not listings and not transactions:
+        return True
+    started = time.perf_counter()
     session = get_session()
     try:
-        transaction_event = SubmitTransactionEvent(
-            user_id=body['user_id'],
-            transaction_id=body['transaction_id'],
-            amount=body['amount'],
-            timestamp=body['timestamp'],
-            trace_id=body['trace_id']
-        )
-        session.add(transaction_event)
+        dialect = session.bind.dialect.name
+        if listings:
+            session.execute(insert_ignore(SubmitListingEvent, dialect), [event.as_row() for event in listings])
+            mark_late_hours(session, SubmitListingEvent, [event.timestamp for event in listings], dialect)
+        if transactions:
+            session.execute(insert_ignore(SubmitTransactionEvent, dialect), [event.as_row() for event in transactions])
+            mark_late_hours(session, SubmitTransactionEvent, [event.timestamp for event in transactions], dialect)
         session.commit()
-        logger.debug(f"Stored event transaction for transaction {body['transaction_id']} with trace id {body['trace_id']}")
+        BATCH_WRITE.labels('committed').observe(time.perf_counter() - started)
+        BATCH_ROWS.observe(len(listings) + len(transactions))
+        logger.debug(f"Stored batch of {len(listings)} listings and {len(transactions)} transactions")
+        return True
     except Exception as e:
         session.rollback()
-        logger.error(f"Failed to store transaction event: {e}")
+        BATCH_WRITE.labels('rolled_back').observe(time.perf_counter() - started)
+        logger.error(f"Failed to store event batch: {e}")
+        if raise_errors:
+            raise
+        return False
     finally:
         session.close()
 
-def get_listings():
-    session = get_session()
-    start_timestamp = request.args.get('start_timestamp')
-    end_timestamp = request.args.get('end_timestamp')
+# Columns returned by GET /events/*, in response field order
+LISTING_COLUMNS = (
+    SubmitListingEvent.id, SubmitListingEvent.trace_id, SubmitListingEvent.user_id,
+    SubmitListingEvent.item_id, SubmitListingEvent.price, SubmitListingEvent.timestamp,
+    SubmitListingEvent.date_created
+)
+TRANSACTION_COLUMNS = (
+    SubmitTransactionEvent.id, SubmitTransactionEvent.trace_id, SubmitTransactionEvent.user_id,
+    SubmitTransactionEvent.transaction_id, SubmitTransactionEvent.amount, SubmitTransactionEvent.timestamp,
+    SubmitTransactionEvent.date_created
+)
+
+def encode_cursor(timestamp, row_id):
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{row_id}".encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    timestamp, row_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+    return datetime.fromisoformat(timestamp), int(row_id)
+
+def row_to_dict(keys, row):
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in zip(keys, row)}
+
+def query_events(model, columns):
+    """Run a keyset-paginated range query for GET /events/listings and /events/transactions.
 
+    Rows are read as column tuples, never as ORM entities. With format=ndjson
+    the rows are streamed from a server-side cursor, one JSON object per line.
+    Otherwise a JSON array is returned and, when the page is full, the cursor
+    for the next page is sent in the X-Next-Cursor header. JSON pages of
+    closed windows are served from the response cache, and every JSON page
+    carries an ETag.
+    """
     try:
-        start = datetime.fromisoformat(start_timestamp)
-        end = datetime.fromisoformat(end_timestamp)
+        start = datetime.fromisoformat(request.args.get('start_timestamp'))
+        end = datetime.fromisoformat(request.args.get('end_timestamp'))
     except (ValueError, TypeError):
         return jsonify({"message": "Invalid timestamp format"}), 400
 
-    listings = session.query(SubmitListingEvent).filter(
-        SubmitListingEvent.timestamp >= start,
-        SubmitListingEvent.timestamp < end
-    ).all()
+    limit = request.args.get('limit', type=int)
+    if limit is not None and not 0 < limit <= MAX_PAGE_SIZE:
+        return jsonify({"message": f"'limit' must be between 1 and {MAX_PAGE_SIZE}"}), 400
+
+    stmt = select(*columns).where(model.timestamp >= start, model.timestamp < end)
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after_timestamp, after_id = decode_cursor(cursor)
+        except (ValueError, UnicodeDecodeError):
+            return jsonify({"message": "Invalid cursor"}), 400
+        stmt = stmt.where(or_(
+            model.timestamp > after_timestamp,
+            and_(model.timestamp == after_timestamp, model.id > after_id)
+        ))
+    stmt = stmt.order_by(model.timestamp, model.id)
+    if limit:
+        stmt = stmt.limit(limit)
+
+    keys = [column.key for column in columns]
+
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            session = get_read_session()
+            try:
+                result = session.execute(stmt.execution_options(yield_per=STREAM_CHUNK_SIZE))
+                for row in result:
+                    yield json.dumps(row_to_dict(keys, row)) + "\n"
+            finally:
+                session.close()
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
-    session.close()
-    return jsonify([listing.to_dict() for listing in listings]), 200
+    cache_key = None
+    if response_cache and as_utc(end) <= utcnow() - timedelta(seconds=CACHE_CLOSED_AFTER_S):
+        cache_key = f"{model.__tablename__}|{as_utc(start).isoformat()}|{as_utc(end).isoformat()}|{limit}|{cursor}"
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            next_cursor, body = cached.split(b"\n", 1)
+            return json_response(body, next_cursor.decode('ascii'))
+
+    session = get_read_session()
+    try:
+        rows = session.execute(stmt).all()
+    finally:
+        session.close()
+
+    body = json.dumps([row_to_dict(keys, row) for row in rows]).encode('utf-8')
+    next_cursor = ''
+    if limit and len(rows) == limit:
+        last = rows[-1]
+        next_cursor = encode_cursor(last.timestamp, last.id)
+    if cache_key:
+        # The cursor is base64, so a newline safely separates it from the body
+        response_cache.set(cache_key, next_cursor.encode('ascii') + b"\n" + body)
+    return json_response(body, next_cursor)
+
+def json_response(body, next_cursor):
+    """JSON response with an ETag; answers 304 when If-None-Match already has it."""
+    response = Response(body, mimetype='application/json')
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    response.set_etag(etag(body))
+    return response.make_conditional(request)
+
+def get_listings():
+    return query_events(SubmitListingEvent, LISTING_COLUMNS)
 
 def get_transactions():
-    session = get_session()
-    start_timestamp = request.args.get('start_timestamp')
-    end_timestamp = request.args.get('end_timestamp')
+    return query_events(SubmitTransactionEvent, TRANSACTION_COLUMNS)
 
+def export_events(model):
+    """Stream events with id > after_id as an Arrow IPC stream, one record batch per chunk.
+
+    Rows are sent in id order, so an interrupted download resumes with
+    after_id set to the last id received.
+    """
+    if not export.available():
+        return jsonify({"message": "Arrow export requires the pyarrow package"}), 501
     try:
-        start = datetime.fromisoformat(start_timestamp)
-        end = datetime.fromisoformat(end_timestamp)
+        after_id = int(request.args.get('after_id', 0))
+        start, end = (as_utc(datetime.fromisoformat(request.args[name])) if name in request.args else None
+                      for name in ('start_timestamp', 'end_timestamp'))
+    except ValueError:
+        return jsonify({"message": "Invalid after_id or timestamp"}), 400
+
+    def generate():
+        session = get_read_session()
+        try:
+            batches = export.iter_batches(session, model, EXPORT_CHUNK_ROWS, after_id, start=start, end=end)
+            yield from export.arrow_stream(batches, export.arrow_schema(model))
+        finally:
+            session.close()
+    return Response(stream_with_context(generate()), mimetype=export.ARROW_STREAM_MIMETYPE)
+
+def get_listings_export():
+    return export_events(SubmitListingEvent)
+
+def get_transactions_export():
+    return export_events(SubmitTransactionEvent)
+
+def as_utc(timestamp):
+    """Naive UTC datetime, matching how event timestamps are stored."""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+def query_event_stats(model, value_column):
+    """Aggregate count/sum/sum_sq/min/max/avg of value_column over a timestamp range.
+
+    With bucket=minute|hour the aggregates are grouped per time bucket. With
+    sketch_accuracy (ungrouped only) a log-bucketed quantile sketch of the
+    values is added, which processing merges to estimate percentiles.
+    """
+    try:
+        start = as_utc(datetime.fromisoformat(request.args.get('start_timestamp')))
+        end = as_utc(datetime.fromisoformat(request.args.get('end_timestamp')))
     except (ValueError, TypeError):
         return jsonify({"message": "Invalid timestamp format"}), 400
 
-    transactions = session.query(SubmitTransactionEvent).filter(
-        SubmitTransactionEvent.timestamp >= start,
-        SubmitTransactionEvent.timestamp < end
+    bucket = request.args.get('bucket')
+    if bucket not in (None, 'minute', 'hour'):
+        return jsonify({"message": "'bucket' must be 'minute' or 'hour'"}), 400
+
+    accuracy = request.args.get('sketch_accuracy', type=float)
+    if accuracy is not None and not 0 < accuracy < 1:
+        return jsonify({"message": "'sketch_accuracy' must be between 0 and 1"}), 400
+
+    aggregates = (
+        func.count(model.id).label('count'),
+        func.sum(value_column).label('sum'),
+        func.sum(value_column * value_column).label('sum_sq'),
+        func.min(value_column).label('min'),
+        func.max(value_column).label('max'),
+        func.avg(value_column).label('avg'),
+    )
+    where = (model.timestamp >= start, model.timestamp < end)
+
+    session = get_read_session()
+    try:
+        # Whole hours that are already rolled up are read from the hourly
+        # rollup table; only the partial hours at the edges, and hours flagged
+        # by late events until the rollup job recomputes them, hit the events.
+        rollup_range = None
+        stale = set()
+        if accuracy is None and bucket in (None, 'hour'):
+            first_hour = start.replace(minute=0, second=0, microsecond=0)
+            if first_hour < start:
+                first_hour += timedelta(hours=1)
+            last_hour = end.replace(minute=0, second=0, microsecond=0)
+            watermark = rolled_up_until(session, model)
+            if watermark is not None:
+                last_hour = min(last_hour, watermark)
+                if first_hour < last_hour:
+                    rollup_range = (first_hour, last_hour)
+                    stale = dirty_hours(session, model, first_hour, last_hour)
+                    ranges = [(start, first_hour), (last_hour, end)]
+                    for hour in sorted(stale):
+                        hour = datetime.strptime(hour, HOUR_FORMAT)
+                        ranges.append((hour, hour + timedelta(hours=1)))
+                    where = (or_(*(and_(model.timestamp >= lower, model.timestamp < upper)
+                                   for lower, upper in ranges)),)
+
+        if bucket is None:
+            row = session.execute(select(*aggregates).where(*where)).one()
+            stats = stats_to_dict(row)
+            if rollup_range:
+                stats = merge_stats(stats, query_rollup(session, model, rollup_range, stale))
+            if accuracy is not None:
+                stats['sketch'] = query_sketch(session, value_column, where, accuracy)
+            return jsonify(stats), 200
+
+        bucket_column = bucket_expression(model.timestamp, bucket, session.bind.dialect.name).label('bucket')
+        rows = session.execute(
+            select(bucket_column, *aggregates).where(*where).group_by(bucket_column).order_by(bucket_column)
+        ).all()
+        buckets = {row.bucket: stats_to_dict(row) for row in rows}
+        if rollup_range:
+            for row in query_rollup(session, model, rollup_range, stale, grouped=True):
+                buckets[row['bucket']] = merge_stats(buckets.get(row['bucket'], EMPTY_STATS), row)
+        return jsonify([{'bucket': key, **buckets[key]} for key in sorted(buckets)]), 200
+    finally:
+        session.close()
+
+def query_rollup(session, model, rollup_range, stale=(), grouped=False):
+    """Aggregates of the hourly rollup rows for [first_hour, last_hour), except the stale buckets."""
+    rollup = ROLLUPS[model][1]
+    first_hour, last_hour = (hour.strftime(HOUR_FORMAT) for hour in rollup_range)
+    where = (rollup.bucket >= first_hour, rollup.bucket < last_hour)
+    if stale:
+        where += (rollup.bucket.notin_(stale),)
+    if grouped:
+        rows = session.execute(select(rollup).where(*where)).scalars()
+        return [{'bucket': r.bucket, 'count': r.count, 'sum': r.sum, 'sum_sq': r.sum_sq, 'min': r.min, 'max': r.max}
+                for r in rows]
+    row = session.execute(select(
+        func.coalesce(func.sum(rollup.count), 0).label('count'),
+        func.sum(rollup.sum).label('sum'),
+        func.sum(rollup.sum_sq).label('sum_sq'),
+        func.min(rollup.min).label('min'),
+        func.max(rollup.max).label('max'),
+    ).where(*where)).one()
+    return {'count': row.count, 'sum': row.sum or 0.0, 'sum_sq': row.sum_sq or 0.0, 'min': row.min, 'max': row.max}
+
+EMPTY_STATS = {'count': 0, 'sum': 0.0, 'sum_sq': 0.0, 'min': None, 'max': None, 'avg': None}
+
+def merge_stats(a, b):
+    count = a['count'] + b['count']
+    total = a['sum'] + b['sum']
+    return {
+        'count': count,
+        'sum': total,
+        'sum_sq': a['sum_sq'] + b['sum_sq'],
+        'min': min((v for v in (a['min'], b['min']) if v is not None), default=None),
+        'max': max((v for v in (a['max'], b['max']) if v is not None), default=None),
+        'avg': total / count if count else None,
+    }
+
+def query_sketch(session, value_column, where, accuracy):
+    """DDSketch bins: positive values are counted per ceil(ln(x) / ln(gamma))."""
+    gamma = (1 + accuracy) / (1 - accuracy)
+    key = func.ceil(func.ln(value_column) / math.log(gamma)).label('key')
+    rows = session.execute(
+        select(key, func.count().label('count')).where(*where, value_column > 0).group_by(key)
     ).all()
+    zero_count = session.execute(select(func.count()).where(*where, value_column <= 0)).scalar()
+    return {
+        'accuracy': accuracy,
+        'bins': {str(int(row.key)): row.count for row in rows},
+        'zero_count': zero_count,
+    }
+
+def stats_to_dict(row):
+    return {
+        'count': row.count,
+        'sum': float(row.sum) if row.sum is not None else 0.0,
+        'sum_sq': float(row.sum_sq) if row.sum_sq is not None else 0.0,
+        'min': row.min,
+        'max': row.max,
+        'avg': float(row.avg) if row.avg is not None else None,
+    }
+
+def get_listing_stats():
+    return query_event_stats(SubmitListingEvent, SubmitListingEvent.price)
+
+def get_transaction_stats():
+    return query_event_stats(SubmitTransactionEvent, SubmitTransactionEvent.amount)
+
+def run_maintenance_loop():
+    while True:
+        try:
+            with MAINTENANCE.time():
+                run_maintenance(write_engine, PARTITION_CONFIG)
+        except Exception as e:
+            logger.error(f"Maintenance pass failed: {e}")
+        time.sleep(PARTITION_CONFIG.get('interval_s', 300))
+
+def run_export_loop():
+    while True:
+        export.run_export(read_engine, EXPORT_CONFIG)
+        time.sleep(EXPORT_CONFIG.get('interval_s', 86400))
 
-    session.close()
-    return jsonify([transaction.to_dict() for transaction in transactions]), 200
+def setup_export_thread():
+    start_thread("storage-export", run_export_loop)
+
+def setup_maintenance_thread():
+    start_thread("storage-maintenance", run_maintenance_loop)
+
+def initialize():
+    """Create the schema (retried until MySQL answers), then start the background workers."""
+    retry_forever("database", init_db)
+    setup_maintenance_thread()
+    if EXPORT_CONFIG.get('enabled', False):
+        setup_export_thread()
+    setup_kafka_thread()
 
 def home():
     return "✅ You are running Connexion!"
 
+def cache_stats():
+    return jsonify(response_cache.info() if response_cache else {"enabled": False})
+
+# Run as a script this module is __main__; let the spec's app.<handler> operationIds resolve
+# to it instead of importing app.py a second time (which registers every metric twice)
+sys.modules.setdefault('app', sys.modules[__name__])
 app = connexion.App(__name__, specification_dir='.')
-app.add_api('openapi.yaml')
+app.add_api(load_spec(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'openapi.yaml')))
 app.app.add_url_rule('/', 'home', home)
+app.app.add_url_rule('/cache/stats', 'cache_stats', cache_stats)
+instrument_app(app.app)
+add_health_routes(app.app)
+register_cache(response_cache)
 
 if __name__ == '__main__':
-    setup_kafka_thread()
+    # Serve the API (and /health) right away; the database and Kafka are connected in the background
+    READINESS.register("database")
+    for worker_id in range(consumer_workers()):
+        READINESS.register(f"kafka-consumer-{worker_id}")
+    threading.Thread(target=initialize, name="storage-init", daemon=True).start()
     app.run(port=8090, host="0.0.0.0")
@@ -0,0 +1,372 @@
+"""Replay the events topic into the event tables, in parallel and in large batches.
+
+    python backfill.py [--from-offset N | --from-time ISO] [--until-time ISO]
+                       [--partitions 0,1] [--workers 4] [--batch-rows 5000]
+                       [--relax-durability] [--commit-group]
+
+Used when storage has fallen far behind, or to rebuild the tables from the
+topic. Without --from-offset/--from-time every partition is replayed from
+the storage consumer group's committed offset (the beginning if it has
+none), i.e. exactly the lag the live consumers still have to work through.
+Replay stops at the high watermark seen at startup (or at --until-time),
+so the run is bounded even while new events keep arriving.
+
+Partitions are spread over `workers` consumer threads by lag, largest
+first, and each thread inserts `batch_rows` events per commit. Inserts skip
+events that are already stored, so replaying a range twice is harmless and
+an interrupted run can simply be restarted (the final report lists where
+each partition stopped). The backfill does not join the consumer group;
+with --commit-group the group's offsets are moved to the end of the replayed
+range afterwards, which only succeeds while the storage consumers are
+stopped.
+
+--relax-durability trades crash safety for insert speed for the duration of
+the run: on MySQL innodb_flush_log_at_trx_commit=2 and sync_binlog=0 (global,
+restored afterwards; needs the SYSTEM_VARIABLES_ADMIN privilege), on SQLite
+synchronous=OFF. A database crash can then lose the last second of
+commits, which a rerun of the same range restores.
+
+Afterwards the hourly rollup watermark of each table is lowered to the
+earliest hour that received backfilled events, so the next maintenance
+pass recomputes those hours and /stats reads them from the events meanwhile.
+"""
+import argparse
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+from kafka import OffsetAndMetadata, TopicPartition
+from sqlalchemy import event, text
+from sqlalchemy.orm import sessionmaker
+
+from db_class import SubmitListingEvent, SubmitTransactionEvent
+from events import decode_event, InvalidEvent, ListingEvent
+from db_setup import create_db_engine, init_db, insert_ignore
+from partitions import lower_rollup_watermark
+
+logger = logging.getLogger('basicLogger')
+
+
+class Progress:
+    """Replay position of every partition, shared by the worker threads."""
+
+    def __init__(self, ranges):
+        self._lock = threading.Lock()
+        self.ranges = dict(ranges)  # partition -> (first offset, end offset)
+        self.positions = {partition: first for partition, (first, _) in self.ranges.items()}
+        self.rows = 0
+        self.skipped = 0
+        self.earliest = {}  # event model -> earliest timestamp written
+        self.started = time.monotonic()
+
+    def advance(self, positions, rows, skipped, earliest=None):
+        with self._lock:
+            self.positions.update(positions)
+            self.rows += rows
+            self.skipped += skipped
+            for model, timestamp in (earliest or {}).items():
+                if model not in self.earliest or timestamp < self.earliest[model]:
+                    self.earliest[model] = timestamp
+
+    @property
+    def total(self):
+        return sum(end - first for first, end in self.ranges.values())
+
+    @property
+    def done(self):
+        with self._lock:
+            return sum(self.positions[p] - first for p, (first, _) in self.ranges.items())
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        done, total = self.done, self.total
+        rate = done / elapsed if elapsed else 0.0
+        eta = f"{(total - done) / rate:.0f} s" if rate else "unknown"
+        percent = done / total * 100 if total else 100.0
+        return (f"{done}/{total} messages ({percent:.1f}%), {self.rows} rows written, {self.skipped} undecodable, "
+                f"{rate:,.0f} msg/s, ETA {eta}")
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'messages': self.done,
+            'rows': self.rows,
+            'skipped': self.skipped,
+            'elapsed_s': round(elapsed, 3),
+            'messages_per_s': round(self.done / elapsed, 1) if elapsed else None,
+            'next_offsets': dict(sorted(self.positions.items())),
+        }
+
+
+@contextmanager
+def relaxed_durability(engine):
+    """Let commits skip the fsync while the block runs (see the module docstring)."""
+    dialect = engine.dialect.name
+    if dialect == 'sqlite':
+        def no_sync(dbapi_connection, _):
+            dbapi_connection.execute('PRAGMA synchronous=OFF')
+        event.listen(engine, 'connect', no_sync)
+        engine.dispose()  # reconnect so every pooled connection gets the pragma
+        try:
+            yield
+        finally:
+            event.remove(engine, 'connect', no_sync)
+            engine.dispose()
+        return
+    if dialect != 'mysql':
+        yield
+        return
+
+    original = {}  # only the settings that were actually changed
+    try:
+        try:
+            with engine.connect() as connection:
+                for name, relaxed in (('innodb_flush_log_at_trx_commit', 2), ('sync_binlog', 0)):
+                    value = connection.execute(text(f"SELECT @@GLOBAL.{name}")).scalar()
+                    connection.execute(text(f"SET GLOBAL {name} = {relaxed}"))
+                    original[name] = value
+        except Exception as e:
+            logger.warning(f"Could not relax durability, continuing with the current settings: {e}")
+        yield
+    finally:
+        if original:
+            with engine.connect() as connection:
+                for name, value in original.items():
+                    try:
+                        connection.execute(text(f"SET GLOBAL {name} = {int(value)}"))
+                        logger.info(f"Restored {name}={value}")
+                    except Exception as e:
+                        logger.error(f"Could not restore {name}={value}, set it by hand: {e}")
+
+
+def replay_ranges(consumer, topic, partitions, group_offsets, from_offset=None, from_time=None, until_time=None):
+    """{partition: (first offset, end offset)} to replay, end exclusive."""
+    tps = [TopicPartition(topic, partition) for partition in partitions]
+    beginning = consumer.beginning_offsets(tps)
+    end = consumer.end_offsets(tps)
+    if until_time is not None:
+        found = consumer.offsets_for_times({tp: _millis(until_time) for tp in tps})
+        end = {tp: found[tp].offset if found[tp] is not None else end[tp] for tp in tps}
+    if from_time is not None:
+        found = consumer.offsets_for_times({tp: _millis(from_time) for tp in tps})
+        first = {tp: found[tp].offset if found[tp] is not None else end[tp] for tp in tps}
+    elif from_offset is not None:
+        first = {tp: from_offset for tp in tps}
+    else:
+        first = {tp: group_offsets.get(tp.partition, beginning[tp]) for tp in tps}
+    return {tp.partition: (max(first[tp], beginning[tp]), end[tp]) for tp in tps
+            if max(first[tp], beginning[tp]) < end[tp]}
+
+
+def _millis(timestamp):
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp() * 1000)
+
+
+def assign_by_lag(ranges, workers):
+    """Spread partitions over at most `workers` groups with about equal message counts (largest first)."""
+    groups = [[] for _ in range(min(workers, len(ranges)))]
+    loads = [0] * len(groups)
+    for partition, (first, end) in sorted(ranges.items(), key=lambda item: item[1][1] - item[1][0], reverse=True):
+        least = loads.index(min(loads))
+        groups[least].append(partition)
+        loads[least] += end - first
+    return groups
+
+
+def write_rows(Session, listings, transactions, retries=3):
+    """Insert one backfill batch, retrying with backoff before giving up."""
+    for attempt in range(retries + 1):
+        session = Session()
+        try:
+            dialect = session.bind.dialect.name
+            if listings:
+                session.execute(insert_ignore(SubmitListingEvent, dialect), [e.as_row() for e in listings])
+            if transactions:
+                session.execute(insert_ignore(SubmitTransactionEvent, dialect), [e.as_row() for e in transactions])
+            session.commit()
+            return
+        except Exception as e:
+            session.rollback()
+            if attempt == retries:
+                raise
+            logger.warning(f"Backfill batch failed (attempt {attempt + 1}), retrying: {e}")
+            time.sleep(0.5 * 2 ** attempt)
+        finally:
+            session.close()
+
+
+def replay_partitions(kafka_pool, Session, partitions, ranges, batch_rows, progress, stop):
+    """Worker thread: replay `partitions` up to their end offsets with batched inserts."""
+    consumer = kafka_pool.consumer(group_id=None, enable_auto_commit=False,
+                                   max_poll_records=batch_rows, fetch_max_bytes=64 * 1024 * 1024)
+    tps = {partition: TopicPartition(kafka_pool.topic, partition) for partition in partitions}
+    consumer.assign(list(tps.values()))
+    for partition, tp in tps.items():
+        consumer.seek(tp, ranges[partition][0])
+    remaining = set(partitions)
+    listings, transactions, positions, skipped = [], [], {}, 0
+
+    def flush():
+        nonlocal listings, transactions, positions, skipped
+        if positions:
+            write_rows(Session, listings, transactions)
+            earliest = {model: min(e.timestamp for e in events)
+                        for model, events in ((SubmitListingEvent, listings), (SubmitTransactionEvent, transactions))
+                        if events}
+            progress.advance(positions, len(listings) + len(transactions), skipped, earliest)
+        listings, transactions, positions, skipped = [], [], {}, 0
+
+    try:
+        while remaining and not stop.is_set():
+            for tp, messages in consumer.poll(timeout_ms=1000).items():
+                end = ranges[tp.partition][1]
+                for message in messages:
+                    if message.offset >= end:
+                        break
+                    try:
+                        decoded = decode_event(message.value)
+                    except InvalidEvent:
+                        skipped += 1  # the live consumer sent these to the dead-letter topic
+                        continue
+                    if type(decoded) is ListingEvent:
+                        listings.append(decoded)
+                    else:
+                        transactions.append(decoded)
+                positions[tp.partition] = min(messages[-1].offset + 1, end)
+            for partition in list(remaining):
+                # position() also covers ranges that end in a gap (compacted or control records)
+                if consumer.position(tps[partition]) >= ranges[partition][1]:
+                    positions[partition] = ranges[partition][1]
+                    consumer.pause(tps[partition])
+                    remaining.discard(partition)
+            if len(listings) + len(transactions) >= batch_rows or not remaining:
+                flush()
+        flush()
+    finally:
+        consumer.close(autocommit=False)
+
+
+def run_backfill(kafka_pool, engine, group_id, from_offset=None, from_time=None, until_time=None,
+                 partitions=None, workers=4, batch_rows=5000, relax=False, commit_group=False, progress_s=10):
+    """Replay the selected range of the topic into the database. Returns the summary dict."""
+    group_consumer = kafka_pool.consumer(group_id=group_id, enable_auto_commit=False)
+    try:
+        available = group_consumer.partitions_for_topic(kafka_pool.topic) or set()
+        partitions = sorted(available if partitions is None else set(partitions) & available)
+        group_offsets = {}
+        for partition in partitions:
+            committed = group_consumer.committed(TopicPartition(kafka_pool.topic, partition))
+            if committed is not None:
+                group_offsets[partition] = committed
+        ranges = replay_ranges(group_consumer, kafka_pool.topic, partitions, group_offsets,
+                               from_offset, from_time, until_time)
+    finally:
+        group_consumer.close(autocommit=False)
+
+    progress = Progress(ranges)
+    if not ranges:
+        logger.info("Nothing to replay")
+        return progress.summary()
+    for partition, (first, end) in sorted(ranges.items()):
+        logger.info(f"Partition {partition}: replaying offsets {first}..{end - 1} ({end - first} messages)")
+
+    Session = sessionmaker(bind=engine)
+    stop = threading.Event()
+    errors = []
+
+    def worker(assigned):
+        try:
+            replay_partitions(kafka_pool, Session, assigned, ranges, batch_rows, progress, stop)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+            logger.error(f"Backfill of partitions {assigned} failed: {e}")
+
+    groups = assign_by_lag(ranges, workers)
+    with relaxed_durability(engine) if relax else nullcontext():
+        threads = [threading.Thread(target=worker, args=(assigned,), name=f"backfill-{i}")
+                   for i, assigned in enumerate(groups)]
+        for t in threads:
+            t.start()
+        logger.info(f"Backfill started with {len(threads)} worker(s): {groups}")
+        for t in threads:
+            while t.is_alive():
+                t.join(timeout=progress_s)
+                if t.is_alive():
+                    logger.info(f"Backfill progress: {progress.report()}")
+
+    # Also after a failure: whatever was written before it must be rolled up again
+    for model, timestamp in progress.earliest.items():
+        if lower_rollup_watermark(engine, model, timestamp):
+            logger.info(f"Lowered the {model.__tablename__} rollup watermark to the hour of {timestamp}")
+
+    summary = progress.summary()
+    if errors:
+        logger.error(f"Backfill stopped early; rerun with the same options to resume. Positions: {summary['next_offsets']}")
+        raise errors[0]
+
+    if commit_group:
+        commit_group_offsets(kafka_pool, group_id, summary['next_offsets'])
+    logger.info(f"Backfill done: {progress.report()}")
+    return summary
+
+
+def commit_group_offsets(kafka_pool, group_id, offsets):
+    """Move the consumer group forward to `offsets` (never backwards)."""
+    consumer = kafka_pool.consumer(group_id=group_id, enable_auto_commit=False)
+    try:
+        commits = {}
+        for partition, offset in offsets.items():
+            tp = TopicPartition(kafka_pool.topic, partition)
+            committed = consumer.committed(tp)
+            if committed is None or committed < offset:
+                commits[tp] = OffsetAndMetadata(offset, 'backfill')
+        if commits:
+            consumer.commit(commits)
+            logger.info(f"Committed {group_id} offsets {({tp.partition: o.offset for tp, o in commits.items()})}")
+    except Exception as e:
+        logger.error(f"Could not commit offsets for group {group_id} (are the storage consumers stopped?): {e}")
+    finally:
+        consumer.close(autocommit=False)
+
+
+def main(argv=None):
+    import json
+    from db_setup import config, db_config
+    from shared.kafka_pool import get_pool
+
+    parser = argparse.ArgumentParser(description="Replay the events topic into the event tables")
+    start = parser.add_mutually_exclusive_group()
+    start.add_argument('--from-offset', type=int, help="offset to start every partition at")
+    start.add_argument('--from-time', type=datetime.fromisoformat, help="start at the first event produced at or after this time")
+    parser.add_argument('--until-time', type=datetime.fromisoformat, help="default: the end of the topic at startup")
+    parser.add_argument('--partitions', type=lambda s: [int(p) for p in s.split(',')], help="default: all")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch-rows', type=int, default=5000)
+    parser.add_argument('--relax-durability', action='store_true')
+    parser.add_argument('--commit-group', action='store_true',
+                        help="advance the storage consumer group past the replayed range afterwards")
+    parser.add_argument('--progress-s', type=float, default=10)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    kafka_config = config['kafka']
+    # A connection per worker, separate from the live service's pools
+    engine = create_db_engine(db_config, {**db_config.get('write_pool', {}),
+                                          'pool_size': args.workers, 'max_overflow': 0})
+    init_db()
+    summary = run_backfill(
+        get_pool(kafka_config), engine, kafka_config.get('group_id', 'storage'),
+        from_offset=args.from_offset, from_time=args.from_time, until_time=args.until_time,
+        partitions=args.partitions, workers=args.workers, batch_rows=args.batch_rows,
+        relax=args.relax_durability, commit_group=args.commit_group, progress_s=args.progress_s,
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime
+from sqlalchemy import Column, Integer, String, Float, DateTime, Index
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.sql import func
 
@@ -6,6 +6,11 @@ Base = declarative_base()
 
 class SubmitListingEvent(Base):
     __tablename__ = 'listing_events'
+    __table_args__ = (
+        Index('ix_listing_events_timestamp_id', 'timestamp', 'id'),  # range scans + keyset pagination
+        # Idempotent ingestion; includes timestamp because MySQL partitioning needs it in unique keys
+        Index('ux_listing_events_trace_id_timestamp', 'trace_id', 'timestamp', unique=True),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(String(255), nullable=False)  # Added length
     item_id = Column(String(255), nullable=False)  # Added length
@@ -16,6 +21,11 @@ class SubmitListingEvent(Base):
 
 class SubmitTransactionEvent(Base):
     __tablename__ = 'transaction_events'
+    __table_args__ = (
+        Index('ix_transaction_events_timestamp_id', 'timestamp', 'id'),  # range scans + keyset pagination
+        # Idempotent ingestion; includes timestamp because MySQL partitioning needs it in unique keys
+        Index('ux_transaction_events_trace_id_timestamp', 'trace_id', 'timestamp', unique=True),
+    )
     id = Column(Integer, primary_key=True)
     user_id = Column(String(255), nullable=False)  # Added length
     transaction_id = Column(String(255), nullable=False)  # Added length
@@ -23,3 +33,36 @@ class SubmitTransactionEvent(Base):
     timestamp = Column(DateTime, default=func.now(), nullable=False)
     date_created = Column(DateTime, default=func.now(), nullable=False)
     trace_id = Column(String(255), nullable=False)  # Added length
+
+
+class ListingRollupHourly(Base):
+    """Pre-aggregated price stats per hour, maintained by the rollup job in partitions.py."""
+    __tablename__ = 'listing_rollups_hourly'
+    bucket = Column(String(19), primary_key=True)  # "YYYY-MM-DDTHH:00:00"
+    count = Column(Integer, nullable=False)
+    sum = Column(Float, nullable=False)
+    sum_sq = Column(Float, nullable=False)
+    min = Column(Float)
+    max = Column(Float)
+
+class TransactionRollupHourly(Base):
+    """Pre-aggregated amount stats per hour, maintained by the rollup job in partitions.py."""
+    __tablename__ = 'transaction_rollups_hourly'
+    bucket = Column(String(19), primary_key=True)  # "YYYY-MM-DDTHH:00:00"
+    count = Column(Integer, nullable=False)
+    sum = Column(Float, nullable=False)
+    sum_sq = Column(Float, nullable=False)
+    min = Column(Float)
+    max = Column(Float)
+
+class RollupState(Base):
+    """Hours before rolled_up_until are complete in the rollup table."""
+    __tablename__ = 'rollup_state'
+    table_name = Column(String(64), primary_key=True)
+    rolled_up_until = Column(DateTime, nullable=False)
+
+class RollupDirty(Base):
+    """Hours before the watermark that received events after they were rolled up, until recomputed."""
+    __tablename__ = 'rollup_dirty'
+    table_name = Column(String(64), primary_key=True)
+    bucket = Column(String(19), primary_key=True)  # "YYYY-MM-DDTHH:00:00"
@@ -1,25 +1,73 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, insert
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker, scoped_session
 from db_class import Base
+import logging
+import os
 import yaml
 
-# Load the configuration from app_conf.yml
-with open("/app/config/storage/storage_conf.yaml", "r") as config_file:
+# Load the configuration from app_conf.yml (APP_CONFIG_DIR overrides /app/config, e.g. in tests)
+CONFIG_DIR = os.path.join(os.environ.get('APP_CONFIG_DIR', '/app/config'), 'storage')
+with open(os.path.join(CONFIG_DIR, "storage_conf.yaml"), "r") as config_file:
     config = yaml.safe_load(config_file)
 
-# Database connection string from the YAML configuration
 db_config = config["datastore"]
-DATABASE_URL = f"mysql+pymysql://{db_config['user']}:{db_config['password']}@{db_config['hostname']}:{db_config['port']}/{db_config['db']}"
 
-# Create engine
-engine = create_engine(DATABASE_URL, echo=True)
+def database_url(db_config):
+    """Connection string from the YAML configuration (`url` overrides the MySQL fields)."""
+    if 'url' in db_config:
+        return db_config['url']
+    return f"mysql+pymysql://{db_config['user']}:{db_config['password']}@{db_config['hostname']}:{db_config['port']}/{db_config['db']}"
 
-# Create tables (if they don't exist)
-Base.metadata.create_all(engine)
+def create_db_engine(db_config, pool_config):
+    url = database_url(db_config)
+    options = {'echo': pool_config.get('echo', False)}
+    if not url.startswith('sqlite'):
+        options.update(
+            pool_size=pool_config.get('pool_size', 10),
+            max_overflow=pool_config.get('max_overflow', 10),
+            pool_timeout=pool_config.get('pool_timeout', 30),
+            pool_recycle=pool_config.get('pool_recycle', 3600),  # below MySQL's wait_timeout
+            pool_pre_ping=pool_config.get('pool_pre_ping', True),
+        )
+    return create_engine(url, **options)
 
-# Set up session (scoped session to handle multiple requests properly)
-Session = scoped_session(sessionmaker(bind=engine))
+# Write path (Kafka consumer) and read path (API) get separate pools, so heavy
+# range queries cannot take every connection away from ingestion. Reads can be
+# routed to a replica by setting datastore.read_replica (hostname, port, ...).
+write_engine = create_db_engine(db_config, db_config.get('write_pool', {}))
+read_engine = create_db_engine({**db_config, **db_config.get('read_replica', {})}, db_config.get('read_pool', {}))
+
+# Kept for database.py and other scripts that only need one engine
+engine = write_engine
+
+# Set up sessions (scoped sessions to handle multiple threads properly)
+Session = scoped_session(sessionmaker(bind=write_engine))
+ReadSession = scoped_session(sessionmaker(bind=read_engine))
+
+def init_db():
+    """Create tables and any missing indexes. Called at startup, not on import."""
+    Base.metadata.create_all(write_engine)
+    # create_all skips tables that already exist, so add indexes introduced later
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(write_engine, checkfirst=True)
+            except Exception as e:
+                logging.getLogger('basicLogger').error(f"Could not create index {index.name}: {e}")
+
+def insert_ignore(model, dialect):
+    """INSERT that skips rows whose (trace_id, timestamp) is already stored."""
+    if dialect == 'mysql':
+        return mysql_insert(model).on_duplicate_key_update(id=model.id)  # no-op update
+    if dialect == 'sqlite':
+        return sqlite_insert(model).on_conflict_do_nothing()
+    return insert(model)
 
 # Use this instead of `session = Session()`
 def get_session():
     return Session()
+
+def get_read_session():
+    return ReadSession()
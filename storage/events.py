@@ -0,0 +1,120 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from shared import wire_format
+
+
+class InvalidEvent(ValueError):
+    """Raised when a Kafka message cannot be decoded into an event record."""
+
+
+def _require(payload, field):
+    value = payload.get(field)
+    if value is None or value == "":
+        raise InvalidEvent(f"Missing '{field}' field")
+    return value
+
+
+def _number(payload, field):
+    value = _require(payload, field)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise InvalidEvent(f"Field '{field}' must be a number")
+    return float(value)
+
+
+def _timestamp(payload):
+    try:
+        timestamp = datetime.fromisoformat(_require(payload, 'timestamp'))
+    except (TypeError, ValueError):
+        raise InvalidEvent("Invalid timestamp format")
+    # The DateTime columns are naive; store everything as UTC
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+@dataclass(slots=True)
+class ListingEvent:
+    trace_id: str
+    user_id: str
+    item_id: str
+    price: float
+    timestamp: datetime
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(
+            trace_id=str(_require(payload, 'trace_id')),
+            user_id=str(_require(payload, 'user_id')),
+            item_id=str(_require(payload, 'item_id')),
+            price=_number(payload, 'price'),
+            timestamp=_timestamp(payload)
+        )
+
+    def as_row(self):
+        return {
+            'trace_id': self.trace_id,
+            'user_id': self.user_id,
+            'item_id': self.item_id,
+            'price': self.price,
+            'timestamp': self.timestamp
+        }
+
+
+@dataclass(slots=True)
+class TransactionEvent:
+    trace_id: str
+    user_id: str
+    transaction_id: str
+    amount: float
+    timestamp: datetime
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(
+            trace_id=str(_require(payload, 'trace_id')),
+            user_id=str(_require(payload, 'user_id')),
+            transaction_id=str(_require(payload, 'transaction_id')),
+            amount=_number(payload, 'amount'),
+            timestamp=_timestamp(payload)
+        )
+
+    def as_row(self):
+        return {
+            'trace_id': self.trace_id,
+            'user_id': self.user_id,
+            'transaction_id': self.transaction_id,
+            'amount': self.amount,
+            'timestamp': self.timestamp
+        }
+
+
+# Envelope "type" written by the receiver -> record class
+EVENT_TYPES = {
+    'listing_event': ListingEvent,
+    'transaction_event': TransactionEvent,
+}
+
+
+def decode_event(raw):
+    """Decode a raw Kafka message value into a ListingEvent or TransactionEvent.
+
+    Accepts the binary wire format and legacy JSON. Raises InvalidEvent if
+    the message cannot be decoded, has an unknown type or its payload is
+    missing required fields.
+    """
+    try:
+        data = wire_format.decode(raw)
+    except ValueError as e:
+        raise InvalidEvent(f"Malformed message: {e}")
+    if not isinstance(data, dict):
+        raise InvalidEvent("Event must be a JSON object")
+
+    event_class = EVENT_TYPES.get(data.get('type'))
+    if event_class is None:
+        raise InvalidEvent(f"Unknown event type: {data.get('type')!r}")
+
+    payload = data.get('payload')
+    if not isinstance(payload, dict):
+        raise InvalidEvent("Missing 'payload' object")
+    return event_class.from_payload(payload)
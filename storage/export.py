@@ -0,0 +1,212 @@
+"""Columnar export of the event tables.
+
+Parquet job: python export.py [--table listing_events] [--directory DIR]
+(also run periodically by app.py when export.enabled is set). Rows are read
+in id order in chunks of `chunk_rows` and written as
+
+    <directory>/<table>/date=YYYY-MM-DD/part-<first id>-<last id>.parquet
+
+partitioned by event date. The last exported id is saved after every chunk,
+so an interrupted export resumes where it stopped and every run only
+exports rows added since the previous one (late events included, since ids
+only grow). File names are derived from the ids, so re-exporting a chunk
+after a crash overwrites the same files.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import Float, Integer, String, DateTime, select, func
+
+from db_class import SubmitListingEvent, SubmitTransactionEvent
+
+# pyarrow is imported on first use; it would add ~150 ms to every service start
+pa = pc = pq = None
+
+logger = logging.getLogger('basicLogger')
+
+MODELS = {model.__tablename__: model for model in (SubmitListingEvent, SubmitTransactionEvent)}
+
+ARROW_STREAM_MIMETYPE = 'application/vnd.apache.arrow.stream'
+
+
+def available():
+    """Import pyarrow if that has not happened yet; False if it is not installed."""
+    global pa, pc, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.compute
+            import pyarrow.parquet
+        except ImportError:
+            return False
+        pa, pc, pq = pyarrow, pyarrow.compute, pyarrow.parquet
+    return True
+
+
+def _require_pyarrow():
+    if not available():
+        raise RuntimeError("Exporting events requires the pyarrow package")
+
+
+def arrow_schema(model):
+    """Arrow schema for all columns of an event table, in table order."""
+    _require_pyarrow()
+    types = ((Integer, pa.int64()), (Float, pa.float64()), (DateTime, pa.timestamp('us')), (String, pa.string()))
+    fields = []
+    for column in model.__table__.columns:
+        arrow_type = next(t for sql_type, t in types if isinstance(column.type, sql_type))
+        fields.append(pa.field(column.key, arrow_type, nullable=column.nullable))
+    return pa.schema(fields)
+
+
+def rows_to_batch(rows, schema):
+    columns = list(zip(*rows)) if rows else [() for _ in schema]
+    return pa.RecordBatch.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                                      schema=schema)
+
+
+def iter_batches(session, model, chunk_rows, after_id=0, until_id=None, start=None, end=None):
+    """Yield Arrow record batches of up to chunk_rows rows with id > after_id, in id order.
+
+    Rows come from a server-side cursor, so memory stays bounded by one chunk.
+    """
+    schema = arrow_schema(model)
+    stmt = select(*model.__table__.columns).where(model.id > after_id)
+    if until_id is not None:
+        stmt = stmt.where(model.id <= until_id)
+    if start is not None:
+        stmt = stmt.where(model.timestamp >= start)
+    if end is not None:
+        stmt = stmt.where(model.timestamp < end)
+    result = session.execute(stmt.order_by(model.id).execution_options(yield_per=chunk_rows))
+    for rows in result.partitions(chunk_rows):
+        yield rows_to_batch(rows, schema)
+
+
+def arrow_stream(batches, schema):
+    """Serialize record batches as an Arrow IPC stream, yielding bytes as each batch is written."""
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()  # end-of-stream marker
+
+
+# --- Parquet export ---------------------------------------------------------------
+
+def _state_path(directory, table):
+    return os.path.join(directory, table, '_export_state.json')
+
+
+def load_state(directory, table):
+    try:
+        with open(_state_path(directory, table), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'last_id': 0, 'rows': 0}
+
+
+def save_state(directory, table, state):
+    path = _state_path(directory, table)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_partitioned(batch, directory, table, compression):
+    """Write one chunk as one Parquet file per event date. Returns the files written."""
+    dates = batch.column('timestamp').cast(pa.date32())
+    files = []
+    for day in dates.unique().to_pylist():
+        rows = batch.filter(pc.equal(dates, pa.scalar(day, pa.date32())))
+        ids = rows.column('id')
+        partition_dir = os.path.join(directory, table, f"date={day.isoformat()}")
+        os.makedirs(partition_dir, exist_ok=True)
+        path = os.path.join(partition_dir, f"part-{pc.min(ids).as_py():012d}-{pc.max(ids).as_py():012d}.parquet")
+        tmp_path = f"{path}.tmp"
+        pq.write_table(pa.Table.from_batches([rows]), tmp_path, compression=compression)
+        os.replace(tmp_path, path)
+        files.append(path)
+    return files
+
+
+def export_table(engine, table, directory, chunk_rows=250000, compression='zstd', settle_s=5):
+    """Export the rows of `table` added since the last export. Returns the number of rows written.
+
+    Ids are allocated before commit, so with concurrent writers a lower id can
+    become visible after a higher one. The export therefore stops at the
+    highest id that existed `settle_s` seconds before it started reading.
+    """
+    _require_pyarrow()
+    model = MODELS[table]
+    state = load_state(directory, table)
+    with engine.connect() as connection:
+        until_id = connection.execute(select(func.max(model.id))).scalar()
+    if until_id is None or until_id <= state['last_id']:
+        return 0
+    time.sleep(settle_s)
+
+    exported = 0
+    started = time.monotonic()
+    with engine.connect() as connection:
+        for batch in iter_batches(connection, model, chunk_rows, after_id=state['last_id'], until_id=until_id):
+            files = write_partitioned(batch, directory, table, compression)
+            exported += batch.num_rows
+            state = {
+                'last_id': pc.max(batch.column('id')).as_py(),
+                'rows': state['rows'] + batch.num_rows,
+                'updated': datetime.now(timezone.utc).isoformat(),
+            }
+            save_state(directory, table, state)
+            logger.info(f"Exported {batch.num_rows} rows of {table} into {len(files)} file(s), up to id {state['last_id']}")
+    elapsed = time.monotonic() - started
+    logger.info(f"Export of {table} done: {exported} rows in {elapsed:.1f} s")
+    return exported
+
+
+def run_export(engine, export_config):
+    """One pass of the export job over both event tables."""
+    exported = {}
+    for table in MODELS:
+        try:
+            exported[table] = export_table(
+                engine, table, export_config.get('directory', 'exports'),
+                chunk_rows=export_config.get('chunk_rows', 250000),
+                compression=export_config.get('compression', 'zstd'),
+                settle_s=export_config.get('settle_s', 5),
+            )
+        except Exception as e:
+            logger.error(f"Export of {table} failed: {e}")
+    return exported
+
+
+def main(argv=None):
+    from db_setup import read_engine, config
+
+    export_config = config.get('export', {})
+    parser = argparse.ArgumentParser(description="Export event tables to date-partitioned Parquet files")
+    parser.add_argument('--table', choices=sorted(MODELS), help="default: both event tables")
+    parser.add_argument('--directory', default=export_config.get('directory', 'exports'))
+    parser.add_argument('--chunk-rows', type=int, default=export_config.get('chunk_rows', 250000))
+    parser.add_argument('--compression', default=export_config.get('compression', 'zstd'))
+    parser.add_argument('--settle-s', type=float, default=export_config.get('settle_s', 5))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    for table in [args.table] if args.table else MODELS:
+        export_table(read_engine, table, args.directory, args.chunk_rows, args.compression, args.settle_s)
+
+
+if __name__ == '__main__':
+    main()
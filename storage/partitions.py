@@ -0,0 +1,278 @@
+import logging
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import text, select, delete, insert, func
+
+from db_class import (SubmitListingEvent, SubmitTransactionEvent, ListingRollupHourly,
+                      TransactionRollupHourly, RollupState, RollupDirty)
+
+logger = logging.getLogger('basicLogger')
+
+# event model -> (value column, hourly rollup model)
+ROLLUPS = {
+    SubmitListingEvent: (SubmitListingEvent.price, ListingRollupHourly),
+    SubmitTransactionEvent: (SubmitTransactionEvent.amount, TransactionRollupHourly),
+}
+
+HOUR_FORMAT = '%Y-%m-%dT%H:00:00'
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def hour_of(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def bucket_expression(column, bucket, dialect):
+    """SQL expression truncating a timestamp to the start of its minute/hour bucket."""
+    if dialect == 'sqlite':
+        fmt = '%Y-%m-%dT%H:%M:00' if bucket == 'minute' else HOUR_FORMAT
+        return func.strftime(fmt, column)
+    fmt = '%Y-%m-%dT%H:%i:00' if bucket == 'minute' else HOUR_FORMAT
+    return func.date_format(column, fmt)
+
+
+# --- MySQL RANGE partitioning --------------------------------------------------
+
+def _to_days(day):
+    """Python equivalent of MySQL TO_DAYS()."""
+    return day.toordinal() + 365
+
+
+def _next_boundary(day, granularity):
+    if granularity == 'monthly':
+        return date(day.year + (day.month == 12), day.month % 12 + 1, 1)
+    return day + timedelta(days=1)
+
+
+def _partition_name(lower, granularity):
+    return f"p{lower:%Y%m}" if granularity == 'monthly' else f"p{lower:%Y%m%d}"
+
+
+def _period_start(day, granularity):
+    return day.replace(day=1) if granularity == 'monthly' else day
+
+
+def list_partitions(connection, table):
+    """[(name, upper bound as date or None for MAXVALUE)] in order, or [] if not partitioned."""
+    rows = connection.execute(text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {'table': table}).all()
+    if not rows or rows[0][0] is None:
+        return []
+    return [(name, None if bound == 'MAXVALUE' else date.fromordinal(int(bound) - 365)) for name, bound in rows]
+
+
+def ensure_partitioning(engine, table, granularity, lookahead):
+    """Partition `table` by RANGE on TO_DAYS(timestamp) and keep `lookahead` future partitions.
+
+    MySQL requires the partitioning column in every unique key, so the
+    primary key becomes (id, timestamp) when the table is first partitioned.
+    All existing rows go into the first partition.
+    """
+    today = _period_start(utcnow().date(), granularity)
+    target = today
+    for _ in range(lookahead + 1):
+        target = _next_boundary(target, granularity)
+
+    with engine.begin() as connection:
+        partitions = list_partitions(connection, table)
+        if not partitions:
+            logger.info(f"Partitioning {table} by {granularity} range on timestamp")
+            connection.execute(text(f"ALTER TABLE {table} DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)"))
+            definitions = [f"PARTITION p_before VALUES LESS THAN ({_to_days(today)})"]
+            lower = today
+            while lower < target:
+                upper = _next_boundary(lower, granularity)
+                definitions.append(f"PARTITION {_partition_name(lower, granularity)} VALUES LESS THAN ({_to_days(upper)})")
+                lower = upper
+            definitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+            connection.execute(text(f"ALTER TABLE {table} PARTITION BY RANGE (TO_DAYS(timestamp)) ({', '.join(definitions)})"))
+            return
+
+        bounds = [bound for _, bound in partitions if bound is not None]
+        lower = max(bounds) if bounds else today
+        while lower < target:
+            upper = _next_boundary(lower, granularity)
+            logger.info(f"Adding partition {_partition_name(lower, granularity)} to {table}")
+            connection.execute(text(
+                f"ALTER TABLE {table} REORGANIZE PARTITION pmax INTO ("
+                f"PARTITION {_partition_name(lower, granularity)} VALUES LESS THAN ({_to_days(upper)}), "
+                f"PARTITION pmax VALUES LESS THAN MAXVALUE)"
+            ))
+            lower = upper
+
+
+# --- Retention -----------------------------------------------------------------
+
+def expire_events(engine, model, retention_days, archive):
+    """Drop (or archive, then drop) events older than retention_days, with their hourly rollups.
+
+    On MySQL whole partitions are dropped once their upper bound is past
+    the cutoff, which is instant regardless of size. Other databases (SQLite
+    in tests) delete the rows instead.
+    """
+    table = model.__tablename__
+    cutoff = utcnow() - timedelta(days=retention_days)
+    archive_table = f"{table}_archive"
+
+    with engine.begin() as connection:
+        if archive:
+            connection.execute(text(f"CREATE TABLE IF NOT EXISTS {archive_table} AS SELECT * FROM {table} WHERE 1 = 0"))
+
+        if engine.dialect.name != 'mysql':
+            if archive:
+                connection.execute(text(f"INSERT INTO {archive_table} SELECT * FROM {table} WHERE timestamp < :cutoff"),
+                                   {'cutoff': cutoff})
+            result = connection.execute(text(f"DELETE FROM {table} WHERE timestamp < :cutoff"), {'cutoff': cutoff})
+            if result.rowcount:
+                logger.info(f"Expired {result.rowcount} rows from {table}")
+                # The hour holding the cutoff lost only some of its rows
+                expire_rollups(connection, model, hour_of(cutoff))
+                mark_late_hours(connection, model, [cutoff], engine.dialect.name)
+            return
+
+        expired_until = None
+        for name, bound in list_partitions(connection, table):
+            if bound is None or bound > cutoff.date():
+                continue
+            if archive:
+                connection.execute(text(f"INSERT INTO {archive_table} SELECT * FROM {table} PARTITION ({name})"))
+            connection.execute(text(f"ALTER TABLE {table} DROP PARTITION {name}"))
+            logger.info(f"{'Archived and dropped' if archive else 'Dropped'} partition {name} of {table}")
+            expired_until = datetime.combine(bound, datetime.min.time())
+        if expired_until is not None:
+            expire_rollups(connection, model, expired_until)
+
+
+def expire_rollups(connection, model, until):
+    """Delete the rollup rows and dirty marks of the hours before `until`, whose events are gone."""
+    rollup = ROLLUPS[model][1]
+    connection.execute(delete(rollup).where(rollup.bucket < until.strftime(HOUR_FORMAT)))
+    connection.execute(delete(RollupDirty).where(RollupDirty.table_name == model.__tablename__,
+                                                 RollupDirty.bucket < until.strftime(HOUR_FORMAT)))
+
+
+# --- Hourly rollups ------------------------------------------------------------
+
+def mark_late_hours(connection, model, timestamps, dialect):
+    """Flag the already rolled-up hours that `timestamps` fall in, so they are recomputed.
+
+    Called in the transaction that stores the events; until the rollup job
+    has recomputed a flagged hour, stats queries read it from the events.
+    """
+    watermark = rolled_up_until(connection, model)
+    if watermark is None:
+        return
+    hours = sorted({hour_of(timestamp) for timestamp in timestamps if timestamp < watermark})
+    if not hours:
+        return
+    statement = insert(RollupDirty).prefix_with('OR IGNORE' if dialect == 'sqlite' else 'IGNORE')
+    connection.execute(statement, [{'table_name': model.__tablename__, 'bucket': hour.strftime(HOUR_FORMAT)}
+                                   for hour in hours])
+
+
+def dirty_hours(session, model, first_hour, last_hour):
+    """Buckets in [first_hour, last_hour) whose rollup rows are stale."""
+    return set(session.execute(select(RollupDirty.bucket).where(
+        RollupDirty.table_name == model.__tablename__,
+        RollupDirty.bucket >= first_hour.strftime(HOUR_FORMAT),
+        RollupDirty.bucket < last_hour.strftime(HOUR_FORMAT))).scalars())
+
+
+def _recompute(connection, model, since, until):
+    """Replace the rollup rows of [since, until) with aggregates of the events."""
+    value_column, rollup = ROLLUPS[model]
+    bucket = bucket_expression(model.timestamp, 'hour', connection.dialect.name)
+    connection.execute(delete(rollup).where(
+        rollup.bucket >= since.strftime(HOUR_FORMAT), rollup.bucket < until.strftime(HOUR_FORMAT)))
+    connection.execute(insert(rollup).from_select(
+        ['bucket', 'count', 'sum', 'sum_sq', 'min', 'max'],
+        select(
+            bucket,
+            func.count(model.id),
+            func.sum(value_column),
+            func.sum(value_column * value_column),
+            func.min(value_column),
+            func.max(value_column),
+        ).where(model.timestamp >= since, model.timestamp < until).group_by(bucket)
+    ))
+
+
+def refresh_rollups(engine, model, lookback_hours):
+    """Recompute the hourly rollups of closed hours since the watermark, and of flagged late hours.
+
+    The last `lookback_hours` hours before the watermark are recomputed too,
+    so events that arrive a little late are rolled up without being flagged
+    one hour at a time.
+    """
+    table = model.__tablename__
+    until = hour_of(utcnow())  # only closed hours
+
+    with engine.begin() as connection:
+        # Take the flags first: an event stored after this point flags its hour again
+        dirty = sorted(connection.execute(select(RollupDirty.bucket).where(RollupDirty.table_name == table)).scalars())
+        if dirty:
+            connection.execute(delete(RollupDirty).where(RollupDirty.table_name == table,
+                                                         RollupDirty.bucket.in_(dirty)))
+            for bucket in dirty:
+                hour = datetime.strptime(bucket, HOUR_FORMAT)
+                _recompute(connection, model, hour, hour + timedelta(hours=1))
+            logger.info(f"Recomputed {len(dirty)} late hour(s) of {table}")
+
+    with engine.begin() as connection:
+        state = connection.execute(select(RollupState.rolled_up_until).where(RollupState.table_name == table)).scalar()
+        if state is None:
+            first = connection.execute(select(func.min(model.timestamp))).scalar()
+            if first is None:
+                return
+            since = hour_of(first)
+        else:
+            since = min(state, until) - timedelta(hours=lookback_hours)
+        if since >= until:
+            return
+
+        _recompute(connection, model, since, until)
+        if state is None:
+            connection.execute(insert(RollupState).values(table_name=table, rolled_up_until=until))
+        else:
+            connection.execute(RollupState.__table__.update()
+                               .where(RollupState.table_name == table).values(rolled_up_until=until))
+    logger.debug(f"Rolled up {table} from {since} to {until}")
+
+
+def lower_rollup_watermark(engine, model, timestamp):
+    """Move the watermark back to the hour of `timestamp`, so refresh_rollups() recomputes from there.
+
+    Returns True if it was lowered.
+    """
+    with engine.begin() as connection:
+        result = connection.execute(RollupState.__table__.update().where(
+            RollupState.table_name == model.__tablename__,
+            RollupState.rolled_up_until > hour_of(timestamp)
+        ).values(rolled_up_until=hour_of(timestamp)))
+    return result.rowcount > 0
+
+
+def rolled_up_until(session, model):
+    return session.execute(
+        select(RollupState.rolled_up_until).where(RollupState.table_name == model.__tablename__)).scalar()
+
+
+def run_maintenance(engine, partition_config):
+    """One pass of the background job: partitions, retention and rollups."""
+    for model in ROLLUPS:
+        table = model.__tablename__
+        try:
+            if engine.dialect.name == 'mysql' and partition_config.get('enabled', True):
+                ensure_partitioning(engine, table, partition_config.get('granularity', 'daily'),
+                                    partition_config.get('lookahead', 3))
+            retention_days = partition_config.get('retention_days')
+            if retention_days:
+                expire_events(engine, model, retention_days, partition_config.get('expired', 'drop') == 'archive')
+            refresh_rollups(engine, model, partition_config.get('rollup_lookback_hours', 2))
+        except Exception as e:
+            logger.error(f"Maintenance of {table} failed: {e}")
@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+
+import pytest
+import yaml
+from sqlalchemy import create_engine
+
+STORAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.dirname(STORAGE_DIR)
+
+sys.path.append(REPO_ROOT)
+
+
+def write_test_config():
+    """The repo's storage config under a temporary APP_CONFIG_DIR, on SQLite and with the log kept in it."""
+    root = tempfile.mkdtemp(prefix='storage-config-')
+    os.makedirs(os.path.join(root, 'storage'))
+    source = os.path.join(REPO_ROOT, 'config', 'storage')
+    with open(os.path.join(source, 'storage_conf.yaml')) as f:
+        config = yaml.safe_load(f)
+    config['datastore']['url'] = f"sqlite:///{os.path.join(root, 'storage.db')}"
+    config['kafka'].update(hostname='127.0.0.1', port=9)  # nothing listens there
+    with open(os.path.join(root, 'storage', 'storage_conf.yaml'), 'w') as f:
+        yaml.safe_dump(config, f)
+    with open(os.path.join(source, 'storage_log_conf.yml')) as f:
+        log_config = yaml.safe_load(f)
+    log_config['handlers']['file']['filename'] = os.path.join(root, 'app.log')
+    with open(os.path.join(root, 'storage', 'storage_log_conf.yml'), 'w') as f:
+        yaml.safe_dump(log_config, f)
+    return root
+
+
+CONFIG_ROOT = write_test_config()
+
+
+def pytest_pycollect_makemodule(module_path, parent):
+    """Import this service's app.py and config in its tests; every service has a flat app.py."""
+    if not getattr(sys.modules.get('app'), '__file__', '').startswith(STORAGE_DIR):
+        sys.modules.pop('app', None)
+        if STORAGE_DIR in sys.path:
+            sys.path.remove(STORAGE_DIR)
+        sys.path.insert(0, STORAGE_DIR)
+    os.environ['APP_CONFIG_DIR'] = CONFIG_ROOT
+
+
+@pytest.fixture
+def bind_sessions():
+    """Point storage's write and read sessions at another engine."""
+    import db_setup
+
+    def bind(engine):
+        for session in (db_setup.Session, db_setup.ReadSession):
+            session.remove()
+            session.configure(bind=engine)
+    return bind
+
+
+@pytest.fixture
+def engine(tmp_path, bind_sessions):
+    """A fresh SQLite database behind storage's write and read sessions."""
+    import db_setup
+    from db_class import Base
+    engine = create_engine(f"sqlite:///{tmp_path / 'events.db'}")
+    Base.metadata.create_all(engine)
+    bind_sessions(engine)
+    yield engine
+    db_setup.Session.remove()
+    db_setup.ReadSession.remove()
+    db_setup.Session.configure(bind=db_setup.write_engine)
+    db_setup.ReadSession.configure(bind=db_setup.read_engine)
@@ -0,0 +1,42 @@
+"""A batch the database keeps rejecting is isolated down to the offending events."""
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine, func, select
+
+import app as storage
+from db_class import SubmitListingEvent
+from events import ListingEvent
+
+
+def pair(user_id='u1'):
+    event = ListingEvent(trace_id=str(uuid.uuid4()), user_id=user_id, item_id='i1', price=1.0,
+                         timestamp=datetime(2026, 1, 1, 12))
+    return event, SimpleNamespace(topic='events', partition=0, offset=0, value=b'')
+
+
+def dead_letters(monkeypatch):
+    sent = []
+    monkeypatch.setattr(storage, 'send_to_dead_letter', lambda message, reason: sent.append(reason))
+    return sent
+
+
+def test_rejected_event_is_dead_lettered_and_the_rest_stored(engine, monkeypatch):
+    sent = dead_letters(monkeypatch)
+    events = [pair() for _ in range(6)] + [pair(user_id=None)] + [pair() for _ in range(5)]
+
+    assert not storage.write_batch(*storage.split_events(events))
+    assert storage.write_isolating(events)
+
+    assert len(sent) == 1
+    with engine.connect() as connection:
+        assert connection.execute(select(func.count()).select_from(SubmitListingEvent)).scalar() == 11
+
+
+def test_unreachable_database_is_not_dead_lettered(tmp_path, engine, bind_sessions, monkeypatch):
+    sent = dead_letters(monkeypatch)
+    bind_sessions(create_engine(f"sqlite:///{tmp_path / 'missing' / 'events.db'}"))
+
+    assert not storage.write_isolating([pair() for _ in range(4)])
+    assert sent == []
@@ -0,0 +1,63 @@
+"""Stats served from the hourly rollups must match the stats computed from the events."""
+import uuid
+from datetime import timedelta
+
+import pytest
+
+import app as storage
+import partitions
+from db_class import SubmitListingEvent
+from events import ListingEvent
+
+
+def store(*timestamps, price=10.0):
+    events = [ListingEvent(trace_id=str(uuid.uuid4()), user_id='u1', item_id='i1', price=price, timestamp=timestamp)
+              for timestamp in timestamps]
+    assert storage.write_batch(events, [])
+
+
+def stats(start, end, bucket=None):
+    """(rollup path, raw path) results for [start, end)."""
+    client = storage.app.app.test_client()
+    query = {'start_timestamp': f"{start.isoformat()}Z", 'end_timestamp': f"{end.isoformat()}Z"}
+    rolled_up = client.get('/events/listings/stats', query_string=query).get_json()
+    raw = client.get('/events/listings/stats', query_string={**query, 'bucket': 'minute'}).get_json()
+    return rolled_up, {'count': sum(b['count'] for b in raw), 'sum': sum(b['sum'] for b in raw)}
+
+
+def assert_paths_agree(start, end, count):
+    rolled_up, raw = stats(start, end)
+    assert rolled_up['count'] == raw['count'] == count
+    assert rolled_up['sum'] == pytest.approx(raw['sum'])
+
+
+def test_late_event_in_rolled_up_hour(engine):
+    now_hour = partitions.hour_of(partitions.utcnow())
+    old_hour = now_hour - timedelta(hours=6)  # outside the lookback window
+    store(*(old_hour + timedelta(minutes=minute) for minute in range(0, 60, 3)))
+    store(*(old_hour + timedelta(hours=1, minutes=minute) for minute in range(0, 60, 3)))
+    partitions.refresh_rollups(engine, SubmitListingEvent, lookback_hours=2)
+    start, end = old_hour - timedelta(hours=1), now_hour
+    assert_paths_agree(start, end, 40)
+
+    store(old_hour + timedelta(minutes=30), price=1000.0)
+    assert_paths_agree(start, end, 41)  # served from the events until recomputed
+
+    partitions.refresh_rollups(engine, SubmitListingEvent, lookback_hours=2)
+    with engine.connect() as connection:
+        assert not partitions.dirty_hours(connection, SubmitListingEvent, start, end)
+    assert_paths_agree(start, end, 41)
+
+
+def test_expired_events_leave_no_rollups(engine):
+    cutoff = partitions.utcnow() - timedelta(days=2)
+    store(*(cutoff - timedelta(minutes=minute) for minute in range(1, 180, 7)))
+    store(*(cutoff + timedelta(minutes=minute) for minute in range(1, 120, 7)))
+    partitions.refresh_rollups(engine, SubmitListingEvent, lookback_hours=2)
+
+    partitions.expire_events(engine, SubmitListingEvent, retention_days=2, archive=False)
+    start = partitions.hour_of(cutoff) - timedelta(hours=4)
+    assert_paths_agree(start, partitions.hour_of(partitions.utcnow()), len(range(1, 120, 7)))
+
+    partitions.refresh_rollups(engine, SubmitListingEvent, lookback_hours=2)
+    assert_paths_agree(start, partitions.hour_of(partitions.utcnow()), len(range(1, 120, 7)))